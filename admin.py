@@ -1,13 +1,27 @@
 import telebot
 from psycopg2._psycopg import Error
 from telebot import types
-from config import API_TOKEN, ADMIN_IDS, PHOTOS_DIR
-from database import insert_product, insert_category, get_all_categories, connect_to_db, delete_product_by_id
-import os
+from config import API_TOKEN, ADMIN_IDS, BROADCAST_PAGE_SIZE
+from database import insert_product, insert_category, delete_product_by_id
+from repository import get_categories
+from fsm import machine
+from catalog_cache import catalog
+from media import send_product_photo
+from broadcast import Broadcaster, product_broadcast_caption, product_broadcast_markup
+from catalog_import import import_archive, CatalogImportError
+from images import pipeline as image_pipeline, format_size
+from functools import partial
+import io
+import logging
+import zipfile
+from decimal import Decimal, InvalidOperation
 
 # --------------------------------------------------------------------------------------------------------
 
-bot = telebot.TeleBot(API_TOKEN)
+# Апдейты раздаются воркерам через dispatcher.py, поэтому встроенный пул потоков TeleBot не используется
+bot = telebot.TeleBot(API_TOKEN, threaded=False)
+machine.attach(bot)
+broadcaster = Broadcaster(bot, BROADCAST_PAGE_SIZE)
 
 # --------------------------------------------------------------------------------------------------------
 
@@ -17,14 +31,15 @@ bot = telebot.TeleBot(API_TOKEN)
 def add_category(message):
     if str(message.from_user.id) in ADMIN_IDS:
         bot.send_message(message.chat.id, "Введите название новой категории:")
-        bot.register_next_step_handler(message, process_category_name)
+        machine.set_state(message.chat.id, 'add_category:name')
     else:
         bot.send_message(message.chat.id, "У вас нет доступа к этой команде.")
 
 
-def process_category_name(message):
-    category_name = message.text.strip()
-    print(f"Trying to insert category: {category_name}")
+@machine.step('add_category:name')
+def process_category_name(message, data):
+    machine.finish(message.chat.id)
+    category_name = (message.text or "").strip()
 
     if insert_category(category_name):
         bot.send_message(message.chat.id, f"Категория '{category_name}' успешно добавлена.")
@@ -43,79 +58,95 @@ def add_product(message):
     if str(message.from_user.id) in ADMIN_IDS:
         bot.send_message(message.chat.id, "Вы вошли в админ панель. Добавьте новый товар.")
         bot.send_message(message.chat.id, "Введите название товара:")
-        bot.register_next_step_handler(message, process_product_name)
+        machine.set_state(message.chat.id, 'add_product:name')
     else:
         bot.send_message(message.chat.id, "У вас нет доступа к этой команде.")
 
 
-def process_product_name(message):
-    product_name = message.text.strip()
+@machine.step('add_product:name')
+def process_product_name(message, data):
+    product_name = (message.text or '').strip()
 
     # Получаем список категорий из базы данных
-    categories = get_all_categories()
+    categories = get_categories()
     if categories:
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
         for category in categories:
-            markup.add(types.KeyboardButton(category[1]))
+            markup.add(types.KeyboardButton(category.name))
         bot.send_message(message.chat.id, "Выберите категорию товара:", reply_markup=markup)
-        bot.register_next_step_handler(message, lambda m: process_category_selection(m, product_name, categories))
+        machine.set_state(message.chat.id, 'add_product:category', {'product_name': product_name})
     else:
+        machine.finish(message.chat.id)
         bot.send_message(message.chat.id, "Ошибка: Нет доступных категорий.")
 
 
-def process_category_selection(message, product_name, categories):
-    selected_category = message.text.strip()
+@machine.step('add_product:category')
+def process_category_selection(message, data):
+    selected_category = (message.text or '').strip()
     category_id = None
-    for category in categories:
-        if category[1] == selected_category:
-            category_id = category[0]
+    for category in get_categories() or []:
+        if category.name == selected_category:
+            category_id = category.id
             break
 
     if category_id is not None:
         bot.send_message(message.chat.id, "Введите цену товара:")
-        bot.register_next_step_handler(message, lambda m: process_product_price(m, product_name, category_id))
+        machine.set_state(message.chat.id, 'add_product:price', dict(data, category_id=category_id))
     else:
+        machine.finish(message.chat.id)
         bot.send_message(message.chat.id, "Ошибка при выборе категории. Попробуйте снова.")
 
 
-def process_product_price(message, product_name, category_id):
+@machine.step('add_product:price')
+def process_product_price(message, data):
     try:
-        price = float(message.text.strip())
+        # products.price - NUMERIC(10, 2), цена хранится без округлений float
+        price = Decimal((message.text or '').strip().replace(',', '.'))
+        if not price.is_finite() or price < 0:
+            raise InvalidOperation
         bot.send_message(message.chat.id, "Введите доступные размеры (разделите запятой):", reply_markup=types.ReplyKeyboardRemove())
-        bot.register_next_step_handler(message, lambda m: process_product_sizes(m, product_name, category_id, price))
-    except ValueError:
+        machine.set_state(message.chat.id, 'add_product:sizes', dict(data, price=str(price)))
+    except InvalidOperation:
+        # Состояние не меняется - следующий ответ снова попадёт на этот шаг
         bot.send_message(message.chat.id, "Некорректный формат цены. Попробуйте снова.")
-        bot.register_next_step_handler(message, lambda m: process_product_price(m, product_name, category_id))
 
 
-def process_product_sizes(message, product_name, category_id, price):
-    sizes = [size.strip() for size in message.text.split(',')]
+@machine.step('add_product:sizes')
+def process_product_sizes(message, data):
+    sizes = [size.strip() for size in (message.text or '').split(',')]
     bot.send_message(message.chat.id, "Загрузите фотографию товара:")
-    bot.register_next_step_handler(message, lambda m: process_product_photo(m, product_name, category_id, price, sizes))
+    machine.set_state(message.chat.id, 'add_product:photo', dict(data, sizes=sizes))
 
 
-def process_product_photo(message, product_name, category_id, price, sizes):
-    if message.photo:
-        file_info = bot.get_file(message.photo[-1].file_id)
-        downloaded_file = bot.download_file(file_info.file_path)
-
-        photo_path = os.path.join(PHOTOS_DIR, '')
-        if not os.path.exists(photo_path):
-            os.makedirs(photo_path)
+@machine.step('add_product:photo')
+def process_product_photo(message, data):
+    if not message.photo:
+        # Остаёмся на этом шаге до получения фото
+        bot.send_message(message.chat.id, "Фотография не загружена. Попробуйте снова.")
+        return
 
-        photo_file_path = os.path.join(photo_path, product_name.lower() + '.jpg')
-        with open(photo_file_path, 'wb') as new_file:
-            new_file.write(downloaded_file)
+    machine.finish(message.chat.id)
+    bot.send_message(message.chat.id, "Обрабатываю фотографию...")
+    # Скачивание и пережатие фото идут в пуле images.py, воркер апдейтов сразу освобождается
+    future = image_pipeline.submit_telegram_file(bot, message.photo[-1].file_id)
+    future.add_done_callback(partial(_finish_add_product, message.chat.id, data))
 
-        photo_filename = product_name.lower() + '.jpg'
 
-        # Добавление товара в базу данных
-        if insert_product(product_name, category_id, price, sizes, photo_filename):
-            bot.send_message(message.chat.id, f"Товар '{product_name}' успешно добавлен.")
-        else:
-            bot.send_message(message.chat.id, "Ошибка при добавлении товара в базу данных.")
+def _finish_add_product(chat_id, data, future):
+    product_name = data['product_name']
+    try:
+        stored = future.result()
+    except Exception as e:
+        logging.error("Failed to process photo for product %r: %s", product_name, e)
+        bot.send_message(chat_id, "Не удалось обработать фотографию. Попробуйте добавить товар снова.")
+        return
+
+    # Добавление товара в базу данных
+    if insert_product(product_name, data['category_id'], data['price'], data['sizes'], stored.filename):
+        bot.send_message(chat_id, f"Товар '{product_name}' успешно добавлен.\n\n"
+                                  f"Фото: {format_size(stored.original_bytes)} -> {format_size(stored.stored_bytes)}")
     else:
-        bot.send_message(message.chat.id, "Фотография не загружена. Попробуйте снова.")
+        bot.send_message(chat_id, "Ошибка при добавлении товара в базу данных.")
 
 
 # --------------------------------------------------------------------------------------------------------
@@ -127,17 +158,113 @@ def process_product_photo(message, product_name, category_id, price, sizes):
 def delete_product(message):
     if str(message.chat.id) in ADMIN_IDS:
         bot.send_message(message.chat.id, "Введите ID продукта для удаления:")
-        bot.register_next_step_handler(message, process_delete_product)
+        machine.set_state(message.chat.id, 'delete_product:id')
     else:
         bot.send_message(message.chat.id, "У вас нет доступа к этой команде.")
 
 
-def process_delete_product(message):
+@machine.step('delete_product:id')
+def process_delete_product(message, data):
+    machine.finish(message.chat.id)
     try:
         product_id = int(message.text.strip())
-        delete_product_by_id(product_id)
-        bot.send_message(message.chat.id, f"Продукт с ID {product_id} успешно удален.")
+        if delete_product_by_id(product_id):
+            bot.send_message(message.chat.id, f"Продукт с ID {product_id} успешно удален.")
+        else:
+            bot.send_message(message.chat.id, f"Не удалось удалить продукт с ID {product_id}: "
+                                              f"его нет в каталоге или произошла ошибка базы данных.")
     except Exception as e:
         bot.send_message(message.chat.id, f"Произошла ошибка при удалении продукта: {str(e)}")
 
 
+# --------------------------------------------------------------------------------------------------------
+
+
+# Массовый импорт каталога из zip-архива (см. catalog_import.py)
+@bot.message_handler(commands=['import_catalog'])
+def import_catalog_command(message):
+    if str(message.from_user.id) in ADMIN_IDS:
+        bot.send_message(message.chat.id, "Отправьте zip-архив с manifest.csv (или manifest.json) и фотографиями.\n\n"
+                                          "Колонки манифеста: name, category, price, sizes, photo.\n"
+                                          "Telegram позволяет боту скачать файл до 20 МБ - каталог больше "
+                                          "загружайте через python catalog_import.py.")
+        machine.set_state(message.chat.id, 'import_catalog:file')
+    else:
+        bot.send_message(message.chat.id, "У вас нет доступа к этой команде.")
+
+
+@machine.step('import_catalog:file')
+def process_import_catalog_file(message, data):
+    document = message.document
+    if document is None or not (document.file_name or '').lower().endswith('.zip'):
+        bot.send_message(message.chat.id, "Пожалуйста, отправьте zip-архив.")
+        return
+
+    machine.finish(message.chat.id)
+    bot.send_message(message.chat.id, "Импортирую каталог...")
+    try:
+        file_info = bot.get_file(document.file_id)
+        report = import_archive(io.BytesIO(bot.download_file(file_info.file_path)))
+        bot.send_message(message.chat.id, report)
+    except (CatalogImportError, zipfile.BadZipFile) as e:
+        bot.send_message(message.chat.id, f"Импорт отменён:\n{str(e)}")
+    except Exception as e:
+        logging.exception("Catalog import failed")
+        bot.send_message(message.chat.id, f"Произошла ошибка при импорте каталога: {str(e)}")
+
+
+# --------------------------------------------------------------------------------------------------------
+
+
+# Рассылка всем пользователям
+@bot.message_handler(commands=['broadcast'])
+def broadcast(message):
+    if str(message.from_user.id) in ADMIN_IDS:
+        bot.send_message(message.chat.id, "Отправьте текст рассылки.\n\n"
+                                          "Чтобы разослать карточку товара, отправьте его ID (например: 15).")
+        machine.set_state(message.chat.id, 'broadcast:content')
+    else:
+        bot.send_message(message.chat.id, "У вас нет доступа к этой команде.")
+
+
+@machine.step('broadcast:content')
+def process_broadcast_content(message, data):
+    content = (message.text or '').strip()
+    if not content:
+        bot.send_message(message.chat.id, "Отправьте текст рассылки или ID товара.")
+        return
+
+    # Предпросмотр: администратор получает ровно то, что получат пользователи
+    if content.isdigit():
+        product = catalog.get_product(int(content))
+        if product is None:
+            machine.finish(message.chat.id)
+            bot.send_message(message.chat.id, f"Товар с ID {content} не найден.")
+            return
+        send_product_photo(bot, message.chat.id, product, caption=product_broadcast_caption(product),
+                           parse_mode='HTML', reply_markup=product_broadcast_markup(product))
+        data = {'product_id': product.id}
+    else:
+        bot.send_message(message.chat.id, content)
+        data = {'text': content}
+
+    markup = types.ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
+    markup.add(types.KeyboardButton('Разослать'), types.KeyboardButton('Отмена'))
+    bot.send_message(message.chat.id, "Разослать это сообщение всем пользователям?", reply_markup=markup)
+    machine.set_state(message.chat.id, 'broadcast:confirm', data)
+
+
+@machine.step('broadcast:confirm')
+def process_broadcast_confirm(message, data):
+    machine.finish(message.chat.id)
+    if message.text != 'Разослать':
+        bot.send_message(message.chat.id, "Рассылка отменена.", reply_markup=types.ReplyKeyboardRemove())
+        return
+
+    try:
+        broadcast_id = broadcaster.start(data.get('text'), data.get('product_id'), message.chat.id)
+        bot.send_message(message.chat.id, f"Рассылка #{broadcast_id} запущена. Сообщу, когда она завершится.",
+                         reply_markup=types.ReplyKeyboardRemove())
+    except Exception as e:
+        bot.send_message(message.chat.id, f"Не удалось запустить рассылку: {str(e)}",
+                         reply_markup=types.ReplyKeyboardRemove())
@@ -0,0 +1,325 @@
+import asyncio
+import functools
+import logging
+import os
+import weakref
+
+from telebot import types, util
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+
+import async_database as db
+from catalog_cache import catalog
+from config import API_TOKEN, PHOTOS_DIR, CATALOG_PAGE_SIZE, METRICS_PORT
+from fsm import machine
+from keyboards import parse_page_callback, format_cart, cart_markup, PAGE_CALLBACK_PREFIX
+from media import is_rejected_file_id, product_photo_steps
+from metrics import instrument_async_bot_api
+from navigation import run_steps_async, show_text_steps, show_markup_steps
+from outbound import scheduler
+from user_registry import users
+
+
+# --------------------------------------------------------------------------------------------------------
+# Async-режим бота (BOT_RUNTIME = 'async' в config.py).
+#
+# Просмотр каталога, карточки товаров и корзина обрабатываются корутинами AsyncTeleBot поверх asyncpg,
+# поэтому один процесс держит тысячи одновременных диалогов без потока на каждый запрос.
+# Остальные апдейты (оформление заказа, админ-команды) пока передаются синхронному боту из bot.py
+# в отдельном потоке - это позволяет переносить обработчики постепенно.
+#
+# Отправки async-бота идут через тот же outbound.scheduler, что и у синхронного (install_async), и
+# попадают в ту же метрику bot_api_request_duration_seconds.
+
+bot = AsyncTeleBot(API_TOKEN)
+
+_sync_bot = None
+_chat_locks = weakref.WeakValueDictionary()
+_sticker_file_id = None
+_catalog_lock = asyncio.Lock()
+
+
+def _chat_lock(chat_id):
+    lock = _chat_locks.get(chat_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _chat_locks[chat_id] = lock
+    return lock
+
+
+def ordered(handler):
+    """Апдейты одного чата обрабатываются по очереди, разные чаты - параллельно."""
+    @functools.wraps(handler)
+    async def wrapper(update):
+        if isinstance(update, types.CallbackQuery):
+            chat_id = update.message.chat.id if update.message else update.from_user.id
+        else:
+            chat_id = update.chat.id
+        async with _chat_lock(chat_id):
+            return await handler(update)
+    return wrapper
+
+
+async def _refresh_catalog():
+    catalog.load(await db.get_categories(), await db.get_products())
+
+
+async def ensure_catalog():
+    """Загружает кэш каталога через asyncpg, если он ещё не загружен или сброшен после ошибки базы.
+
+    Вызывается перед обращением к catalog: сам кэш в async-режиме базу не читает (catalog.autoload).
+    """
+    if catalog.loaded:
+        return
+    async with _catalog_lock:
+        if not catalog.loaded:
+            await _refresh_catalog()
+
+
+async def resolve_user(chat_id):
+    # Тот же кэш chat_id -> users.id, что и в синхронном режиме, но промах читается через asyncpg
+    user_id = users.get(chat_id)
+    if user_id is None:
+        user_id = await db.get_user_id(chat_id)
+        if user_id is not None:
+            users.put(chat_id, user_id)
+    return user_id
+
+
+# То же, что navigation.py в синхронном режиме: меню меняется на месте, на каждое нажатие - ответ
+async def answer(call, text=None, show_alert=False):
+    try:
+        await bot.answer_callback_query(call.id, text, show_alert=show_alert)
+    except ApiTelegramException as error:
+        logging.info("Error answering callback query: %s", error)
+
+
+async def show_text(call, text, reply_markup=None):
+    return await run_steps_async(bot, show_text_steps(call, text, reply_markup))
+
+
+# --------------------------------------------------------------------------------------------------------
+
+
+@bot.message_handler(commands=['start'])
+@ordered
+async def send_welcome(message):
+    global _sticker_file_id
+    await asyncio.to_thread(machine.finish, message.chat.id)
+
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("Каталог", callback_data="catalog"))
+
+    sticker_path = os.path.join(PHOTOS_DIR, 'AnimatedSticker.tgs')
+    if _sticker_file_id:
+        try:
+            await bot.send_sticker(message.chat.id, _sticker_file_id)
+        except ApiTelegramException as error:
+            if not is_rejected_file_id(error):
+                raise
+            _sticker_file_id = None
+    if not _sticker_file_id:
+        if os.path.exists(sticker_path):
+            with open(sticker_path, 'rb') as sticker:
+                sent = await bot.send_sticker(message.chat.id, sticker)
+            if sent.sticker:
+                _sticker_file_id = sent.sticker.file_id
+        else:
+            await bot.send_message(message.chat.id, "Не удалось найти стикер.")
+
+    user_id = await db.upsert_user(message.chat.id, message.chat.username, message.chat.first_name,
+                                   message.chat.last_name)
+    users.put(message.chat.id, user_id)
+
+    await bot.send_message(message.chat.id, "Добро пожаловать в наш магазин PANDA SHOP 🐼", reply_markup=markup)
+
+    # Ссылка на товар из inline-поиска: /start product_<id>
+    payload = (message.text or '').partition(' ')[2].strip()
+    if payload.startswith('product_') and payload[len('product_'):].isdigit():
+        await send_product_card(message.chat.id, int(payload[len('product_'):]))
+
+
+@bot.callback_query_handler(func=lambda call: call.data in ("catalog", "back_catalog", "back_to_catalog"))
+@ordered
+async def send_catalog(call):
+    await ensure_catalog()
+    await show_text(call, "Что будем покупать?", reply_markup=catalog.get_catalog_markup())
+    await answer(call)
+
+
+async def get_products_page(category_id, direction='next', cursor_id=0):
+    # Общий с синхронным режимом кэш страниц, промах читается через asyncpg
+    await ensure_catalog()
+    key = (category_id, direction, cursor_id)
+    version, page = catalog.get_cached_page(key)
+    if page is None:
+        page = await db.get_products_page(category_id, direction, cursor_id, CATALOG_PAGE_SIZE)
+        if page is not None:
+            catalog.put_page(key, page, version)
+    return page
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("category_"))
+@ordered
+async def process_category_callback(call):
+    category_id = int(call.data.split('_')[1])
+    page = await get_products_page(category_id)
+
+    if page and page[0]:
+        await show_text(call, "Выберите товар:", reply_markup=catalog.get_page_markup((category_id, 'next', 0), page))
+        await answer(call)
+    else:
+        await answer(call, "В этой категории пока нет товаров.")
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(PAGE_CALLBACK_PREFIX))
+@ordered
+async def process_category_page_callback(call):
+    try:
+        category_id, direction, cursor_id = parse_page_callback(call.data)
+    except ValueError:
+        await answer(call, "Неизвестная команда.")
+        return
+
+    key = (category_id, direction, cursor_id)
+    page = await get_products_page(*key)
+    if not page or not page[0]:
+        key = (category_id, 'next', 0)
+        page = await get_products_page(*key)
+    if not page or not page[0]:
+        await answer(call, "В этой категории пока нет товаров.")
+        return
+
+    try:
+        await run_steps_async(bot, show_markup_steps(call, catalog.get_page_markup(key, page)))
+    finally:
+        await answer(call)
+
+
+async def send_product_photo(chat_id, product, **kwargs):
+    # Те же шаги, что media.send_product_photo, file_id сохраняется через asyncpg
+    message, new_file_id = await run_steps_async(bot, product_photo_steps(chat_id, product, **kwargs))
+    if new_file_id and await db.set_product_photo_file_id(product.id, new_file_id):
+        catalog.set_photo_file_id(product.id, new_file_id)
+    return message
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("product_"))
+@ordered
+async def send_product_info(call):
+    chat_id = call.message.chat.id
+    try:
+        product_id = int(call.data.split('_')[1])
+    except ValueError:
+        await answer(call, "Ошибка: Некорректный формат данных для получения информации о товаре.")
+        return
+    try:
+        await send_product_card(chat_id, product_id)
+    finally:
+        await answer(call)
+
+
+async def send_product_card(chat_id, product_id):
+    await ensure_catalog()
+    card = catalog.get_product_card(product_id)
+    if not card:
+        await bot.send_message(chat_id, "Товар не найден.")
+        return
+
+    product, caption, markup = card
+    try:
+        await send_product_photo(chat_id, product, caption=caption, parse_mode='HTML', reply_markup=markup)
+    except Exception as error:
+        logging.error("Ошибка при получении информации о продукте: %s", error)
+        await bot.send_message(chat_id, "Произошла ошибка при получении информации о товаре.")
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("add_to_cart_"))
+@ordered
+async def handle_add_to_cart(call):
+    chat_id = call.message.chat.id
+    data = call.data.split('_')
+    if len(data) != 4 or not data[3].isdigit():
+        await answer(call, "Ошибка: некорректный формат данных.")
+        return
+    product_id = int(data[3])
+
+    try:
+        user_id = await resolve_user(chat_id)
+        if user_id:
+            await db.add_to_cart(user_id, product_id)
+            await answer(call, "Товар добавлен в корзину.")
+        else:
+            await answer(call, "Ошибка: вы не зарегистрированы. Нажмите /start для регистрации.", show_alert=True)
+    except Exception as error:
+        logging.error("Ошибка при обработке запроса: %s", error)
+        await answer(call, "Произошла ошибка при добавлении товара в корзину. Пожалуйста, попробуйте позже.",
+                     show_alert=True)
+
+
+@bot.callback_query_handler(func=lambda call: call.data == "view_cart")
+@ordered
+async def handle_view_cart(call):
+    chat_id = call.message.chat.id
+    user_id = await resolve_user(chat_id)
+    items, total_amount = await db.get_cart_summary(user_id) if user_id else ([], 0)
+    if not items:
+        await answer(call, "Ваша корзина пуста.")
+        return
+
+    await show_text(call, format_cart(items, total_amount), reply_markup=cart_markup())
+    await answer(call)
+
+
+@bot.callback_query_handler(func=lambda call: call.data == "clear_cart")
+@ordered
+async def handle_clear_cart(call):
+    chat_id = call.message.chat.id
+    user_id = await resolve_user(chat_id)
+    if user_id:
+        await db.clear_cart(user_id)
+    await ensure_catalog()
+    await show_text(call, "Ваша корзина была очищена.", reply_markup=catalog.get_catalog_markup())
+    await answer(call)
+
+
+# --------------------------------------------------------------------------------------------------------
+# Всё остальное обрабатывает синхронный бот (оформление заказа, next step handlers, админка)
+
+
+@bot.callback_query_handler(func=lambda call: True)
+@ordered
+async def bridge_callback_query(call):
+    await asyncio.to_thread(_sync_bot.process_new_callback_query, [call])
+
+
+@bot.message_handler(func=lambda message: True, content_types=util.content_type_media)
+@ordered
+async def bridge_message(message):
+    await asyncio.to_thread(_sync_bot.process_new_messages, [message])
+
+
+@bot.inline_handler(func=lambda inline_query: True)
+async def bridge_inline_query(inline_query):
+    # Поиск идёт по кэшу каталога в памяти, но answer_inline_query - через синхронного бота
+    await asyncio.to_thread(_sync_bot.process_new_inline_query, [inline_query])
+
+
+async def _main():
+    scheduler.install_async(bot)
+    if METRICS_PORT:
+        instrument_async_bot_api()
+    await _refresh_catalog()
+    try:
+        await bot.infinity_polling(timeout=60)
+    finally:
+        await bot.close_session()
+        await db.close_pool()
+
+
+def run(sync_bot):
+    """Запускает async-режим. sync_bot - бот из bot.py с зарегистрированными синхронными обработчиками."""
+    global _sync_bot
+    _sync_bot = sync_bot
+    catalog.autoload = False
+    asyncio.run(_main())
@@ -0,0 +1,173 @@
+import logging
+from decimal import Decimal
+
+import asyncpg
+from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_POOL_MIN_CONN, DB_POOL_MAX_CONN
+from repository import Category, Product, CartLine
+
+
+# --------------------------------------------------------------------------------------------------------
+# Асинхронный доступ к PostgreSQL (asyncpg) для async-режима бота (async_bot.py).
+#
+# Функции повторяют имена и результаты database.py и repository.py, только объявлены как async def.
+# Здесь только то, что вызывают async-обработчики; запись каталога и оформление заказа идут через
+# синхронного бота и database.py.
+# Строки каталога и корзины возвращаются теми же объектами repository.Product, Category, CartLine.
+# Подготавливать запросы вручную, как database.execute_prepared, здесь не нужно: asyncpg сам готовит
+# каждый запрос на сервере и держит кэш подготовленных запросов на каждом соединении пула.
+
+_pool = None
+
+
+async def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            database=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT,
+            min_size=DB_POOL_MIN_CONN,
+            max_size=DB_POOL_MAX_CONN
+        )
+        logging.info("asyncpg connection pool created (%s-%s connections)", DB_POOL_MIN_CONN, DB_POOL_MAX_CONN)
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+        logging.info("asyncpg connection pool is closed")
+
+
+# --------------------------------------------------------------------------------------------------------
+
+
+async def add_to_cart(user_id, product_id):
+    try:
+        pool = await get_pool()
+        await pool.execute("""
+            INSERT INTO carts (user_id, product_id, quantity)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (user_id, product_id) DO UPDATE
+            SET quantity = carts.quantity + 1
+        """, user_id, product_id, 1)
+    except (Exception, asyncpg.PostgresError) as error:
+        logging.error("Error while adding product to cart: %s", error)
+
+
+async def get_cart_summary(user_id):
+    try:
+        pool = await get_pool()
+        rows = await pool.fetch("""
+            SELECT p.id, p.name, p.price, c.quantity,
+                   p.price * c.quantity AS subtotal,
+                   SUM(p.price * c.quantity) OVER () AS total
+            FROM carts c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.user_id = $1
+            ORDER BY c.id
+        """, user_id)
+    except (Exception, asyncpg.PostgresError) as error:
+        logging.error("Error while fetching cart summary: %s", error)
+        return [], Decimal(0)
+
+    if not rows:
+        return [], Decimal(0)
+    return [CartLine(*tuple(row)[:5]) for row in rows], rows[0]['total']
+
+
+async def clear_cart(user_id):
+    try:
+        pool = await get_pool()
+        await pool.execute("DELETE FROM carts WHERE user_id = $1", user_id)
+    except (Exception, asyncpg.PostgresError) as error:
+        logging.error("Error while clearing cart: %s", error)
+
+
+async def get_products():
+    try:
+        pool = await get_pool()
+        rows = await pool.fetch("""
+            SELECT id, name, category_id, price, sizes, photo, photo_file_id
+            FROM products
+            ORDER BY id
+        """)
+        return [Product.from_row(row) for row in rows]
+    except (Exception, asyncpg.PostgresError) as error:
+        logging.error("Error while fetching products: %s", error)
+        return None
+
+
+async def get_categories():
+    try:
+        pool = await get_pool()
+        rows = await pool.fetch("SELECT id, name FROM categories ORDER BY id")
+        return [Category(*row) for row in rows]
+    except (Exception, asyncpg.PostgresError) as error:
+        logging.error("Error while fetching categories: %s", error)
+        return None
+
+
+async def get_products_page(category_id, direction, cursor_id, limit):
+    try:
+        pool = await get_pool()
+        if direction == 'prev':
+            rows = await pool.fetch("""
+                SELECT id, name, price FROM products
+                WHERE category_id = $1 AND id < $2
+                ORDER BY id DESC
+                LIMIT $3
+            """, category_id, cursor_id, limit + 1)
+        else:
+            rows = await pool.fetch("""
+                SELECT id, name, price FROM products
+                WHERE category_id = $1 AND id > $2
+                ORDER BY id
+                LIMIT $3
+            """, category_id, cursor_id, limit + 1)
+    except (Exception, asyncpg.PostgresError) as error:
+        logging.error("Error while fetching data: %s", error)
+        return None
+
+    has_more = len(rows) > limit
+    rows = [tuple(row) for row in rows[:limit]]
+    if direction == 'prev':
+        return list(reversed(rows)), has_more, True
+    return rows, cursor_id > 0, has_more
+
+
+async def set_product_photo_file_id(product_id, file_id):
+    try:
+        pool = await get_pool()
+        await pool.execute("UPDATE products SET photo_file_id = $1 WHERE id = $2", file_id, product_id)
+        return True
+    except (Exception, asyncpg.PostgresError) as error:
+        logging.error("Error while saving photo file_id for product %s: %s", product_id, error)
+        return False
+
+
+async def upsert_user(chat_id, username, first_name, last_name):
+    pool = await get_pool()
+    return await pool.fetchval("""
+        INSERT INTO users (username, first_name, last_name, chat_id)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (chat_id) DO UPDATE
+        SET username = EXCLUDED.username,
+            first_name = EXCLUDED.first_name,
+            last_name = EXCLUDED.last_name,
+            is_blocked = FALSE
+        RETURNING id
+    """, username, first_name, last_name, chat_id)
+
+
+async def get_user_id(chat_id):
+    try:
+        pool = await get_pool()
+        return await pool.fetchval("SELECT id FROM users WHERE chat_id = $1", chat_id)
+    except (Exception, asyncpg.PostgresError) as error:
+        logging.error("Error while fetching user id: %s", error)
+        return None
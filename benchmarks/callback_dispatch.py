@@ -0,0 +1,64 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from callbacks import CallbackRouter
+
+
+# --------------------------------------------------------------------------------------------------------
+# Время выбора обработчика для нажатия на кнопку в зависимости от числа маршрутов.
+#
+# chain  - как было: обработчики с предикатами startswith/==, перебираются по порядку
+#          (худший случай - последний маршрут)
+# router - callbacks.CallbackRouter: разбор callback_data и поиск действия в словаре
+#
+#   python benchmarks/callback_dispatch.py
+
+ROUTE_COUNTS = (10, 100, 1000, 10000)
+NUMBER = 2000
+
+
+def _handler(call, *args):
+    return args
+
+
+def build_chain(count):
+    handlers = []
+    for number in range(count):
+        prefix = f"action{number}_item_"
+        handlers.append((lambda data, prefix=prefix: data.startswith(prefix), _handler))
+    return handlers
+
+
+def dispatch_chain(handlers, data):
+    for predicate, handler in handlers:
+        if predicate(data):
+            return handler
+    return None
+
+
+def build_router(count):
+    router = CallbackRouter()
+    for number in range(count):
+        router.route(f"action{number}_item", int)(_handler)
+    return router
+
+
+def main():
+    print(f"{'routes':>8} {'chain, мкс':>12} {'router, мкс':>12}")
+    for count in ROUTE_COUNTS:
+        data = f"action{count - 1}_item_42"
+        chain = build_chain(count)
+        router = build_router(count)
+        assert dispatch_chain(chain, data) is _handler
+        assert router.resolve(data) == (_handler, [42])
+
+        chain_time = min(timeit.repeat(lambda: dispatch_chain(chain, data), number=NUMBER, repeat=3)) / NUMBER
+        router_time = min(timeit.repeat(lambda: router.resolve(data), number=NUMBER, repeat=3)) / NUMBER
+        print(f"{count:>8} {chain_time * 1e6:>12.2f} {router_time * 1e6:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
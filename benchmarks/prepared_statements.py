@@ -0,0 +1,82 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import repository
+from database import get_connection, close_pool, execute_prepared, _statements, PRODUCTS_PAGE_NEXT, \
+    PRODUCTS_PAGE_PREV, USER_ID_BY_CHAT_ID, CART_UPSERT
+
+
+# --------------------------------------------------------------------------------------------------------
+# Время одного горячего запроса на одном соединении: обычный execute против PREPARE/EXECUTE.
+#
+# plain    - cursor.execute с текстом запроса: сервер каждый раз разбирает, анализирует и планирует запрос
+# prepared - database.execute_prepared: запрос подготовлен один раз, дальше только EXECUTE
+# saved    - разница, то есть время разбора и планирования, сэкономленное на каждом вызове
+#
+# Нужна база из config.py с данными (хотя бы один товар и один пользователь). Добавление в корзину
+# выполняется в транзакции, которая откатывается в конце.
+#
+#   python benchmarks/prepared_statements.py
+
+NUMBER = 2000
+
+
+def sample_params(cursor):
+    cursor.execute("SELECT id, category_id FROM products ORDER BY id LIMIT 1")
+    product = cursor.fetchone()
+    cursor.execute("SELECT id, chat_id FROM users ORDER BY id LIMIT 1")
+    user = cursor.fetchone()
+    if product is None or user is None:
+        return None
+    product_id, category_id = product
+    user_id, chat_id = user
+    return {
+        PRODUCTS_PAGE_NEXT: (category_id, 0, 11),
+        PRODUCTS_PAGE_PREV: (category_id, product_id + 100, 11),
+        repository.CART_BY_USER: (user_id,),
+        repository.USER_BY_CHAT_ID: (chat_id,),
+        USER_ID_BY_CHAT_ID: (chat_id,),
+        CART_UPSERT: (user_id, product_id, 1),
+    }
+
+
+def run_plain(cursor, name, params):
+    cursor.execute(_statements[name], params)
+    if cursor.description is not None:
+        cursor.fetchall()
+
+
+def run_prepared(cursor, name, params):
+    execute_prepared(cursor, name, params)
+    if cursor.description is not None:
+        cursor.fetchall()
+
+
+def main():
+    try:
+        with get_connection() as connection, connection.cursor() as cursor:
+            statements = sample_params(cursor)
+            if statements is None:
+                print("В базе нет товаров или пользователей - нечего измерять")
+                return
+
+            print(f"{'statement':>20} {'plain, мкс':>12} {'prepared, мкс':>14} {'saved, мкс':>12}")
+            for name, params in statements.items():
+                # Первый вызов готовит запрос - в замер он не попадает
+                run_prepared(cursor, name, params)
+                plain_time = min(timeit.repeat(lambda: run_plain(cursor, name, params),
+                                               number=NUMBER, repeat=3)) / NUMBER
+                prepared_time = min(timeit.repeat(lambda: run_prepared(cursor, name, params),
+                                                  number=NUMBER, repeat=3)) / NUMBER
+                print(f"{name:>20} {plain_time * 1e6:>12.1f} {prepared_time * 1e6:>14.1f} "
+                      f"{(plain_time - prepared_time) * 1e6:>12.1f}")
+            connection.rollback()
+    finally:
+        close_pool()
+
+
+if __name__ == '__main__':
+    main()
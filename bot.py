@@ -6,16 +6,33 @@ import telebot
 from telebot import types
 import os
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-from database import insert_product, get_all_categories, get_products_by_category, get_product_by_id, add_to_cart, \
-    get_cart_items, clear_cart, save_order, get_user_info, get_order_info
+from database import insert_product, add_to_cart, clear_cart, save_order, place_order, close_pool
+from repository import get_cart_summary, get_user
 from config import *
 from functools import partial
 from admin import add_category, add_product
 from admin import bot as admin_bot
+from admin import broadcaster
+from catalog_cache import catalog
+from media import send_product_photo, send_sticker_file
+from dispatcher import install_dispatcher
+from fsm import machine
+from user_registry import users
+from outbound import scheduler
+from keyboards import page_direction, format_cart, cart_markup, PAGE_CALLBACK_ACTION
+from navigation import answer, show_text, show_markup
+from callbacks import router
+from search import search_results_markup, inline_search_results
+from webhook import WebhookServer
+from metrics import instrument_bot, instrument_bot_api, registry, start_metrics_server
+from logs import setup_logging, shutdown_logging, stats as log_stats
+from outbox import OutboxWorker, text_message, photo_message, copy_message
+from images import pipeline as image_pipeline
 
 bot = admin_bot
 
-logging.basicConfig(level=logging.INFO)
+# Уведомления группе администраторов (ADMIN_GROUP_ID) уходят через outbox
+outbox = OutboxWorker(bot)
 
 
 # --------------------------------------------------------------------------------------------------------
@@ -23,6 +40,9 @@ logging.basicConfig(level=logging.INFO)
 # Приветственное сообщение и кнопка "Каталог"
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
+    # /start прерывает незавершённый диалог (например, оформление заказа)
+    machine.finish(message.chat.id)
+
     markup = types.InlineKeyboardMarkup()
     catalog_button = types.InlineKeyboardButton("Каталог", callback_data="catalog")
     markup.add(catalog_button)
@@ -30,40 +50,19 @@ def send_welcome(message):
     # Отправка стикера из файла
     sticker_path = os.path.join(PHOTOS_DIR, 'AnimatedSticker.tgs')
     if os.path.exists(sticker_path):
-        with open(sticker_path, 'rb') as sticker:
-            bot.send_sticker(message.chat.id, sticker)
+        send_sticker_file(bot, message.chat.id, sticker_path)
     else:
         bot.send_message(message.chat.id, "Не удалось найти стикер.")
 
-    # Проверяем, зарегистрирован ли пользователь
-    if not is_user_registered(message.chat.id):
-        register_user(message)
+    # Регистрируем пользователя (или обновляем его данные) одним запросом
+    users.register(message.chat)
 
     bot.send_message(message.chat.id, "Добро пожаловать в наш магазин PANDA SHOP 🐼", reply_markup=markup)
 
-
-# Функция для проверки регистрации пользователя
-def is_user_registered(chat_id):
-    with psycopg2.connect(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT,
-                          database=DB_NAME) as connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT * FROM users WHERE chat_id = %s", (chat_id,))
-            return cursor.fetchone() is not None
-
-
-# Функция для регистрации пользователя
-def register_user(message):
-    chat_id = message.chat.id
-    username = message.chat.username
-    first_name = message.chat.first_name
-    last_name = message.chat.last_name
-
-    with psycopg2.connect(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT,
-                          database=DB_NAME) as connection:
-        with connection.cursor() as cursor:
-            cursor.execute("INSERT INTO users (username, first_name, last_name, chat_id) VALUES (%s, %s, %s, %s)",
-                           (username, first_name, last_name, chat_id))
-            connection.commit()
+    # Ссылка на товар из inline-поиска: /start product_<id>
+    payload = (message.text or '').partition(' ')[2].strip()
+    if payload.startswith('product_') and payload[len('product_'):].isdigit():
+        send_product_card(message.chat.id, int(payload[len('product_'):]))
 
 
 @bot.message_handler(commands=['stop'])
@@ -75,172 +74,154 @@ def handle_stop(message):
 # --------------------------------------------------------------------------------------------------------
 
 
-@bot.callback_query_handler(func=lambda call: True)
-def handle_query(call):
-    logging.info(f"Handling callback query with data: {call.data}")
-
-    if call.data == "catalog":
-        send_catalog(call)
-    elif call.data.startswith("add_to_cart_"):
-        handle_add_to_cart(call)
-    elif call.data.startswith("category_"):
-        process_category_callback(call)
-    elif call.data == "back_catalog":
-        send_catalog(call)
-    elif call.data == "view_cart":
-        handle_view_cart(call)
-    elif call.data == "clear_cart":
-        handle_clear_cart(call)
-    elif call.data.startswith("order_"):
-        if call.data == "order_0":
-            handle_order_from_cart(call)
-        else:
-            handle_order(call)
-    elif call.data.startswith("confirm_order_"):
-        handle_confirm_order(call)
-    elif call.data == "cancel_order":
-        handle_cancel_order(call)
-    elif call.data.startswith("product_"):
-        send_product_info(call, call.data)
-    elif call.data.startswith("pay_by_"):
-        handle_payment_method(call)
-    else:
-        bot.send_message(call.message.chat.id, "Неизвестная команда.")
-
-
-
-
-
-
+# Все нажатия на инлайн-кнопки проходят через таблицу маршрутов (callbacks.py),
+# обработчики ниже регистрируются через @router.route
+router.attach(bot)
 
 
 # --------------------------------------------------------------------------------------------------------
 
 # Функция для отправки каталога товаров
-def send_catalog(call=None):
-    markup = types.InlineKeyboardMarkup()
-    categories = get_all_categories()  # Получаем все категории из базы данных
+@router.route('catalog')
+@router.route('back_catalog')
+@router.route('back_to_catalog')
+def send_catalog(call):
+    # Готовое меню из кэша каталога показывается на месте сообщения с кнопкой
+    show_text(bot, call, "Что будем покупать?", reply_markup=catalog.get_catalog_markup())
 
-    if categories:
-        for category in categories:
-            category_button = types.InlineKeyboardButton(category[1], callback_data=f"category_{category[0]}")
-            markup.add(category_button)
 
-    back_button = types.InlineKeyboardButton("Назад", callback_data="back_catalog")
-    markup.add(back_button)
+# Обработчик нажатий на кнопки
+@router.route('category', int)
+def process_category_callback(call, category_id):
+    page = catalog.get_products_page(category_id)
 
-    if call:
-        try:
-            bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
-        except Exception as e:
-            print(f"Error deleting message: {e}")
+    if page and page[0]:
+        show_text(bot, call, "Выберите товар:", reply_markup=catalog.get_page_markup((category_id, 'next', 0), page))
+    else:
+        answer(bot, call, "В этой категории пока нет товаров.")
+
+
+# Листание страниц категории: меняем клавиатуру в том же сообщении
+@router.route(PAGE_CALLBACK_ACTION, int, page_direction, int)
+def process_category_page_callback(call, category_id, direction, cursor_id):
+    key = (category_id, direction, cursor_id)
+    page = catalog.get_products_page(*key)
+    if not page or not page[0]:
+        # Товары могли удалить - начинаем категорию сначала
+        key = (category_id, 'next', 0)
+        page = catalog.get_products_page(*key)
+    if not page or not page[0]:
+        answer(bot, call, "В этой категории пока нет товаров.")
+        return
 
-    bot.send_message(call.message.chat.id, "Что будем покупать?", reply_markup=markup) if call else None
+    show_markup(bot, call, catalog.get_page_markup(key, page))
 
 
-# Обработчик нажатий на кнопки
-@bot.callback_query_handler(func=lambda call: call.data.startswith('category_'))
-def process_category_callback(call):
-    category_id = int(call.data.split('_')[1])
-    products = get_products_by_category(category_id)
+# Функция для отправки информации о товаре
+@router.route('product', int)
+def send_product_info(call, product_id):
+    send_product_card(call.message.chat.id, product_id)
 
-    if products:
-        markup = types.InlineKeyboardMarkup()
-        for product in products:
-            product_button = types.InlineKeyboardButton(f"{product[1]} - {product[3]} тг.", callback_data=f"product_{product[0]}")
-            markup.add(product_button)
 
+def send_product_card(chat_id, product_id):
+    try:
+        card = catalog.get_product_card(product_id)
 
-        bot.send_message(call.message.chat.id, "Выберите товар:", reply_markup=markup)
-    else:
-        bot.send_message(call.message.chat.id, "В этой категории пока нет товаров.")
+        if card:
+            product, caption, markup = card
 
+            # Фото отправляется по сохранённому file_id, файл загружается только в первый раз.
+            # Отправка идёт в фоне, об ошибке пользователь узнаёт из колбэка
+            sending = send_product_photo(bot, chat_id, product, caption=caption, parse_mode='HTML',
+                                         reply_markup=markup)
+            sending.add_done_callback(partial(_report_product_card_error, chat_id))
 
-@bot.callback_query_handler(func=lambda call: call.data == 'back_to_catalog')
-def back_to_catalog_callback(call):
-    send_catalog(call)
+        else:
+            bot.send_message(chat_id, "Товар не найден.")
 
+    except (Exception, psycopg2.Error) as error:
+        logging.error("Ошибка при получении информации о продукте: %s", error)
+        bot.send_message(chat_id, "Произошла ошибка при получении информации о товаре.")
 
 
-# Функция для отправки информации о товаре
-def send_product_info(call, product_id_str):
-    try:
-        # Проверка формата данных
-        if not product_id_str.startswith("product_"):
-            raise ValueError("Некорректный формат данных для получения информации о товаре.")
+def _report_product_card_error(chat_id, future):
+    error = future.exception()
+    if error is not None:
+        logging.error("Ошибка при отправке карточки товара: %s", error)
+        bot.send_message(chat_id, "Произошла ошибка при получении информации о товаре.")
 
-        # Извлекаем числовую часть из строки идентификатора товара
-        product_id = int(product_id_str.split('_')[1])
-        print(f"Fetching product info for ID: {product_id}")
 
-        # Устанавливаем соединение с базой данных
-        with psycopg2.connect(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT,
-                              database=DB_NAME) as connection:
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-                product = cursor.fetchone()
+# --------------------------------------------------------------------------------------------------------
+# Поиск товаров: /search <запрос> и inline-режим (@bot запрос)
 
-                if product:
-                    product_name = product[1]
-                    product_price = product[3]
-                    product_sizes = product[4]
-                    product_photo_filename = product[5]
+_bot_username = None
 
-                    product_photo_url = os.path.join(PHOTOS_DIR, product_photo_filename)
 
-                    print(f"Product photo URL: {product_photo_url}")
+def get_bot_username():
+    global _bot_username
+    if _bot_username is None:
+        _bot_username = bot.get_me().username
+    return _bot_username
 
-                    with open(product_photo_url, 'rb') as photo_file:
-                        sizes_text = ", ".join(product_sizes)
 
-                        markup = types.InlineKeyboardMarkup()
+def send_search_results(chat_id, query):
+    products = catalog.search(query, SEARCH_RESULTS_LIMIT)
+    if products:
+        bot.send_message(chat_id, f"Найдено по запросу «{query}»:", reply_markup=search_results_markup(products))
+    else:
+        bot.send_message(chat_id, f"По запросу «{query}» ничего не найдено.")
 
-                        add_to_cart_button = types.InlineKeyboardButton("В корзину",
-                                                                        callback_data=f"add_to_cart_{product_id}")
-                        markup.row(add_to_cart_button)
 
-                        bot.send_photo(call.message.chat.id, photo_file,
-                                       caption=f"ID товара: {product_id}\n\nНазвание: <b>{product_name}</b>\n\nЦена: {product_price} тг.\n\nРазмеры: {sizes_text}",
-                                       parse_mode='HTML', reply_markup=markup)
+@bot.message_handler(commands=['search'])
+def handle_search(message):
+    query = (message.text or '').partition(' ')[2].strip()
+    if query:
+        send_search_results(message.chat.id, query)
+    else:
+        bot.send_message(message.chat.id, "Введите название товара или категории:")
+        machine.set_state(message.chat.id, 'search:query')
 
-                else:
-                    bot.send_message(call.message.chat.id, "Товар не найден.")
 
-    except ValueError as e:
-        bot.send_message(call.message.chat.id, f"Ошибка: {str(e)}")
-    except (Exception, psycopg2.Error) as error:
-        print(f"Ошибка при получении информации о продукте: {error}")
-        bot.send_message(call.message.chat.id, "Произошла ошибка при получении информации о товаре.")
+@machine.step('search:query')
+def handle_search_query_step(message, data):
+    query = (message.text or '').strip()
+    if not query:
+        bot.send_message(message.chat.id, "Введите название товара или категории:")
+        return
+    machine.finish(message.chat.id)
+    send_search_results(message.chat.id, query)
 
 
+@bot.inline_handler(func=lambda query: True)
+def handle_inline_search(inline_query):
+    products = catalog.search(inline_query.query, INLINE_RESULTS_LIMIT) if inline_query.query.strip() else []
+    try:
+        bot.answer_inline_query(inline_query.id, inline_search_results(products, get_bot_username()),
+                                cache_time=INLINE_CACHE_TIME)
+    except apihelper.ApiTelegramException as e:
+        # Запрос устаревает через несколько секунд, если пользователь продолжил печатать
+        logging.info("Error answering inline query: %s", e)
 
 
 # --------------------------------------------------------------------------------------------------------
+def format_order_summary(lines):
+    """lines - [(название, количество, цена за единицу)]."""
+    return "\n".join(f"{name} - {quantity} шт. - {price} тг. за шт." for name, quantity, price in lines)
+
+
 # Функция для обработки оформления заказа из корзины
+@router.route('order_0')
 def handle_order_from_cart(call):
     chat_id = call.message.chat.id
-    logging.info(f"User {chat_id} requested to order from cart")
+    logging.info("User %s requested to order from cart", chat_id)
 
-    items = get_cart_items(chat_id)
+    user_id = users.resolve(chat_id)
+    items, total_amount = get_cart_summary(user_id) if user_id else ([], 0)
     if not items:
         bot.send_message(chat_id, "Ваша корзина пуста.")
         return
 
-    order_summary = []
-    total_amount = 0
-
-    for item in items:
-        product_id, name, price, quantity = item
-        try:
-            price = float(price)
-            quantity = int(quantity)
-            total_amount += price * quantity
-            order_summary.append(f"{name} - {quantity} шт. - {price} тг. за шт.")
-        except ValueError:
-            logging.error(f"Ошибка преобразования данных для товара {product_id}.")
-            order_summary.append(f"{name} - {quantity} шт.")
-
-    order_summary_text = "\n".join(order_summary)
+    order_summary_text = format_order_summary((line.name, line.quantity, line.price) for line in items)
 
     # Кнопки для выбора способа оплаты
     markup = types.ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
@@ -254,233 +235,161 @@ def handle_order_from_cart(call):
                      "\nПожалуйста, выберите способ оплаты.",
                      reply_markup=markup)
 
-    bot.register_next_step_handler(call.message, handle_payment_method_step, order_summary_text, total_amount)
+    # Состав и сумма заказа здесь только для показа: заказ и уведомление администраторам строятся
+    # из корзины в момент оформления (place_order)
+    machine.set_state(chat_id, 'checkout:payment_method', {})
 
 # Функция для обработки выбранного способа оплаты
-def handle_payment_method_step(message, order_summary, total_amount):
+@machine.step('checkout:payment_method')
+def handle_payment_method_step(message, data):
     chat_id = message.chat.id
     payment_method = message.text
 
     if payment_method == 'Оплатить картой':
         bot.send_message(chat_id, "Пожалуйста, отправьте чек о платеже.", reply_markup=types.ReplyKeyboardRemove())
-        bot.register_next_step_handler(message, handle_payment_receipt_step, order_summary, total_amount)
+        machine.set_state(chat_id, 'checkout:receipt', data)
     elif payment_method == 'Оплатить криптовалютой':
         bot.send_message(chat_id, "Для оплаты криптовалютой, пожалуйста, используйте бот @send и отправьте скриншот подтверждения.", reply_markup=types.ReplyKeyboardRemove())
-        bot.register_next_step_handler(message, handle_payment_receipt_step, order_summary, total_amount)
+        machine.set_state(chat_id, 'checkout:receipt', data)
     else:
+        # Остаёмся на этом же шаге
         bot.send_message(chat_id, "Пожалуйста, выберите правильный способ оплаты.")
-        bot.register_next_step_handler(message, handle_payment_method_step, order_summary, total_amount)
 
-def handle_payment_receipt_step(message, order_summary, total_amount):
+@machine.step('checkout:receipt')
+def handle_payment_receipt_step(message, data):
     chat_id = message.chat.id
     receipt_photo = message.photo[-1].file_id if message.photo else None
 
     if not receipt_photo:
         bot.send_message(chat_id, "Пожалуйста, отправьте фотографию чека.")
-        bot.register_next_step_handler(message, handle_payment_receipt_step, order_summary, total_amount)
         return
 
     bot.send_message(chat_id, "Пожалуйста, введите ваше имя.")
-    bot.register_next_step_handler(message, handle_name_step, order_summary, total_amount, receipt_photo)
+    machine.set_state(chat_id, 'checkout:name', dict(data, receipt_photo=receipt_photo))
 
-def handle_name_step(message, order_summary, total_amount, receipt_photo):
+@machine.step('checkout:name')
+def handle_name_step(message, data):
     chat_id = message.chat.id
     user_name = message.text
 
     bot.send_message(chat_id, "Пожалуйста, введите ваш адрес.")
-    bot.register_next_step_handler(message, handle_address_step, order_summary, total_amount, receipt_photo, user_name)
+    machine.set_state(chat_id, 'checkout:address', dict(data, user_name=user_name))
 
-def handle_address_step(message, order_summary, total_amount, receipt_photo, user_name):
+@machine.step('checkout:address')
+def handle_address_step(message, data):
     chat_id = message.chat.id
     address = message.text
 
     bot.send_message(chat_id, "Пожалуйста, введите ваш номер телефона.")
-    bot.register_next_step_handler(message, handle_phone_step, order_summary, total_amount, receipt_photo, user_name, address)
+    machine.set_state(chat_id, 'checkout:phone', dict(data, address=address))
 
-def handle_phone_step(message, order_summary, total_amount, receipt_photo, user_name, address):
+@machine.step('checkout:phone')
+def handle_phone_step(message, data):
     chat_id = message.chat.id
     phone = message.text
 
-    order_details = {
-        'order_summary': order_summary,
-        'total_amount': total_amount,
-        'name': user_name,
-        'address': address,
-        'phone': phone
-    }
-
-    save_order(chat_id, order_details)
-    clear_cart(chat_id)
-
-    bot.send_message(chat_id, "Ваш заказ был успешно оформлен. Спасибо за покупку!")
-    admin_chat_id = GROUP_ID
-    formatted_order_details = (
-        f"Пользователь {user_name} оформил заказ:\n\n"
-        f"Товары:\n{order_summary}\n\n"
-        f"Итого: {total_amount:.2f} тг.\n"
-        f"Имя: {user_name}\n"
-        f"Адрес: {address}\n"
-        f"Телефон: {phone}"
-    )
-    bot.send_message(admin_chat_id, formatted_order_details)
-
-
-def handle_payment_receipt_step(message, order_summary, total_amount):
-    chat_id = message.chat.id
-    receipt_photo = message.photo[-1].file_id if message.photo else None
-
-    if not receipt_photo:
-        bot.send_message(chat_id, "Пожалуйста, отправьте фотографию чека.")
-        bot.register_next_step_handler(message, handle_payment_receipt_step, order_summary, total_amount)
-        return
-
-    bot.send_message(chat_id, "Пожалуйста, введите ваше имя.")
-    bot.register_next_step_handler(message, handle_name_step, order_summary, total_amount, receipt_photo)
-
-def handle_name_step(message, order_summary, total_amount, receipt_photo):
-    chat_id = message.chat.id
-    user_name = message.text
-
-    bot.send_message(chat_id, "Пожалуйста, введите ваш адрес.")
-    bot.register_next_step_handler(message, handle_address_step, order_summary, total_amount, receipt_photo, user_name)
-
-def handle_address_step(message, order_summary, total_amount, receipt_photo, user_name):
-    chat_id = message.chat.id
-    address = message.text
-
-    bot.send_message(chat_id, "Пожалуйста, введите ваш номер телефона.")
-    bot.register_next_step_handler(message, handle_phone_step, order_summary, total_amount, receipt_photo, user_name, address)
-
-def handle_phone_step(message, order_summary, total_amount, receipt_photo, user_name, address):
-    chat_id = message.chat.id
-    phone = message.text
+    receipt_photo = data['receipt_photo']
+    user_name = data['user_name']
+    address = data['address']
 
     # Сохраняем детали заказа
     order_details = {
-        'order_summary': order_summary,
-        'total_amount': total_amount,
         'name': user_name,
         'address': address,
         'phone': phone
     }
 
-    save_order(chat_id, order_details)
-    clear_cart(chat_id)
+    # Сообщение с деталями заказа и фото чека для группы администраторов - из записанных позиций
+    def notifications(order_id, lines, total_amount):
+        formatted_order_details = (
+            f"Пользователь {user_name} оформил заказ #{order_id}:\n\n"
+            f"Товары:\n{format_order_summary(lines)}\n\n"
+            f"Итого: {total_amount:.2f} тг.\n"
+            f"Имя: {user_name}\n"
+            f"Адрес: {address}\n"
+            f"Телефон: {phone}"
+        )
+        return [text_message(ADMIN_GROUP_ID, formatted_order_details),
+                photo_message(ADMIN_GROUP_ID, receipt_photo, caption=f"Фото чека к заказу #{order_id}.")]
+
+    # Заказ, его позиции, очистка корзины и уведомления в outbox - одна транзакция
+    order_id = place_order(users.resolve(chat_id), order_details, notifications)
+    if order_id is None:
+        # Остаёмся на шаге телефона: чек, имя и адрес сохранены, повторная отправка номера повторит заказ
+        bot.send_message(chat_id, "Не удалось оформить заказ: корзина пуста или произошла ошибка. "
+                                  "Пожалуйста, отправьте номер телефона ещё раз.")
+        return
 
-    # Форматируем текстовое сообщение с деталями заказа
-    formatted_order_details = (
-        f"Пользователь {user_name} оформил заказ:\n\n"
-        f"Товары:\n{order_summary}\n\n"
-        f"Итого: {total_amount:.2f} тг.\n"
-        f"Имя: {user_name}\n"
-        f"Адрес: {address}\n"
-        f"Телефон: {phone}"
-    )
+    machine.finish(chat_id)
+    # Покупатель получает ответ сразу, группа - из фонового потока outbox
+    bot.send_message(chat_id, "Ваш заказ был успешно оформлен. Спасибо за покупку!")
+    outbox.notify()
 
-    # Отправляем сообщение и фото чека в группу администраторов
-    admin_chat_id = GROUP_ID
-    if isinstance(admin_chat_id, list):
-        admin_chat_id = admin_chat_id[0]  # Убедитесь, что это одно число
 
-    try:
-        bot.send_message(admin_chat_id, formatted_order_details)
-        bot.send_photo(admin_chat_id, receipt_photo, caption="Фото чека от пользователя.")
-        bot.send_message(chat_id, "Ваш заказ был успешно оформлен. Спасибо за покупку!")
-    except Exception as e:
-        bot.send_message(chat_id, "Произошла ошибка при отправке информации в группу.")
-        logging.error(f"Ошибка при отправке информации в группу: {e}")
 
+@router.route('pay_by', str)
+def handle_payment_method(call, method):
+    chat_id = call.message.chat.id
 
+    # Инлайн-кнопки оплаты работают только на шаге выбора способа оплаты
+    session = machine.get_state(chat_id)
+    if session is None or session[0] != 'checkout:payment_method':
+        answer(bot, call, "Сначала откройте корзину и нажмите «Оформить заказ».", show_alert=True)
+        return
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("pay_by_"))
-def handle_payment_method(call):
-    chat_id = call.message.chat.id
-    if call.data == "pay_by_card":
+    if method == "card":
         bot.send_message(chat_id,
                          "Пожалуйста, отправьте чек о платеже.",
                          reply_markup=types.ReplyKeyboardRemove())
-        bot.register_next_step_handler(call.message, handle_payment_receipt)
-    elif call.data == "pay_by_crypto":
+        machine.set_state(chat_id, 'checkout:receipt', session[1])
+    elif method == "crypto":
         bot.send_message(chat_id,
                          "Для оплаты криптовалютой перейдите в бот @send и выполните оплату. После этого отправьте чек о платеже.",
                          reply_markup=types.ReplyKeyboardRemove())
-        bot.register_next_step_handler(call.message, handle_payment_receipt)
+        machine.set_state(chat_id, 'checkout:receipt', session[1])
 
-def handle_payment_receipt(message, order_summary, total_amount):
-    chat_id = message.chat.id
-    receipt_photo = message.photo[-1].file_id if message.photo else None
 
-    if not receipt_photo:
-        bot.send_message(chat_id, "Пожалуйста, отправьте фотографию чека.")
-        bot.register_next_step_handler(message, handle_payment_receipt, order_summary, total_amount)
-        return
+@router.route('confirm_order', int)
+def handle_confirm_order(call, product_id):
+    chat_id = call.message.chat.id
+    try:
+        logging.info("Confirming order for product_id: %s", product_id)
 
-    # Отправляем фото чека в группу администраторов
-    admin_chat_id = GROUP_ID
-    if isinstance(admin_chat_id, list):
-        admin_chat_id = admin_chat_id[0]  # Убедитесь, что это одно число
+        user = get_user(chat_id)
+        if not user:
+            bot.send_message(chat_id, "Ошибка: не удалось получить информацию о пользователе.")
+            return
 
-    bot.send_photo(admin_chat_id, receipt_photo, caption="Фото чека от пользователя.")
+        username = user.username or 'Не указано'
 
-    bot.send_message(chat_id, "Пожалуйста, введите ваше имя.")
-    bot.register_next_step_handler(message, handle_name_step, order_summary, total_amount, receipt_photo)
+        product = catalog.get_product(product_id)
 
+        if product:
+            product_name = product.name
+            product_price = product.price
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("confirm_order_"))
-def handle_confirm_order(call):
-    try:
-        data = call.data.split('_')
-        if len(data) != 3 or data[0] != 'confirm' or data[1] != 'order':
-            raise ValueError("Некорректный формат данных для подтверждения заказа.")
+            # Сохранение заказа
+            order_details = {
+                'order_summary': f"{product_name} - {product_price} тг.",
+                'total_amount': str(product_price),  # Убедитесь, что это строка
+                'username': username
+            }
+            save_order(users.resolve(chat_id), order_details)
 
-        product_id = int(data[2])
-        logging.info(f"Confirming order for product_id: {product_id}")
+            bot.send_message(chat_id, "Ваш заказ был успешно оформлен. Спасибо за покупку!")
 
-        chat_id = call.message.chat.id
-        user_info = get_user_info(chat_id)
-        if not user_info:
-            bot.send_message(chat_id, "Ошибка: не удалось получить информацию о пользователе.")
-            return
+            # Уведомление администратора
+            outbox.enqueue([text_message(ADMIN_GROUP_ID, f"Новый заказ:\n\n{order_details}")])
 
-        username = user_info.get('username', 'Не указано')
-
-        with psycopg2.connect(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT, database=DB_NAME) as connection:
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-                product = cursor.fetchone()
-
-                if product:
-                    product_name = product[1]
-                    product_price = product[3]
-
-                    # Сохранение заказа
-                    order_details = {
-                        'order_summary': f"{product_name} - {product_price} тг.",
-                        'total_amount': str(product_price),  # Убедитесь, что это строка
-                        'username': username
-                    }
-                    save_order(chat_id, order_details)
-
-                    bot.send_message(chat_id, "Ваш заказ был успешно оформлен. Спасибо за покупку!")
-
-                    # Уведомление администратора
-                    admin_chat_id = GROUP_ID
-                    if isinstance(admin_chat_id, list):
-                        admin_chat_id = admin_chat_id[0]  # Убедитесь, что это одно число
-                    logging.info(f"Sending order details to admin chat_id: {admin_chat_id}")
-                    bot.send_message(admin_chat_id, f"Новый заказ:\n\n{order_details}")
-
-                else:
-                    bot.send_message(chat_id, "Товар не найден.")
-    except ValueError as e:
-        bot.send_message(chat_id, f"Ошибка: {str(e)}")
+        else:
+            bot.send_message(chat_id, "Товар не найден.")
     except (Exception, psycopg2.Error) as error:
-        logging.error(f"Ошибка при подтверждении заказа: {error}")
+        logging.error("Ошибка при подтверждении заказа: %s", error)
         bot.send_message(chat_id, "Произошла ошибка при подтверждении заказа.")
 
-@bot.callback_query_handler(func=lambda call: call.data == "cancel_order")
+@router.route('cancel_order')
 def handle_cancel_order(call):
-    bot.send_message(call.message.chat.id, "Заказ отменен.")
+    answer(bot, call, "Заказ отменен.")
 
 
 
@@ -508,165 +417,91 @@ def pay_with_crypto(message):
 def handle_payment_receipt(message):
     chat_id = message.chat.id
 
-    logging.info(f"Received photo from chat_id {chat_id}")
-
-    if is_user_registered(chat_id):
-        user_info = get_user_info(chat_id)
-        if user_info is None:
-            logging.error("Failed to get user info.")
-            bot.send_message(chat_id, "Не удалось получить информацию о пользователе.")
-            return
+    logging.info("Received photo from chat_id %s", chat_id)
 
-        items = get_cart_items(chat_id)
-        if not items:
-            logging.info("Cart is empty.")
-            bot.send_message(chat_id, "Ваша корзина пуста.")
-            return
-
-        order_summary = []
-        total_amount = 0
-        for item in items:
-            product_id, name, price, quantity = item
-            try:
-                price = float(price)
-                quantity = int(quantity)
-                total_amount += price * quantity
-                order_summary.append(f"{name} - {quantity} шт. - {price} тг. за шт.")
-            except ValueError:
-                order_summary.append(f"{name} - {quantity} шт.")
-
-        order_summary_text = "\n".join(order_summary)
+    user_id = users.resolve(chat_id)
+    if user_id:
         order_details = {
-            'order_summary': order_summary_text,
-            'total_amount': total_amount,
-            'name': user_info.get('name', 'Не указано'),
-            'address': user_info.get('address', 'Не указано'),
-            'phone': user_info.get('phone', 'Не указано')
+            'name': 'Не указано',
+            'address': 'Не указано',
+            'phone': 'Не указано'
         }
 
-        try:
-            save_order(chat_id, order_details)
-            logging.info("Order saved successfully.")
-        except Exception as e:
-            logging.error(f"Failed to save order: {e}")
-
-        admin_chat_id = GROUP_ID
-        bot.forward_message(admin_chat_id, chat_id, message.message_id)
-        bot.send_message(admin_chat_id, f"Пользователь оплатил заказ:\n\n{order_details}")
+        def notifications(order_id, lines, total_amount):
+            formatted_order_details = (
+                f"Пользователь оплатил заказ #{order_id}:\n\n"
+                f"Товары:\n{format_order_summary(lines)}\n\n"
+                f"Итого: {total_amount:.2f} тг."
+            )
+            return [text_message(ADMIN_GROUP_ID, formatted_order_details),
+                    copy_message(ADMIN_GROUP_ID, chat_id, message.message_id, caption=f"Чек к заказу #{order_id}.")]
+
+        # Чек по корзине - заказ оформляется так же, как в конце checkout, вместе с очисткой корзины
+        # и уведомлениями в outbox
+        order_id = place_order(user_id, order_details, notifications)
+        if order_id is None:
+            bot.send_message(chat_id, "Не удалось оформить заказ: корзина пуста или произошла ошибка. "
+                                      "Пожалуйста, попробуйте снова.")
+            return
 
         bot.send_message(chat_id, "Спасибо за покупку! Ваш чек отправлен администратору.")
+        outbox.notify()
     else:
         bot.send_message(chat_id, "Вы не зарегистрированы. Пожалуйста, нажмите /start для регистрации.")
 
 
 # --------------------------------------------------------------------------------------------------------
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("add_to_cart_"))
-def handle_add_to_cart(call):
+@router.route('add_to_cart', int)
+def handle_add_to_cart(call, product_id):
     try:
-        # Получаем product_id из callback_data
-        data = call.data.split('_')
-        logging.info(f"Callback data: {data}")
-
-        if len(data) != 4 or data[0] != 'add' or data[1] != 'to' or data[2] != 'cart':
-            logging.error("Ошибка: некорректный формат callback_data.")
-            bot.send_message(call.message.chat.id, "Ошибка: некорректный формат данных.")
-            return
-
-        product_id_str = data[3]
-        logging.info(f"Extracted product_id_str: {product_id_str}")
-
-        try:
-            product_id = int(product_id_str)
-            logging.info(f"Converted product_id: {product_id}")
-        except ValueError as e:
-            logging.error(f"Ошибка преобразования product_id: {e}")
-            bot.send_message(call.message.chat.id, "Ошибка: некорректный идентификатор товара.")
-            return
-
         chat_id = call.message.chat.id  # Получаем chat_id пользователя
 
-        logging.info(f"Handling add to cart for user {chat_id} and product {product_id}")
+        logging.info("Handling add to cart for user %s and product %s", chat_id, product_id)
 
         # Проверяем, существует ли пользователь в таблице users
-        with psycopg2.connect(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT,
-                              database=DB_NAME) as connection:
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT * FROM users WHERE chat_id = %s", (chat_id,))
-                user = cursor.fetchone()
-
-                if user:
-                    # Пользователь существует, добавляем товар в корзину
-                    add_to_cart(chat_id, product_id)
-
-                    # Создаем клавиатуру с кнопкой "Посмотреть корзину"
-                    markup = types.InlineKeyboardMarkup()
-                    view_cart_button = types.InlineKeyboardButton(
-                        "Посмотреть корзину",
-                        callback_data="view_cart"
-                    )
-                    markup.add(view_cart_button)
-
-                    bot.send_message(
-                        chat_id,
-                        f"Товар с ID {product_id} добавлен в корзину.",
-                        reply_markup=markup
-                    )
-                else:
-                    # Пользователь не найден в базе данных
-                    bot.send_message(chat_id, "Ошибка: вы не зарегистрированы. Нажмите /start для регистрации.")
+        user_id = users.resolve(chat_id)
+        if user_id:
+            # Пользователь существует, добавляем товар в корзину
+            add_to_cart(user_id, product_id)
+
+            # Всплывающее уведомление вместо нового сообщения, корзина - кнопкой на карточке товара
+            answer(bot, call, "Товар добавлен в корзину.")
+        else:
+            # Пользователь не найден в базе данных
+            answer(bot, call, "Ошибка: вы не зарегистрированы. Нажмите /start для регистрации.", show_alert=True)
     except (Exception, psycopg2.Error) as error:
         logging.error("Ошибка при обработке запроса: %s", error)
-        bot.send_message(call.message.chat.id,
-                         "Произошла ошибка при добавлении товара в корзину. Пожалуйста, попробуйте позже.")
+        answer(bot, call, "Произошла ошибка при добавлении товара в корзину. Пожалуйста, попробуйте позже.",
+               show_alert=True)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "view_cart")
+@router.route('view_cart')
 def handle_view_cart(call):
     chat_id = call.message.chat.id
-    logging.info(f"User {chat_id} requested to view cart")
+    logging.info("User %s requested to view cart", chat_id)
 
-    items = get_cart_items(chat_id)
+    user_id = users.resolve(chat_id)
+    items, total_amount = get_cart_summary(user_id) if user_id else ([], 0)
     if items:
-        response = "Ваша корзина:\n ----------------- \n"
-        total_amount = 0
-        markup = types.InlineKeyboardMarkup()
-
-        for item in items:
-            product_id, name, price, quantity = item
-            try:
-                price = float(price)
-                quantity = int(quantity)
-                total_amount += price * quantity
-                response += (f" {name} "
-                             f"\n Кол-во: {quantity} шт."
-                             f"\n Цена: {price} тг. за шт.\n")
-            except ValueError:
-                logging.error(f"Ошибка преобразования данных для товара {product_id}.")
-                response += f"{name} - {quantity} шт.\n"
-
-        response += f" ----------------- \nИтого: {total_amount:.2f} тг."
-
-        clear_cart_button = types.InlineKeyboardButton("Очистить корзину", callback_data="clear_cart")
-        checkout_button = types.InlineKeyboardButton("Оформить заказ", callback_data="order_0")  # Передаем правильный идентификатор
-        markup.add(clear_cart_button, checkout_button)
-
-        bot.send_message(chat_id, response, reply_markup=markup)
+        show_text(bot, call, format_cart(items, total_amount), reply_markup=cart_markup())
     else:
-        bot.send_message(chat_id, "Ваша корзина пуста.")
+        answer(bot, call, "Ваша корзина пуста.")
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "clear_cart")
+@router.route('clear_cart')
 def handle_clear_cart(call):
     chat_id = call.message.chat.id
-    logging.info(f"User {chat_id} requested to clear cart")
+    logging.info("User %s requested to clear cart", chat_id)
 
     try:
-        clear_cart(chat_id)
-        bot.send_message(chat_id, "Ваша корзина была очищена.")
+        user_id = users.resolve(chat_id)
+        if user_id:
+            clear_cart(user_id)
+        show_text(bot, call, "Ваша корзина была очищена.", reply_markup=catalog.get_catalog_markup())
     except Exception as e:
-        logging.error(f"Ошибка при очистке корзины: {e}")
-        bot.send_message(chat_id, "Произошла ошибка при очистке корзины. Пожалуйста, попробуйте позже.")
+        logging.error("Ошибка при очистке корзины: %s", e)
+        answer(bot, call, "Произошла ошибка при очистке корзины. Пожалуйста, попробуйте позже.", show_alert=True)
 
 
 
@@ -683,6 +518,8 @@ def admin_commands(message):
         markup.add(types.KeyboardButton('/add_product'))
         # markup.add(types.KeyboardButton('/edit_product'))
         markup.add(types.KeyboardButton('/delete_product'))
+        markup.add(types.KeyboardButton('/import_catalog'))
+        markup.add(types.KeyboardButton('/broadcast'))
         bot.send_message(message.chat.id, "Выберите действие:", reply_markup=markup)
     else:
         bot.send_message(message.chat.id, "У вас нет доступа к этой команде.")
@@ -711,9 +548,58 @@ def admin_commands(message):
 
 
 
+def run_sync_bot():
+    catalog.warm()
+    dispatcher = install_dispatcher(bot, WORKER_POOL_SIZE, WORKER_QUEUE_SIZE)
+    try:
+        if BOT_MODE == 'webhook':
+            if WEBHOOK_URL:
+                bot.remove_webhook()
+                bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET_TOKEN or None)
+            server = WebhookServer(bot, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN,
+                                   WEBHOOK_QUEUE_SIZE)
+            try:
+                server.serve_forever()
+            finally:
+                server.shutdown()
+        else:
+            bot.polling(none_stop=True, interval=0, timeout=60)
+    finally:
+        dispatcher.stop()
+
+
 if __name__ == '__main__':
-    logging.basicConfig(level=logging.INFO)
-    bot.polling(none_stop=True, interval=0, timeout=60)
+    setup_logging()
+    if METRICS_PORT:
+        instrument_bot(bot, machine, router)
+        instrument_bot_api()
+        registry.add_gauges('bot_outbound_scheduler', "Состояние планировщика исходящих запросов (outbound.py)",
+                            scheduler.stats)
+        registry.add_gauges('bot_log_records_dropped', "Записи лога, отброшенные сэмплированием, лимитом или "
+                                                       "переполнением очереди (logs.py)", log_stats.snapshot)
+        registry.add_gauges('bot_outbox_messages', "Уведомления администраторам из outbox (outbox.py)", outbox.stats)
+        registry.add_gauges('bot_image_pipeline', "Пережатые фото товаров и сэкономленные байты (images.py)",
+                            image_pipeline.stats)
+        start_metrics_server(METRICS_LISTEN, METRICS_PORT)
+    # Все отправки сообщений идут через планировщик с лимитами Bot API
+    scheduler.install(bot)
+    broadcaster.resume()
+    # Уведомления, не отправленные до перезапуска, уходят сразу
+    outbox.start()
+    outbox.notify()
+    try:
+        if BOT_RUNTIME == 'async':
+            # Async-рантайм использует этот же бот для ещё не перенесённых обработчиков
+            import async_bot
+
+            async_bot.run(bot)
+        else:
+            run_sync_bot()
+    finally:
+        outbox.stop()
+        scheduler.stop()
+        close_pool()
+        shutdown_logging()
     # logging.basicConfig(level=logging.INFO)
     # start_bot()
 
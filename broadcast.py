@@ -0,0 +1,144 @@
+import logging
+import threading
+
+from telebot.apihelper import ApiTelegramException
+
+from catalog_cache import catalog
+from database import create_broadcast, get_running_broadcasts, get_broadcast_recipients, save_broadcast_progress, \
+    finish_broadcast
+from keyboards import product_card_markup
+from media import send_product_photo
+from outbound import scheduler, unwrap, wait, PRIORITY_BULK, SchedulerStopped
+from user_registry import users
+
+
+# --------------------------------------------------------------------------------------------------------
+# Рассылка всем зарегистрированным пользователям (/broadcast).
+#
+# Получатели читаются страницами по users.id (keyset-пагинация), страница целиком ставится в очередь
+# планировщика outbound.py с самым низким приоритетом - он сам держит максимально допустимую скорость
+# и пропускает вперёд ответы покупателям. После каждой страницы прогресс сохраняется в таблицу
+# broadcasts, поэтому после падения рассылка продолжается с того же места (повторно может уйти
+# не больше одной страницы). При остановке бота прогресс сдвигается только за получателей, которым
+# отправка действительно завершилась - остальные получат сообщение после перезапуска.
+# Пользователи, заблокировавшие бота, помечаются users.is_blocked и убираются из кэша
+# chat_id -> users.id.
+
+def product_broadcast_caption(product):
+    return (f"Новинка в PANDA SHOP 🐼\n\nНазвание: <b>{product.name}</b>\n\n"
+            f"Цена: {product.price} тг.\n\nРазмеры: {', '.join(product.sizes)}")
+
+
+def product_broadcast_markup(product):
+    return product_card_markup(product.id)
+
+
+class Broadcaster:
+    def __init__(self, bot, page_size):
+        self.bot = bot
+        self.page_size = page_size
+
+    def start(self, text, product_id, created_by):
+        broadcast_id = create_broadcast(text, product_id, created_by)
+        self._spawn(broadcast_id, text, product_id, 0, created_by)
+        return broadcast_id
+
+    def resume(self):
+        """Продолжает рассылки, прерванные перезапуском бота."""
+        try:
+            broadcasts = get_running_broadcasts()
+        except Exception as error:
+            logging.error("Failed to load running broadcasts: %s", error)
+            return
+        for broadcast_id, text, product_id, last_user_id, created_by in broadcasts:
+            logging.info("Resuming broadcast %s after user %s", broadcast_id, last_user_id)
+            self._spawn(broadcast_id, text, product_id, last_user_id, created_by)
+
+    def _spawn(self, *args):
+        scheduler.start()
+        thread = threading.Thread(target=self._run, args=args, name=f"Broadcast-{args[0]}", daemon=True)
+        thread.start()
+
+    def _prepare_send(self, text, product_id, created_by):
+        """Возвращает (метод, аргументы, именованные аргументы) для отправки одному получателю."""
+        if product_id is None:
+            return unwrap(self.bot.send_message), (text,), {}
+
+        product = catalog.get_product(product_id)
+        if product is None:
+            return None
+        if not product.photo_file_id and created_by:
+            # Карточка ещё ни разу не загружалась - отправляем её автору рассылки, чтобы получить file_id
+            wait(send_product_photo(self.bot, created_by, product, caption=product_broadcast_caption(product),
+                                    parse_mode='HTML', reply_markup=product_broadcast_markup(product)))
+            product = catalog.get_product(product_id)
+        if not product.photo_file_id:
+            return None
+        kwargs = {
+            'caption': product_broadcast_caption(product),
+            'parse_mode': 'HTML',
+            'reply_markup': product_broadcast_markup(product),
+        }
+        return unwrap(self.bot.send_photo), (product.photo_file_id,), kwargs
+
+    def _run(self, broadcast_id, text, product_id, last_user_id, created_by):
+        try:
+            prepared = self._prepare_send(text, product_id, created_by)
+            if prepared is None:
+                logging.error("Broadcast %s: product %s is unavailable", broadcast_id, product_id)
+                finish_broadcast(broadcast_id)
+                return
+            method, args, kwargs = prepared
+
+            while True:
+                recipients = get_broadcast_recipients(last_user_id, self.page_size)
+                if not recipients:
+                    break
+
+                futures = [(user_id, chat_id, scheduler.submit(method, chat_id, *args, priority=PRIORITY_BULK,
+                                                               **kwargs))
+                           for user_id, chat_id in recipients]
+                sent = failed = 0
+                blocked = []
+                completed_user_id = None
+                stopped = False
+                for user_id, chat_id, future in futures:
+                    try:
+                        future.result()
+                        sent += 1
+                    except SchedulerStopped:
+                        # Бот останавливается: этому и следующим получателям отправка не завершилась
+                        stopped = True
+                        break
+                    except ApiTelegramException as error:
+                        # 403: бот заблокирован или аккаунт удалён
+                        if error.error_code == 403:
+                            blocked.append((user_id, chat_id))
+                        else:
+                            failed += 1
+                    except Exception:
+                        failed += 1
+                    completed_user_id = user_id
+
+                if completed_user_id is not None:
+                    last_user_id = completed_user_id
+                    save_broadcast_progress(broadcast_id, last_user_id, sent, failed,
+                                            [user_id for user_id, _ in blocked])
+                for _, chat_id in blocked:
+                    users.forget(chat_id)
+                if stopped:
+                    logging.info("Broadcast %s paused by shutdown after user %s", broadcast_id, last_user_id)
+                    return
+
+            sent, failed, blocked = finish_broadcast(broadcast_id)
+            logging.info("Broadcast %s finished: sent=%s failed=%s blocked=%s", broadcast_id, sent, failed, blocked)
+            if created_by:
+                self.bot.send_message(created_by, f"Рассылка #{broadcast_id} завершена.\n\n"
+                                                  f"Отправлено: {sent}\nОшибок: {failed}\n"
+                                                  f"Заблокировали бота: {blocked}")
+        except SchedulerStopped:
+            # Статус остаётся 'running' - рассылка продолжится при следующем запуске
+            logging.info("Broadcast %s paused by shutdown after user %s", broadcast_id, last_user_id)
+        except Exception as error:
+            # Статус остаётся 'running' - рассылка продолжится при следующем запуске
+            logging.exception("Broadcast %s interrupted: %s", broadcast_id, error)
@@ -0,0 +1,79 @@
+import logging
+
+from navigation import answer
+
+
+# --------------------------------------------------------------------------------------------------------
+# Маршрутизация нажатий на инлайн-кнопки.
+#
+# callback_data имеет вид <действие>[_<аргумент>...], например category_3, add_to_cart_15,
+# catpage_3_n_57. Вместо цепочки startswith для каждого нажатия строка один раз разбивается по "_",
+# действие ищется в словаре (сначала самое длинное: order_0 раньше order), аргументы приводятся к
+# типам маршрута. Время поиска не зависит от числа маршрутов - только от числа слов в действии.
+#
+#   @router.route('add_to_cart', int)
+#   def handle_add_to_cart(call, product_id): ...
+
+SEPARATOR = '_'
+
+
+class CallbackRouter:
+    def __init__(self):
+        # действие -> (обработчик, преобразователи аргументов)
+        self._routes = {}
+        self._max_words = 1
+        self._bot = None
+
+    def route(self, action, *converters):
+        """Регистрирует обработчик handler(call, *args); converters - по одному на аргумент (int, str ...)."""
+        def decorator(handler):
+            if action in self._routes:
+                raise ValueError(f"Маршрут {action!r} уже зарегистрирован")
+            self._routes[action] = (handler, converters)
+            self._max_words = max(self._max_words, action.count(SEPARATOR) + 1)
+            return handler
+        return decorator
+
+    def wrap_routes(self, wrapper):
+        """Заменяет каждый обработчик на wrapper(action, handler) - например, для метрик."""
+        self._routes = {action: (wrapper(action, handler), converters)
+                        for action, (handler, converters) in self._routes.items()}
+
+    def resolve(self, data):
+        """Возвращает (обработчик, аргументы) или None, если такого маршрута нет."""
+        parts = data.split(SEPARATOR)
+        for words in range(min(len(parts), self._max_words), 0, -1):
+            route = self._routes.get(SEPARATOR.join(parts[:words]))
+            if route is None:
+                continue
+            handler, converters = route
+            args = parts[words:]
+            if len(args) != len(converters):
+                continue
+            try:
+                return handler, [convert(arg) for convert, arg in zip(converters, args)]
+            except ValueError:
+                return None
+        return None
+
+    def attach(self, bot):
+        # Один обработчик на все нажатия: TeleBot не перебирает предикаты маршрутов
+        self._bot = bot
+        bot.register_callback_query_handler(self._dispatch, func=lambda call: True)
+
+    def _dispatch(self, call):
+        logging.info("Handling callback query with data: %s", call.data)
+        resolved = self.resolve(call.data or '')
+        if resolved is None:
+            logging.warning("Unknown callback data: %s", call.data)
+            answer(self._bot, call, "Неизвестная команда.")
+            return
+        handler, args = resolved
+        try:
+            handler(call, *args)
+        finally:
+            # Убираем индикатор загрузки на кнопке, если обработчик не ответил сам
+            answer(self._bot, call)
+
+
+router = CallbackRouter()
@@ -0,0 +1,166 @@
+import dataclasses
+import logging
+import threading
+
+from config import CATALOG_PAGE_SIZE, CATALOG_PAGE_CACHE_SIZE, CATALOG_MARKUP_CACHE_SIZE
+from database import get_products_page, on_catalog_change
+from repository import get_categories, get_products
+from keyboards import catalog_markup, category_page_markup, product_card_markup, product_caption
+from search import SearchIndex
+
+
+# --------------------------------------------------------------------------------------------------------
+# Кэш каталога в памяти процесса.
+#
+# Категории и товары меняются только через админские команды (/add_category, /add_product,
+# /delete_product), поэтому при просмотре каталога читаем их отсюда, а не из PostgreSQL.
+# Кэш прогревается при старте бота и перестраивается после каждой записи в каталог.
+# Страницы категорий загружаются по требованию и живут, пока не сменится версия каталога.
+# Так же живут готовые к отправке клавиатуры (уже сериализованные в JSON - TeleBot передаёт
+# строку как есть) и подписи карточек товаров.
+
+class CatalogCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._categories = []
+        self._products_by_id = {}
+        self._pages = {}
+        self._markups = {}
+        self._search_index = SearchIndex((), ())
+        # Увеличивается при каждом изменении каталога
+        self.version = 0
+        # Перечитывать незагруженный кэш из базы при обращении. async_bot.py выключает это и загружает
+        # кэш сам через asyncpg, чтобы psycopg2 не блокировал цикл событий
+        self.autoload = True
+
+    def warm(self):
+        self.refresh()
+
+    def refresh(self):
+        return self.load(get_categories(), get_products())
+
+    def load(self, categories, products):
+        # Данные передаются снаружи, чтобы кэш можно было заполнить и из async_database
+        if categories is None or products is None:
+            # База недоступна - сбрасываем кэш, он загрузится при следующем обращении
+            logging.error("Failed to load catalog, cache will be reloaded on next access")
+            with self._lock:
+                self._loaded = False
+                self._pages = {}
+                self._markups = {}
+                self.version += 1
+            return False
+
+        # repository.Product / repository.Category
+        products_by_id = {product.id: product for product in products}
+        categories = list(categories)
+        # Индекс строится вне блокировки - до замены чтение идёт по старому
+        search_index = SearchIndex(products_by_id.values(), categories)
+
+        with self._lock:
+            self._categories = categories
+            self._products_by_id = products_by_id
+            self._search_index = search_index
+            self._pages = {}
+            self._markups = {}
+            self._loaded = True
+            self.version += 1
+        logging.info("Catalog cache loaded: %s categories, %s products", len(categories), len(products))
+        return True
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def _ensure_loaded(self):
+        if not self._loaded and self.autoload:
+            self.refresh()
+
+    def get_categories(self):
+        self._ensure_loaded()
+        return self._categories
+
+    def get_product(self, product_id):
+        self._ensure_loaded()
+        return self._products_by_id.get(product_id)
+
+    def search(self, query, limit):
+        """Лучшие по совпадению с запросом товары (repository.Product, как get_product)."""
+        self._ensure_loaded()
+        products_by_id = self._products_by_id
+        return [products_by_id[product_id] for product_id in self._search_index.search(query, limit)
+                if product_id in products_by_id]
+
+    def set_photo_file_id(self, product_id, file_id):
+        # file_id не влияет на вид каталога, поэтому версия не меняется
+        with self._lock:
+            product = self._products_by_id.get(product_id)
+            if product is None:
+                return
+            self._products_by_id[product_id] = dataclasses.replace(product, photo_file_id=file_id)
+
+    # ---------------------------------------------------------------------------------------------
+    # Страницы категорий: ключ (category_id, direction, cursor_id), значение - результат get_products_page
+
+    def get_cached_page(self, key):
+        with self._lock:
+            return self.version, self._pages.get(key)
+
+    def put_page(self, key, page, version):
+        with self._lock:
+            # Страница, прочитанная до изменения каталога, уже устарела
+            if version != self.version:
+                return
+            if len(self._pages) >= CATALOG_PAGE_CACHE_SIZE:
+                self._pages = {}
+            self._pages[key] = page
+
+    def get_products_page(self, category_id, direction='next', cursor_id=0):
+        key = (category_id, direction, cursor_id)
+        version, page = self.get_cached_page(key)
+        if page is None:
+            page = get_products_page(category_id, direction, cursor_id, CATALOG_PAGE_SIZE)
+            if page is not None:
+                self.put_page(key, page, version)
+        return page
+
+
+    # ---------------------------------------------------------------------------------------------
+    # Готовые клавиатуры и подписи: ключ ('catalog',), ('page', category_id, direction, cursor_id)
+    # или ('product', product_id)
+
+    def get_markup(self, key, build):
+        """Возвращает значение из кэша или build(), сохранённое до следующего изменения каталога."""
+        with self._lock:
+            version = self.version
+            value = self._markups.get(key)
+        if value is None:
+            value = build()
+            with self._lock:
+                if version == self.version:
+                    if len(self._markups) >= CATALOG_MARKUP_CACHE_SIZE:
+                        self._markups = {}
+                    self._markups[key] = value
+        return value
+
+    def get_catalog_markup(self):
+        return self.get_markup(('catalog',), lambda: catalog_markup(self.get_categories()).to_json())
+
+    def get_page_markup(self, key, page):
+        """Клавиатура страницы категории; key - (category_id, direction, cursor_id), по которому получена page."""
+        return self.get_markup(('page',) + key, lambda: category_page_markup(key[0], page).to_json())
+
+    def get_product_card(self, product_id):
+        """(товар, подпись, клавиатура) или None, если товара нет."""
+        product = self.get_product(product_id)
+        if product is None:
+            return None
+        caption, markup = self.get_markup(
+            ('product', product_id), lambda: (product_caption(product), product_card_markup(product_id).to_json()))
+        # Сам товар берётся свежим: в нём может появиться photo_file_id
+        return product, caption, markup
+
+
+catalog = CatalogCache()
+on_catalog_change(catalog.refresh)
@@ -0,0 +1,222 @@
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from PIL import Image
+
+from config import IMPORT_WORKERS
+from database import import_catalog, close_pool
+from images import store_image, format_size
+
+
+# --------------------------------------------------------------------------------------------------------
+# Массовый импорт каталога.
+#
+# Манифест - CSV с заголовком или JSON-список объектов с полями name, category, price, sizes, photo.
+# sizes - строка через запятую (как в /add_product) или JSON-список, photo - путь к файлу внутри
+# папки или zip-архива с фотографиями. Фото обрабатываются пулом потоков (images.store_image -
+# пережатие и имя по хэшу), затем каталог загружается в базу одной транзакцией
+# (database.import_catalog).
+#
+#   python catalog_import.py manifest.csv --images photos/
+#   python catalog_import.py catalog.zip          - manifest.csv или manifest.json в корне архива
+#
+# Из бота то же самое делает /import_catalog (admin.py): администратор присылает zip-архив.
+
+MANIFEST_NAMES = ('manifest.csv', 'manifest.json')
+
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+class CatalogImportError(Exception):
+    """Ошибка в манифесте или фотографиях - в базу ничего не записывается."""
+
+
+class _DirectorySource:
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self, name):
+        return os.path.isfile(os.path.join(self.path, name))
+
+    def read(self, name):
+        with open(os.path.join(self.path, name), 'rb') as file:
+            return file.read()
+
+    def close(self):
+        pass
+
+
+class _ZipSource:
+    def __init__(self, path_or_file):
+        # ZipFile сам сериализует чтение из общего файла, read() можно звать из нескольких потоков
+        self.archive = zipfile.ZipFile(path_or_file)
+        self.names = set(self.archive.namelist())
+
+    def exists(self, name):
+        return name in self.names
+
+    def read(self, name):
+        return self.archive.read(name)
+
+    def close(self):
+        self.archive.close()
+
+
+def open_image_source(path):
+    if os.path.isdir(path):
+        return _DirectorySource(path)
+    return _ZipSource(path)
+
+
+def parse_manifest(content, filename):
+    """Читает манифест из bytes/str. Формат определяется по расширению filename."""
+    if isinstance(content, bytes):
+        try:
+            content = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise CatalogImportError("Манифест должен быть в кодировке UTF-8")
+    if filename.lower().endswith('.json'):
+        try:
+            records = json.loads(content)
+        except ValueError as error:
+            raise CatalogImportError(f"Некорректный JSON-манифест: {error}")
+        if not isinstance(records, list):
+            raise CatalogImportError("JSON-манифест должен быть списком товаров")
+    else:
+        records = list(csv.DictReader(io.StringIO(content)))
+    return records
+
+
+def validate_records(records, source):
+    """Проверяет манифест целиком и возвращает [(name, category, price, sizes, photo)].
+
+    Все ошибки собираются в одно исключение, чтобы администратор исправил манифест за один раз.
+    """
+    errors = []
+    products = {}
+    for number, record in enumerate(records, start=1):
+        if not isinstance(record, dict):
+            errors.append(f"строка {number}: ожидается объект с полями товара")
+            continue
+        name = str(record.get('name') or '').strip()
+        category = str(record.get('category') or '').strip()
+        photo = str(record.get('photo') or '').strip()
+        sizes = record.get('sizes') or []
+        if isinstance(sizes, str):
+            sizes = sizes.split(',')
+        sizes = [str(size).strip() for size in sizes if str(size).strip()]
+
+        if not name or not category:
+            errors.append(f"строка {number}: не указано название или категория")
+            continue
+        try:
+            price = Decimal(str(record.get('price', '')).strip().replace(',', '.'))
+            if not price.is_finite() or price < 0:
+                raise InvalidOperation
+        except InvalidOperation:
+            errors.append(f"строка {number} ({name}): некорректная цена {record.get('price')!r}")
+            continue
+        if not photo or not source.exists(photo):
+            errors.append(f"строка {number} ({name}): нет файла фото {photo!r}")
+            continue
+        if os.path.splitext(photo)[1].lower() not in _IMAGE_EXTENSIONS:
+            errors.append(f"строка {number} ({name}): неподдерживаемый формат фото {photo!r}")
+            continue
+
+        if name in products:
+            logging.warning("Catalog import: duplicate product %r, row %s wins", name, number)
+        products[name] = (name, category, price, sizes, photo)
+
+    if errors:
+        raise CatalogImportError("\n".join(errors))
+    if not products:
+        raise CatalogImportError("Манифест не содержит товаров")
+    return list(products.values())
+
+
+def _store_photo(source, photo):
+    try:
+        return store_image(source.read(photo))
+    except (OSError, Image.DecompressionBombError) as error:
+        # PIL.UnidentifiedImageError - подкласс OSError
+        raise CatalogImportError(f"не удалось обработать фото {photo!r}: {error}")
+
+
+def ingest_photos(products, source, workers=IMPORT_WORKERS):
+    """Обрабатывает фото товаров и возвращает {путь в манифесте: StoredImage}."""
+    photos = sorted({product[4] for product in products})
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="CatalogImport") as executor:
+        # Первая же ошибка прерывает импорт до записи в базу
+        return dict(zip(photos, executor.map(lambda photo: _store_photo(source, photo), photos)))
+
+
+def run_import(records, source):
+    """Проверяет манифест, копирует фото и загружает каталог. Возвращает текст отчёта."""
+    started_at = time.monotonic()
+    products = validate_records(records, source)
+    photos = ingest_photos(products, source)
+    categories_created, inserted, updated = import_catalog(
+        [(name, category, price, sizes, photos[photo].filename) for name, category, price, sizes, photo in products])
+    elapsed = time.monotonic() - started_at
+    original_bytes = sum(stored.original_bytes for stored in photos.values())
+    stored_bytes = sum(stored.stored_bytes for stored in photos.values())
+    logging.info("Catalog import: %s products, %s photos in %.2f s", len(products), len(photos), elapsed)
+    return (f"Импортировано товаров: {len(products)} за {elapsed:.1f} с.\n"
+            f"Новых: {inserted}, обновлено: {updated}, новых категорий: {categories_created}\n"
+            f"Фото: {len(photos)}, {format_size(original_bytes)} -> {format_size(stored_bytes)}")
+
+
+def import_archive(path_or_file):
+    """Импорт из zip-архива с манифестом в корне."""
+    source = _ZipSource(path_or_file)
+    try:
+        manifest = next((name for name in MANIFEST_NAMES if source.exists(name)), None)
+        if manifest is None:
+            raise CatalogImportError("В архиве нет manifest.csv или manifest.json")
+        return run_import(parse_manifest(source.read(manifest), manifest), source)
+    finally:
+        source.close()
+
+
+def import_files(manifest_path, images_path):
+    with open(manifest_path, 'rb') as file:
+        records = parse_manifest(file.read(), manifest_path)
+    source = open_image_source(images_path)
+    try:
+        return run_import(records, source)
+    finally:
+        source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовый импорт каталога")
+    parser.add_argument('manifest', help="manifest.csv / manifest.json или zip-архив с манифестом и фото")
+    parser.add_argument('--images', help="папка или zip-архив с фотографиями (по умолчанию - папка манифеста)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        if zipfile.is_zipfile(args.manifest):
+            report = import_archive(args.manifest)
+        else:
+            report = import_files(args.manifest, args.images or os.path.dirname(os.path.abspath(args.manifest)))
+    except CatalogImportError as error:
+        print(f"Импорт отменён:\n{error}")
+        return 1
+    finally:
+        close_pool()
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,6 +16,8 @@ API_TOKEN = '7054860054:AAFdE_Zsc6pJiqAXjNi_gYMP0x2a1qRKD-I'
 ADMIN_IDS = ['5700886234', '575653773', '400577843']
 ADMIN_CHAT_ID = ['575653773', ]
 GROUP_ID ='-4200768048'
+# Чат группы администраторов для уведомлений о заказах (outbox.py)
+ADMIN_GROUP_ID = int(GROUP_ID)
 
 
 PHOTOS_DIR = 'static/products'
@@ -27,3 +29,123 @@ DB_PASSWORD = "TOBI8585"
 DB_HOST = "localhost"
 DB_PORT = "5432"
 
+
+# Пул соединений с PostgreSQL
+DB_POOL_MIN_CONN = 1
+DB_POOL_MAX_CONN = 10
+# Через сколько секунд простоя соединение проверяется запросом SELECT 1 перед выдачей
+DB_POOL_HEALTH_CHECK_INTERVAL = 30
+# Готовить горячие запросы на сервере (PREPARE) один раз на соединение. Выключить, если между ботом
+# и PostgreSQL стоит pgbouncer в режиме transaction pooling - там соединение сервера не закреплено за ботом
+DB_PREPARED_STATEMENTS = True
+
+
+# Пул воркеров для обработки апдейтов (апдейты одного чата обрабатываются по порядку)
+WORKER_POOL_SIZE = 8
+# Сколько апдейтов может ждать обработки (во всех чатах вместе); при заполнении polling ждёт освобождения места
+WORKER_QUEUE_SIZE = 800
+
+
+# Способ получения апдейтов: 'polling' или 'webhook'
+BOT_MODE = 'polling'
+# Публичный адрес webhook (https://example.com/webhook). Если пусто, setWebhook не вызывается -
+# удобно, когда несколько экземпляров стоят за балансировщиком и webhook регистрируется отдельно
+WEBHOOK_URL = ''
+WEBHOOK_LISTEN = '0.0.0.0'
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_SECRET_TOKEN = ''
+WEBHOOK_QUEUE_SIZE = 1000
+
+
+# Рантайм бота: 'sync' (TeleBot + psycopg2) или 'async' (AsyncTeleBot + asyncpg, см. async_bot.py)
+BOT_RUNTIME = 'sync'
+
+
+# Хранилище состояний диалогов (fsm.py): 'memory' или 'postgres'
+FSM_STORAGE = 'memory'
+# Незавершённый диалог сбрасывается после стольких секунд бездействия
+FSM_SESSION_TTL = 3600
+# Максимум одновременно хранимых диалогов для хранилища в памяти
+FSM_MAX_SESSIONS = 10000
+
+
+# Сколько соответствий chat_id -> users.id держать в памяти (user_registry.py)
+USER_CACHE_SIZE = 50000
+
+
+# Лимиты исходящих запросов к Bot API (outbound.py), сообщений в секунду
+OUTBOUND_GLOBAL_RATE = 30
+OUTBOUND_CHAT_RATE = 1
+OUTBOUND_CHAT_BURST = 3
+# В группы Telegram разрешает не больше 20 сообщений в минуту
+OUTBOUND_GROUP_RATE = 20 / 60
+OUTBOUND_GROUP_BURST = 3
+OUTBOUND_WORKERS = 8
+# Сколько раз повторять запрос после ответа 429
+OUTBOUND_MAX_RETRIES = 3
+# Как часто (в секундах) писать в лог размер очередей и задержку
+OUTBOUND_STATS_INTERVAL = 60
+
+
+# Уведомления администраторам через таблицу outbox (outbox.py)
+# Как часто (в секундах) проверять очередь, если новых уведомлений не было
+OUTBOX_POLL_INTERVAL = 5
+# Сколько секунд копить уведомления после первого, чтобы отправить всплеск одной сводкой
+OUTBOX_DIGEST_WINDOW = 2
+OUTBOX_BATCH_SIZE = 50
+# Сколько секунд забранное уведомление скрыто от других реплик (на случай падения посреди отправки)
+OUTBOX_LEASE = 120
+# Повторы после ошибки: задержка OUTBOX_BACKOFF_BASE * 2^(попытка - 1), но не больше OUTBOX_BACKOFF_MAX
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_BACKOFF_BASE = 5
+OUTBOX_BACKOFF_MAX = 900
+
+
+# Рассылки (/broadcast): сколько получателей читать из базы и отправлять за один шаг
+BROADCAST_PAGE_SIZE = 200
+
+
+# Сколько товаров показывать на одной странице категории
+CATALOG_PAGE_SIZE = 10
+# Сколько страниц категорий держать в кэше каталога
+CATALOG_PAGE_CACHE_SIZE = 1000
+# Сколько готовых клавиатур и подписей (меню, страницы, карточки товаров) держать в кэше каталога
+CATALOG_MARKUP_CACHE_SIZE = 20000
+
+
+# Потоков для копирования фотографий при импорте каталога (catalog_import.py)
+IMPORT_WORKERS = 8
+
+
+# Обработка фото товаров (images.py): максимальная длинная сторона и качество JPEG
+IMAGE_MAX_SIZE = 1280
+IMAGE_QUALITY = 85
+IMAGE_WORKERS = 2
+
+
+# Поиск товаров (search.py): результатов в ответ на /search и в inline-режиме (Telegram - до 50)
+SEARCH_RESULTS_LIMIT = 10
+INLINE_RESULTS_LIMIT = 20
+# Сколько секунд Telegram может кэшировать ответ на inline-запрос
+INLINE_CACHE_TIME = 60
+
+
+# Метрики Prometheus (metrics.py): http://METRICS_LISTEN:METRICS_PORT/metrics, 0 - выключить
+METRICS_LISTEN = '127.0.0.1'
+METRICS_PORT = 9100
+
+
+# Логирование (logs.py): уровень и формат - 'json' (одна запись - один JSON-объект) или 'text'
+LOG_LEVEL = 'INFO'
+LOG_FORMAT = 'json'
+# Записи сверх размера очереди отбрасываются, чтобы обработчики не ждали поток записи
+LOG_QUEUE_SIZE = 10000
+# Не больше стольких записей INFO в секунду с одной строки кода (0 - без ограничения)
+LOG_RATE_LIMIT = 20
+LOG_RATE_BURST = 100
+# Доля записей INFO, которые остаются, по 'модуль.функция'
+LOG_SAMPLE_RATES = {
+    'callbacks._dispatch': 0.1,
+    'bot.handle_add_to_cart': 0.1,
+}
@@ -9,9 +9,11 @@ CREATE TABLE products (
     id SERIAL PRIMARY KEY,
     name VARCHAR(255) NOT NULL,
     category_id INT NOT NULL REFERENCES categories(id),
-    price VARCHAR(50) NOT NULL,
+    price NUMERIC(10, 2) NOT NULL,
     sizes TEXT[] NOT NULL,
-    photo VARCHAR(255) NOT NULL
+    photo VARCHAR(255) NOT NULL,
+    -- file_id, который Telegram вернул после первой загрузки фото
+    photo_file_id VARCHAR(255)
 );
 
 CREATE TABLE users (
@@ -19,7 +21,9 @@ CREATE TABLE users (
     username VARCHAR(255),
     first_name VARCHAR(255),
     last_name VARCHAR(255),
-    chat_id BIGINT UNIQUE NOT NULL
+    chat_id BIGINT UNIQUE NOT NULL,
+    -- пользователь заблокировал бота, рассылки его пропускают
+    is_blocked BOOLEAN NOT NULL DEFAULT FALSE
 );
 
 CREATE TABLE orders (
@@ -27,13 +31,17 @@ CREATE TABLE orders (
     user_id INT NOT NULL REFERENCES users(id),
     status VARCHAR(50) NOT NULL,
     total_amount DECIMAL(10, 2) NOT NULL,
-    order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    customer_name VARCHAR(255),
+    address TEXT,
+    phone VARCHAR(50)
 );
 
 CREATE TABLE order_items (
     id SERIAL PRIMARY KEY,
     order_id INT NOT NULL REFERENCES orders(id),
-    product_id INT NOT NULL REFERENCES products(id),
+    -- NULL, если товар удалён из каталога
+    product_id INT REFERENCES products(id) ON DELETE SET NULL,
     quantity INT NOT NULL,
     price_per_unit DECIMAL(10, 2) NOT NULL
 );
@@ -42,9 +50,56 @@ CREATE TABLE carts (
     id SERIAL PRIMARY KEY,
     user_id BIGINT NOT NULL REFERENCES users(id),
     product_id INT NOT NULL REFERENCES products(id),
-    quantity INT NOT NULL
+    quantity INT NOT NULL,
+    CONSTRAINT carts_user_id_product_id_key UNIQUE (user_id, product_id)
+);
+
+CREATE TABLE fsm_states (
+    chat_id BIGINT PRIMARY KEY,
+    state VARCHAR(64) NOT NULL,
+    data JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE broadcasts (
+    id SERIAL PRIMARY KEY,
+    text TEXT,
+    product_id INT REFERENCES products(id) ON DELETE SET NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    -- users.id последнего обработанного получателя, с него рассылка продолжается после перезапуска
+    last_user_id INT NOT NULL DEFAULT 0,
+    sent INT NOT NULL DEFAULT 0,
+    failed INT NOT NULL DEFAULT 0,
+    blocked INT NOT NULL DEFAULT 0,
+    created_by BIGINT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE TABLE outbox (
+    id BIGSERIAL PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    -- 'text' (payload.text), 'photo' (payload.photo, payload.caption) или 'copy'
+    -- (payload.from_chat_id, payload.message_id, payload.caption)
+    kind VARCHAR(20) NOT NULL,
+    payload JSONB NOT NULL,
+    -- pending -> sent или failed после OUTBOX_MAX_ATTEMPTS неудачных попыток
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
 );
 
 
+CREATE INDEX products_category_id_id_idx ON products (category_id, id);
+CREATE INDEX products_name_idx ON products (name);
+CREATE INDEX carts_product_id_idx ON carts (product_id);
+CREATE INDEX orders_user_id_idx ON orders (user_id);
+CREATE INDEX order_items_order_id_idx ON order_items (order_id);
+CREATE INDEX outbox_pending_idx ON outbox (next_attempt_at, id) WHERE status = 'pending';
 
 
+-- Снимок текущей схемы для справки. Базу создаёт и обновляет python migrate.py (каталог migrations/),
+-- новые изменения схемы добавляются только новой миграцией.
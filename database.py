@@ -1,409 +1,747 @@
+import csv
+import functools
+import io
+import json
 import logging
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
 import psycopg2
-from psycopg2 import Error
-from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+import psycopg2.extras
+from psycopg2 import Error, errors, extensions, pool
+from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_POOL_MIN_CONN, DB_POOL_MAX_CONN, \
+    DB_POOL_HEALTH_CHECK_INTERVAL, DB_PREPARED_STATEMENTS
+from metrics import DB_QUERY_DURATION
 
 
-logging.basicConfig(level=logging.INFO)
+# --------------------------------------------------------------------------------------------------------
+# Пул соединений с PostgreSQL
+#
+# Все обращения к базе (database.py, bot.py, admin.py) идут через get_connection(), поэтому
+# соединение открывается один раз и переиспользуется между апдейтами.
 
-# Функция для подключения к базе данных PostgreSQL
-def connect_to_db():
-    try:
-        connection = psycopg2.connect(
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        print("Connected to PostgreSQL successfully")
-        return connection
-    except (Exception, Error) as error:
-        print("Error while connecting to PostgreSQL", error)
-        return None
+class PreparingConnection(extensions.connection):
+    """Соединение, которое помнит, какие запросы уже подготовлены на сервере (см. execute_prepared)."""
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
 
-# Получение информации о продукте по его имени
-def get_product_info(name):
-    connection = connect_to_db()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT * FROM products WHERE name = %s", (name,))
-            product = cursor.fetchone()
-            if product:
-                return {
-                    "name": product[1],
-                    "price": product[3],
-                    "sizes": product[4].split(','),  # Предположим, что размеры хранятся как строка с разделителем
-                    "photo": product[5]
-                }
-            else:
-                print(f"Product '{name}' not found in the database.")
-                return None
-        except (Exception, Error) as error:
-            print("Error fetching product information:", error)
-        finally:
-            if connection:
-                cursor.close()
-                connection.close()
-                print("PostgreSQL connection is closed")
-    else:
-        return None
 
+class ConnectionPool:
+    def __init__(self, minconn, maxconn, health_check_interval, **connect_kwargs):
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        # ThreadedConnectionPool бросает PoolError при исчерпании, семафор заставляет ждать свободное соединение
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._health_check_interval = health_check_interval
+        self._last_used = {}
 
-def insert_category(name):
-    connection = connect_to_db()
-    if connection:
+    def getconn(self):
+        self._slots.acquire()
         try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                INSERT INTO categories (name)
-                VALUES (%s)
-            """, (name,))
-            connection.commit()
-            print("Category inserted successfully")
-        except (Exception, Error) as error:
-            print("Error while inserting category:", error)
+            connection = self._pool.getconn()
+            if not self._is_healthy(connection):
+                logging.warning("Discarding broken PostgreSQL connection from pool")
+                self._pool.putconn(connection, close=True)
+                connection = self._pool.getconn()
+            return connection
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection):
+        try:
+            broken = connection.closed or \
+                connection.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN
+            if not broken:
+                self._last_used[id(connection)] = time.monotonic()
+            else:
+                self._last_used.pop(id(connection), None)
+            self._pool.putconn(connection, close=broken)
         finally:
-            if connection:
-                cursor.close()
-                connection.close()
-                print("PostgreSQL connection is closed")
+            self._slots.release()
 
+    def closeall(self):
+        self._pool.closeall()
+        self._last_used.clear()
 
-# Функция для вставки нового продукта в базу данных
-def insert_product(product_name, category_id, price, sizes, photo_filename):
-    connection = connect_to_db()
-    if connection:
+    def _is_healthy(self, connection):
+        if connection.closed:
+            return False
+        if connection.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        # Соединение, которое долго простаивало, могло быть закрыто сервером - проверяем его запросом
+        last_used = self._last_used.get(id(connection))
+        if last_used is not None and time.monotonic() - last_used < self._health_check_interval:
+            return True
         try:
-            cursor = connection.cursor()
-            cursor.execute("INSERT INTO products (name, category_id, price, sizes, photo) VALUES (%s, %s, %s, %s, %s)",
-                           (product_name, category_id, price, sizes, photo_filename))
-            connection.commit()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
             return True
-        except (Exception, Error) as error:
-            print("Error inserting product:", error)
+        except (Exception, Error):
             return False
-        finally:
-            if connection:
-                cursor.close()
-                connection.close()
-                print("PostgreSQL connection is closed")
-    else:
-        return False
 
 
-# Функция для добавления товара в корзину пользователя
-def add_to_cart(user_id, product_id):
-    connection = connect_to_db()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            logging.info(f"Adding product to cart for user_id: {user_id}, product_id: {product_id}")
-            cursor.execute("""
-                INSERT INTO carts (user_id, product_id, quantity)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (user_id, product_id) DO UPDATE
-                SET quantity = carts.quantity + 1
-            """, (user_id, product_id, 1))
-            connection.commit()
-            logging.info("Product added to cart successfully")
-        except (Exception, Error) as error:
-            logging.error("Error while adding product to cart: %s", error)
-        finally:
-            if connection:
-                cursor.close()
-                connection.close()
-                logging.info("PostgreSQL connection is closed")
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    DB_POOL_MIN_CONN,
+                    DB_POOL_MAX_CONN,
+                    DB_POOL_HEALTH_CHECK_INTERVAL,
+                    database=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    connection_factory=PreparingConnection
+                )
+                logging.info("PostgreSQL connection pool created (%s-%s connections)", DB_POOL_MIN_CONN,
+                             DB_POOL_MAX_CONN)
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            logging.info("PostgreSQL connection pool is closed")
+
+
+@contextmanager
+def get_connection():
+    """Выдаёт соединение из пула. При успешном выходе транзакция фиксируется, при ошибке - откатывается."""
+    try:
+        connection_pool = get_pool()
+        connection = connection_pool.getconn()
+    except BaseException:
+        _query_state.failed = True
+        raise
+    try:
+        yield connection
+        connection.commit()
+    except BaseException:
+        # Функции ниже сами ловят ошибки и возвращают None/False - отмечаем ошибку для метрик
+        _query_state.failed = True
+        if not connection.closed:
+            connection.rollback()
+        raise
+    finally:
+        connection_pool.putconn(connection)
 
 
+# --------------------------------------------------------------------------------------------------------
+# Подготовленные запросы.
+#
+# Запросы, которые выполняются почти на каждый апдейт (страница категории, корзина,
+# пользователь по chat_id, добавление в корзину), регистрируются через prepare() и выполняются через
+# execute_prepared(). На каждом соединении пула запрос один раз отправляется как PREPARE, дальше -
+# только EXECUTE с параметрами: PostgreSQL не разбирает и не анализирует текст запроса заново, а после
+# нескольких выполнений переиспользует и общий план. Подготовленный запрос живёт, пока живёт соединение,
+# откат транзакции его не удаляет.
+#
+# Если сервер забыл запрос (DISCARD ALL, другое соединение за pgbouncer) или его план устарел после
+# миграции ("cached plan must not change result type"), запрос один раз готовится заново и выполняется
+# повторно. Ошибка прерывает транзакцию, поэтому повтор возможен, только когда этот запрос её и начал;
+# иначе ошибка пробрасывается, а запрос будет подготовлен заново при следующем обращении.
+#
+# Текст запроса записывается как обычно, с %s, и при DB_PREPARED_STATEMENTS = False выполняется как есть.
+
+_statements = {}
+
+
+def prepare(name, query):
+    """Регистрирует запрос с параметрами %s под именем name и возвращает имя для execute_prepared."""
+    if name in _statements:
+        raise ValueError(f"Запрос {name!r} уже зарегистрирован")
+    _statements[name] = query
+    return name
+
+
+def statement_text(name):
+    """Текст зарегистрированного запроса с параметрами %s (например, для EXPLAIN в migrate.py --check)."""
+    return _statements[name]
+
+
+def _positional(query):
+    # %s -> $1, $2 ... в порядке следования: так параметры записываются в PREPARE
+    parts = query.split('%s')
+    return ''.join(part + (f"${number}" if number < len(parts) else '')
+                   for number, part in enumerate(parts, 1))
 
-# Пример использования:
-# add_to_cart(1, 5)  # Добавить товар с ID=5 в корзину пользователя с ID=1
 
+def _is_stale_plan(error):
+    return isinstance(error, errors.FeatureNotSupported) and \
+        'cached plan must not change result type' in str(error)
 
-def get_cart_items(user_id):
-    """Получает элементы корзины для пользователя."""
-    connection = connect_to_db()
-    if connection:
+
+def _prepare(cursor, name):
+    statement = f"PREPARE {name} AS {_positional(_statements[name])}"
+    connection = cursor.connection
+    # Точка сохранения нужна, чтобы ошибка PREPARE не прервала транзакцию вызывающего кода
+    savepoint = not connection.autocommit
+    if savepoint:
+        cursor.execute("SAVEPOINT prepare_statement")
+    try:
+        cursor.execute(statement)
+    except errors.DuplicatePreparedStatement:
+        # Запрос уже есть на сервере, но забыт на клиенте (после ошибки выше) - его план мог устареть
+        if savepoint:
+            cursor.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+        cursor.execute(f"DEALLOCATE {name}")
+        cursor.execute(statement)
+    if savepoint:
+        cursor.execute("RELEASE SAVEPOINT prepare_statement")
+    connection.prepared_statements.add(name)
+
+
+def _execute(cursor, name, params):
+    cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}",
+                   params)
+
+
+def execute_prepared(cursor, name, params=()):
+    connection = cursor.connection
+    prepared = getattr(connection, 'prepared_statements', None)
+    if not DB_PREPARED_STATEMENTS or prepared is None:
+        cursor.execute(_statements[name], params)
+        return
+
+    starts_transaction = connection.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+    if name not in prepared:
+        _prepare(cursor, name)
+    try:
+        _execute(cursor, name, params)
+    except (errors.InvalidSqlStatementName, errors.FeatureNotSupported) as error:
+        stale_plan = _is_stale_plan(error)
+        if isinstance(error, errors.FeatureNotSupported) and not stale_plan:
+            raise
+        prepared.discard(name)
+        if not starts_transaction:
+            raise
+        logging.warning("Re-preparing statement %s: %s", name, str(error).strip())
+        connection.rollback()
+        if stale_plan:
+            cursor.execute(f"DEALLOCATE {name}")
+        _prepare(cursor, name)
+        _execute(cursor, name, params)
+
+
+# --------------------------------------------------------------------------------------------------------
+# Метрики: время каждой функции ниже с результатом ok/error (metrics.py).
+# Функции ловят исключения сами, поэтому об ошибке запроса сообщает get_connection через _query_state.
+
+_query_state = threading.local()
+
+
+def instrumented(function):
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        _query_state.failed = False
+        started_at = time.perf_counter()
+        outcome = 'error'
         try:
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT p.id, p.name, p.price, c.quantity
-                    FROM carts c
-                    JOIN products p ON c.product_id = p.id
-                    WHERE c.user_id = %s
-                """, (user_id,))
-                items = cursor.fetchall()
-
-                # Логирование всех элементов корзины
-                for item in items:
-                    logging.info(f"Fetched item: {item}")
-
-                return items
-        except (Exception, psycopg2.Error) as error:
-            logging.error("Error while fetching cart items: %s", error)
-            return []
+            result = function(*args, **kwargs)
+            outcome = 'error' if _query_state.failed else 'ok'
+            return result
         finally:
-            if connection:
-                connection.close()
-                logging.info("PostgreSQL connection is closed")
-    else:
-        return []
+            DB_QUERY_DURATION.observe(time.perf_counter() - started_at, name, outcome)
+    return wrapper
 
 
-def save_order(user_id, order_details):
-    try:
-        connection = connect_to_db()
-        if connection:
-            cursor = connection.cursor()
-            logging.info(f"Saving order for user_id: {user_id} with details: {order_details}")
-
-            # Убедитесь, что все необходимые данные присутствуют
-            order_summary = order_details.get('order_summary', '')
-            total_amount = order_details.get('total_amount', 0)
-            name = order_details.get('name', 'Не указано')
-            address = order_details.get('address', 'Не указано')
-            phone = order_details.get('phone', 'Не указано')
-
-            # Запишите данные в базу данных
-            cursor.execute("""
-                INSERT INTO orders (user_id, status, total_amount)
-                VALUES (%s, 'pending', %s)
-            """, (user_id, total_amount))
-            connection.commit()
+# --------------------------------------------------------------------------------------------------------
+# Подписчики на изменения каталога (категории и товары).
+# Вызываются после успешной записи, чтобы кэши в памяти процесса (catalog_cache.py) могли обновиться.
 
-            logging.info("Order saved successfully.")
-    except (Exception, psycopg2.Error) as error:
-        logging.error(f"Error while saving order: {error}")
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            logging.info("PostgreSQL connection is closed")
+_catalog_listeners = []
 
 
+def on_catalog_change(callback):
+    _catalog_listeners.append(callback)
+    return callback
 
-def clear_cart(chat_id):
-    try:
-        connection = connect_to_db()
-        if connection:
-            cursor = connection.cursor()
-            logging.info(f"Clearing cart for chat_id: {chat_id}")
-            cursor.execute("DELETE FROM carts WHERE user_id = %s", (chat_id,))
-            connection.commit()
-            logging.info("Cart cleared successfully.")
-    except (Exception, psycopg2.Error) as error:
-        logging.error(f"Error while clearing cart: {error}")
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            logging.info("PostgreSQL connection is closed")
 
+def _notify_catalog_change():
+    for callback in _catalog_listeners:
+        try:
+            callback()
+        except Exception as error:
+            logging.error("Catalog change listener failed: %s", error)
 
 
+# --------------------------------------------------------------------------------------------------------
 
 
-def clear_cart(chat_id):
+@instrumented
+def insert_category(name):
     try:
-        with psycopg2.connect(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT, database=DB_NAME) as connection:
-            with connection.cursor() as cursor:
-                cursor.execute("DELETE FROM carts WHERE user_id = %s", (chat_id,))
-                connection.commit()
-    except (Exception, psycopg2.Error) as error:
-        logging.error("Ошибка при очистке корзины: %s", error)
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO categories (name)
+                VALUES (%s)
+            """, (name,))
+        _notify_catalog_change()
+        return True
+    except (Exception, Error) as error:
+        logging.error("Error while inserting category: %s", error)
+        return False
 
 
+# Функция для вставки нового продукта в базу данных
+@instrumented
+def insert_product(product_name, category_id, price, sizes, photo_filename):
+    try:
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("INSERT INTO products (name, category_id, price, sizes, photo) VALUES (%s, %s, %s, %s, %s)",
+                           (product_name, category_id, price, sizes, photo_filename))
+        _notify_catalog_change()
+        return True
+    except (Exception, Error) as error:
+        logging.error("Error inserting product: %s", error)
+        return False
 
 
+def _pg_array_literal(values):
+    return '{' + ','.join('"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"' for value in values) + '}'
+
+
+# Запросы import_catalog, которые сопоставляют товары по названию (migrate.py --check проверяет их планы;
+# им нужна временная таблица IMPORT_PRODUCTS_TABLE в той же транзакции)
+IMPORT_PRODUCTS_TABLE = """
+    CREATE TEMP TABLE import_products (
+        name VARCHAR(255) NOT NULL,
+        category VARCHAR(255) NOT NULL,
+        price NUMERIC(10, 2) NOT NULL,
+        sizes TEXT[] NOT NULL,
+        photo VARCHAR(255) NOT NULL,
+        category_id INT
+    ) ON COMMIT DROP
+"""
+IMPORT_PRODUCTS_UPDATE = """
+    UPDATE products p
+    SET category_id = s.category_id, price = s.price, sizes = s.sizes, photo = s.photo,
+        -- Имя фото - хэш содержимого: file_id остаётся верным, пока фото не сменилось
+        photo_file_id = CASE WHEN p.photo = s.photo THEN p.photo_file_id END
+    FROM import_products s
+    WHERE p.name = s.name
+"""
+IMPORT_PRODUCTS_INSERT = """
+    INSERT INTO products (name, category_id, price, sizes, photo)
+    SELECT s.name, s.category_id, s.price, s.sizes, s.photo FROM import_products s
+    WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.name = s.name)
+"""
+
+
+@instrumented
+def import_catalog(rows):
+    """Загружает каталог одной транзакцией: COPY во временную таблицу и upsert в categories/products.
+
+    rows - [(name, category, price, sizes, photo)]. Товар с таким же названием обновляется
+    (file_id фото сбрасывается, если сменилось фото), новые категории создаются.
+    Возвращает (создано категорий, добавлено товаров, обновлено товаров).
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for name, category, price, sizes, photo in rows:
+        writer.writerow((name, category, price, _pg_array_literal(sizes), photo))
+    buffer.seek(0)
+
+    with get_connection() as connection, connection.cursor() as cursor:
+        # Параллельный импорт или /add_product не должны создать дубликаты по названию
+        cursor.execute("LOCK TABLE categories, products IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(IMPORT_PRODUCTS_TABLE)
+        cursor.copy_expert("COPY import_products (name, category, price, sizes, photo) FROM STDIN WITH (FORMAT csv)",
+                           buffer)
+
+        cursor.execute("""
+            INSERT INTO categories (name)
+            SELECT DISTINCT s.category FROM import_products s
+            WHERE NOT EXISTS (SELECT 1 FROM categories c WHERE c.name = s.category)
+        """)
+        categories_created = cursor.rowcount
+        cursor.execute("""
+            UPDATE import_products s
+            SET category_id = (SELECT MIN(c.id) FROM categories c WHERE c.name = s.category)
+        """)
+
+        cursor.execute(IMPORT_PRODUCTS_UPDATE)
+        products_updated = cursor.rowcount
+        cursor.execute(IMPORT_PRODUCTS_INSERT)
+        products_inserted = cursor.rowcount
+
+    _notify_catalog_change()
+    return categories_created, products_inserted, products_updated
 
 
+# Функция для добавления товара в корзину пользователя
+CART_UPSERT = prepare('cart_upsert', """
+    INSERT INTO carts (user_id, product_id, quantity)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (user_id, product_id) DO UPDATE
+    SET quantity = carts.quantity + 1
+""")
 
 
+@instrumented
+def add_to_cart(user_id, product_id):
+    try:
+        with get_connection() as connection, connection.cursor() as cursor:
+            execute_prepared(cursor, CART_UPSERT, (user_id, product_id, 1))
+    except (Exception, Error) as error:
+        logging.error("Error while adding product to cart: %s", error)
 
-# Функция для получения всех продуктов из базы данных
-def get_all_products():
-    connection = connect_to_db()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT * FROM products")
-            rows = cursor.fetchall()
-            for row in rows:
-                print(row)
-            return rows
-        except (Exception, Error) as error:
-            print("Error while fetching data:", error)
-        finally:
-            if connection:
-                cursor.close()
-                connection.close()
-                print("PostgreSQL connection is closed")
 
+# Пример использования:
+# add_to_cart(1, 5)  # Добавить товар с ID=5 в корзину пользователя с ID=1
 
-def get_all_categories():
-    connection = connect_to_db()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT * FROM categories")
-            rows = cursor.fetchall()
-            for row in rows:
-                print(row)
-            return rows
-        except (Exception, Error) as error:
-            print("Error while fetching data:", error)
-        finally:
-            if connection:
-                cursor.close()
-                connection.close()
-                print("PostgreSQL connection is closed")
 
+@instrumented
+def save_order(user_id, order_details):
+    try:
+        logging.info("Saving order for user_id %s", user_id)
 
-# Функция для получения продуктов по ID категории
-def get_products_by_category(category_id):
-    connection = connect_to_db()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT * FROM products WHERE category_id = %s", (category_id,))
-            rows = cursor.fetchall()
-            return rows
-        except (Exception, Error) as error:
-            print("Error while fetching data:", error)
-        finally:
-            if connection:
-                cursor.close()
-                connection.close()
-    return None
+        # Убедитесь, что все необходимые данные присутствуют
+        total_amount = order_details.get('total_amount', 0)
+
+        # Запишите данные в базу данных
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO orders (user_id, status, total_amount)
+                VALUES (%s, 'pending', %s)
+            """, (user_id, total_amount))
+    except (Exception, psycopg2.Error) as error:
+        logging.error("Error while saving order: %s", error)
 
 
-def get_product_by_id(product_id):
+# Строки корзины, из которых оформляется заказ
+ORDER_CART_ROWS = "SELECT id FROM carts WHERE user_id = %s FOR UPDATE"
+
+
+@instrumented
+def place_order(user_id, details, notifications=None):
+    """Оформляет заказ из корзины в одной транзакции и возвращает id заказа.
+
+    Заказ, позиции order_items (одним INSERT ... SELECT по корзине) и очистка корзины либо
+    записываются вместе, либо не записываются вовсе. Число запросов не зависит от размера корзины.
+    notifications(order_id, lines, total_amount) возвращает уведомления [(chat_id, kind, payload)],
+    которые попадают в outbox в той же транзакции - заказ не может сохраниться без уведомления
+    администраторам. lines - записанные позиции [(название, количество, цена за единицу)], total_amount -
+    записанная сумма заказа: уведомление описывает ровно то, что сохранено, даже если корзина изменилась
+    во время оформления.
+    Каждый запрос READ COMMITTED видит свой снимок, поэтому заказ строится только из строк корзины,
+    заблокированных первым запросом: сумма считается по записанным позициям, удаляются только эти строки.
+    Возвращает None, если корзина пуста или произошла ошибка.
+    """
     try:
-        # Подключение к базе данных
-        connection = psycopg2.connect(
-            user="tab1k",
-            password="TOBI8585",
-            host="localhost",
-            port="5432",
-            database="bot_db"
-        )
+        with get_connection() as connection, connection.cursor() as cursor:
+            # Блокируем строки корзины, чтобы параллельное "В корзину" не изменило их посреди оформления
+            # Строка, добавленная в корзину параллельно, в заказ не попадёт и останется в корзине
+            cursor.execute(ORDER_CART_ROWS, (user_id,))
+            cart_ids = [cart_id for cart_id, in cursor.fetchall()]
+            if not cart_ids:
+                return None
 
-        cursor = connection.cursor()
+            cursor.execute("""
+                INSERT INTO orders (user_id, status, total_amount, customer_name, address, phone)
+                VALUES (%s, 'pending', 0, %s, %s, %s)
+                RETURNING id
+            """, (user_id, details.get('name'), details.get('address'), details.get('phone')))
+            order_id, = cursor.fetchone()
 
-        # Запрос к базе данных для получения информации о продукте по ID
-        cursor.execute(f"SELECT * FROM products WHERE id = {product_id}")
-        product = cursor.fetchone()  # Получаем одну строку с информацией о продукте
+            cursor.execute("""
+                WITH items AS (
+                    INSERT INTO order_items (order_id, product_id, quantity, price_per_unit)
+                    SELECT %s, c.product_id, c.quantity, p.price
+                    FROM carts c
+                    JOIN products p ON c.product_id = p.id
+                    WHERE c.id = ANY(%s)
+                    RETURNING product_id, quantity, price_per_unit
+                )
+                SELECT p.name, items.quantity, items.price_per_unit
+                FROM items
+                JOIN products p ON items.product_id = p.id
+                ORDER BY p.name
+            """, (order_id, cart_ids))
+            lines = cursor.fetchall()
+
+            total_amount = sum((quantity * price for _, quantity, price in lines), Decimal(0))
+            cursor.execute("UPDATE orders SET total_amount = %s WHERE id = %s", (total_amount, order_id))
+            cursor.execute("DELETE FROM carts WHERE id = ANY(%s)", (cart_ids,))
+
+            if notifications is not None:
+                _insert_outbox(cursor, notifications(order_id, lines, total_amount))
+        logging.info("Order %s placed for user_id %s", order_id, user_id)
+        return order_id
+    except (Exception, psycopg2.Error) as error:
+        logging.error("Error while placing order: %s", error)
+        return None
+
+
+@instrumented
+def clear_cart(user_id):
+    try:
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("DELETE FROM carts WHERE user_id = %s", (user_id,))
+        logging.info("Cart cleared for user %s", user_id)
+    except (Exception, psycopg2.Error) as error:
+        logging.error("Error while clearing cart: %s", error)
+
+
+# Страница товаров категории для клавиатуры каталога (keyset-пагинация по id).
+# direction 'next' - товары после cursor_id, 'prev' - товары перед cursor_id.
+PRODUCTS_PAGE_NEXT = prepare('products_page_next', """
+    SELECT id, name, price FROM products
+    WHERE category_id = %s AND id > %s
+    ORDER BY id
+    LIMIT %s
+""")
+PRODUCTS_PAGE_PREV = prepare('products_page_prev', """
+    SELECT id, name, price FROM products
+    WHERE category_id = %s AND id < %s
+    ORDER BY id DESC
+    LIMIT %s
+""")
+
+
+# Возвращает (строки (id, name, price), есть ли предыдущая страница, есть ли следующая)
+@instrumented
+def get_products_page(category_id, direction, cursor_id, limit):
+    try:
+        with get_connection() as connection, connection.cursor() as cursor:
+            statement = PRODUCTS_PAGE_PREV if direction == 'prev' else PRODUCTS_PAGE_NEXT
+            execute_prepared(cursor, statement, (category_id, cursor_id, limit + 1))
+            rows = cursor.fetchall()
+    except (Exception, Error) as error:
+        logging.error("Error while fetching data: %s", error)
+        return None
 
-        # Закрываем курсор и соединение с базой данных
-        cursor.close()
-        connection.close()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == 'prev':
+        return list(reversed(rows)), has_more, True
+    return rows, cursor_id > 0, has_more
 
-        return product  # Возвращаем информацию о продукте (кортеж)
 
+# Сохраняет file_id фотографии товара, полученный от Telegram после загрузки
+@instrumented
+def set_product_photo_file_id(product_id, file_id):
+    try:
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("UPDATE products SET photo_file_id = %s WHERE id = %s", (file_id, product_id))
+        return True
     except (Exception, Error) as error:
-        print("Ошибка при получении информации о продукте:", error)
-        return None  # В случае ошибки возвращаем None
+        logging.error("Error while saving photo file_id for product %s: %s", product_id, error)
+        return False
 
 
+PRODUCT_CARTS_DELETE = "DELETE FROM carts WHERE product_id = %s"
 
 
+@instrumented
 def delete_product_by_id(product_id):
-    connection = psycopg2.connect(
-        dbname="bot_db",
-        user="tab1k",
-        password="TOBI8585"
-    )
+    """Удаляет товар из каталога и корзин. Возвращает False, если товара нет или произошла ошибка.
 
+    В позициях прошлых заказов product_id обнуляется (ON DELETE SET NULL, миграция 0011).
+    """
     try:
-        with connection.cursor() as cursor:
+        with get_connection() as connection, connection.cursor() as cursor:
             # Удаляем продукт из корзин
-            cursor.execute("DELETE FROM carts WHERE product_id = %s", (product_id,))
+            cursor.execute(PRODUCT_CARTS_DELETE, (product_id,))
             # Удаляем продукт из основной таблицы
             cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
-            connection.commit()
-            print(f"Product {product_id} deleted successfully.")
+            deleted = cursor.rowcount > 0
+        if not deleted:
+            logging.warning("Product %s not found", product_id)
+            return False
+        logging.info("Product %s deleted", product_id)
+        _notify_catalog_change()
+        return True
     except psycopg2.Error as e:
-        print(f"Error deleting product {product_id}: {e}")
-    finally:
-        connection.close()
+        logging.error("Error deleting product %s: %s", product_id, e)
+        return False
 
 
-def clear_cart(user_id):
-    connection = connect_to_db()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            cursor.execute("DELETE FROM carts WHERE user_id = %s", (user_id,))
-            connection.commit()
-            logging.info(f"Cart cleared for user {user_id}")
-        except (Exception, psycopg2.Error) as error:
-            logging.error("Error while clearing cart: %s", error)
-        finally:
-            if connection:
-                cursor.close()
-                connection.close()
-                logging.info("PostgreSQL connection is closed")
+# Регистрация пользователя одним запросом: новый пользователь добавляется, у существующего
+# обновляются имя и username. Возвращает users.id
+@instrumented
+def upsert_user(chat_id, username, first_name, last_name):
+    with get_connection() as connection, connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO users (username, first_name, last_name, chat_id)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (chat_id) DO UPDATE
+            SET username = EXCLUDED.username,
+                first_name = EXCLUDED.first_name,
+                last_name = EXCLUDED.last_name,
+                is_blocked = FALSE
+            RETURNING id
+        """, (username, first_name, last_name, chat_id))
+        return cursor.fetchone()[0]
 
 
+# Возвращает users.id по chat_id или None, если пользователь не зарегистрирован
+USER_ID_BY_CHAT_ID = prepare('user_id_by_chat_id', "SELECT id FROM users WHERE chat_id = %s")
 
 
-
-# Функция для получения информации о заказе из базы данных
-def get_order_info(chat_id):
-    order_info = None
+@instrumented
+def get_user_id(chat_id):
     try:
-        with psycopg2.connect(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT,
-                              database=DB_NAME) as connection:
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT * FROM orders WHERE chat_id = %s", (chat_id,))
-                order_info = cursor.fetchone()
+        with get_connection() as connection, connection.cursor() as cursor:
+            execute_prepared(cursor, USER_ID_BY_CHAT_ID, (chat_id,))
+            row = cursor.fetchone()
+        return row[0] if row else None
     except (Exception, psycopg2.Error) as error:
-        print(f"Error retrieving order information: {error}")
-
-    return order_info
-
-
-# Получение адреса и телефона
-def get_user_info(chat_id):
-    connection = connect_to_db()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            logging.info(f"Fetching user info for chat_id: {chat_id}")  # Логирование запроса
-            cursor.execute("SELECT username, first_name, last_name FROM users WHERE chat_id = %s", (chat_id,))
-            result = cursor.fetchone()
-            logging.info(f"Query result: {result}")  # Логирование результата запроса
-
-            if result:
-                username = result[0] if result[0] else 'Не указано'
-                first_name = result[1] if result[1] else 'Не указано'
-                last_name = result[2] if result[2] else 'Не указано'
-
-                user_info = {
-                    'username': username,
-                    'first_name': first_name,
-                    'last_name': last_name
-                }
-                logging.info(f"User info retrieved: {user_info}")  # Логирование полученных данных
-                return user_info
-            else:
-                logging.info("User not found.")
-                return None
-        except (Exception, psycopg2.Error) as error:
-            logging.error("Error while fetching user info: %s", error)
-            return None
-        finally:
-            if connection:
-                cursor.close()
-                connection.close()
-                logging.info("PostgreSQL connection is closed")
-    else:
-        logging.error("Failed to connect to the database.")
+        logging.error("Error while fetching user id: %s", error)
         return None
 
 
-
+# --------------------------------------------------------------------------------------------------------
+# Рассылки
+
+
+@instrumented
+def create_broadcast(text, product_id, created_by):
+    with get_connection() as connection, connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO broadcasts (text, product_id, created_by)
+            VALUES (%s, %s, %s)
+            RETURNING id
+        """, (text, product_id, created_by))
+        return cursor.fetchone()[0]
+
+
+@instrumented
+def get_running_broadcasts():
+    with get_connection() as connection, connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT id, text, product_id, last_user_id, created_by
+            FROM broadcasts
+            WHERE status = 'running'
+            ORDER BY id
+        """)
+        return cursor.fetchall()
+
+
+# Страница получателей рассылки: keyset-пагинация по users.id вместо OFFSET
+BROADCAST_RECIPIENTS = """
+    SELECT id, chat_id FROM users
+    WHERE id > %s AND NOT is_blocked
+    ORDER BY id
+    LIMIT %s
+"""
+
+
+@instrumented
+def get_broadcast_recipients(after_user_id, limit):
+    with get_connection() as connection, connection.cursor() as cursor:
+        cursor.execute(BROADCAST_RECIPIENTS, (after_user_id, limit))
+        return cursor.fetchall()
+
+
+@instrumented
+def save_broadcast_progress(broadcast_id, last_user_id, sent, failed, blocked_user_ids):
+    with get_connection() as connection, connection.cursor() as cursor:
+        if blocked_user_ids:
+            cursor.execute("UPDATE users SET is_blocked = TRUE WHERE id = ANY(%s)", (list(blocked_user_ids),))
+        cursor.execute("""
+            UPDATE broadcasts
+            SET last_user_id = %s, sent = sent + %s, failed = failed + %s, blocked = blocked + %s
+            WHERE id = %s
+        """, (last_user_id, sent, failed, len(blocked_user_ids), broadcast_id))
+
+
+@instrumented
+def finish_broadcast(broadcast_id):
+    with get_connection() as connection, connection.cursor() as cursor:
+        cursor.execute("""
+            UPDATE broadcasts
+            SET status = 'finished', finished_at = NOW()
+            WHERE id = %s
+            RETURNING sent, failed, blocked
+        """, (broadcast_id,))
+        return cursor.fetchone()
+
+
+# --------------------------------------------------------------------------------------------------------
+# Очередь уведомлений администраторам (outbox.py)
+
+
+def _insert_outbox(cursor, messages):
+    if not messages:
+        return
+    psycopg2.extras.execute_values(cursor, """
+        INSERT INTO outbox (chat_id, kind, payload) VALUES %s
+    """, [(chat_id, kind, json.dumps(payload, ensure_ascii=False)) for chat_id, kind, payload in messages])
+
+
+@instrumented
+def enqueue_outbox(messages):
+    """Записывает уведомления [(chat_id, kind, payload)] в outbox."""
+    with get_connection() as connection, connection.cursor() as cursor:
+        _insert_outbox(cursor, messages)
+
+
+OUTBOX_CLAIM = """
+    UPDATE outbox o
+    SET attempts = o.attempts + 1, next_attempt_at = NOW() + make_interval(secs => %s)
+    FROM (
+        SELECT id FROM outbox
+        WHERE status = 'pending' AND next_attempt_at <= NOW()
+        ORDER BY next_attempt_at, id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ) due
+    WHERE o.id = due.id
+    RETURNING o.id, o.chat_id, o.kind, o.payload, o.attempts
+"""
+
+
+@instrumented
+def claim_outbox(limit, lease):
+    """Забирает до limit уведомлений, которым пора уйти, в порядке создания.
+
+    Забранные уведомления скрываются от других реплик бота на lease секунд: если процесс упадёт
+    посреди отправки, они уйдут после этого срока. Возвращает [(id, chat_id, kind, payload, attempts)].
+    """
+    with get_connection() as connection, connection.cursor() as cursor:
+        cursor.execute(OUTBOX_CLAIM, (lease, limit))
+        return sorted(cursor.fetchall())
+
+
+@instrumented
+def mark_outbox_sent(message_ids):
+    with get_connection() as connection, connection.cursor() as cursor:
+        cursor.execute("""
+            UPDATE outbox SET status = 'sent', sent_at = NOW(), last_error = NULL
+            WHERE id = ANY(%s)
+        """, (list(message_ids),))
+
+
+@instrumented
+def mark_outbox_failed(message_ids, error, max_attempts, backoff_base, backoff_max):
+    """Откладывает повтор с экспоненциальной задержкой; после max_attempts попыток - status = 'failed'."""
+    with get_connection() as connection, connection.cursor() as cursor:
+        cursor.execute("""
+            UPDATE outbox
+            SET last_error = %s,
+                status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                next_attempt_at = NOW() + make_interval(secs => LEAST(%s * 2 ^ (attempts - 1), %s))
+            WHERE id = ANY(%s)
+            RETURNING id, status
+        """, (str(error)[:1000], max_attempts, backoff_base, backoff_max, list(message_ids)))
+        return [message_id for message_id, status in cursor.fetchall() if status == 'failed']
 
@@ -0,0 +1,138 @@
+import logging
+import queue
+import threading
+from collections import deque
+
+from logs import log_context
+
+
+# --------------------------------------------------------------------------------------------------------
+# Параллельная обработка апдейтов с сохранением порядка внутри одного чата.
+#
+# У каждого чата своя очередь апдейтов, очереди разбирает общий пул воркеров. Чат, в котором есть
+# необработанные апдейты, стоит в общей очереди готовых чатов; воркер берёт из него один апдейт и,
+# если там есть ещё, ставит чат в конец очереди готовых. Поэтому апдейты одного чата обрабатываются
+# строго по очереди и никогда двумя потоками сразу (шаги оформления заказа видят сообщения в правильном
+# порядке), а медленный обработчик (импорт каталога, загрузка фото) занимает один воркер и задерживает
+# только свой чат. Число необработанных апдейтов ограничено: при заполнении submit() блокирует поток polling.
+
+_CHAT_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'my_chat_member',
+                'chat_member', 'chat_join_request')
+_USER_FIELDS = ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'poll_answer')
+
+
+def get_update_chat_id(update):
+    for field in _CHAT_FIELDS:
+        obj = getattr(update, field, None)
+        if obj is not None:
+            return obj.chat.id
+
+    call = getattr(update, 'callback_query', None)
+    if call is not None:
+        return call.message.chat.id if call.message else call.from_user.id
+
+    for field in _USER_FIELDS:
+        obj = getattr(update, field, None)
+        if obj is not None:
+            user = getattr(obj, 'from_user', None) or getattr(obj, 'user', None)
+            if user is not None:
+                return user.id
+
+    # Апдейты без чата (например, опросы) упорядочивать не нужно
+    return update.update_id
+
+
+# Сигнал воркеру завершиться
+_STOP = object()
+
+
+class ChatOrderedDispatcher:
+    def __init__(self, handler, workers, queue_size):
+        self._handler = handler
+        self._workers = workers
+        self._queue_size = queue_size
+        # chat_id -> апдейты чата, ещё не переданные обработчику. Чат есть в словаре, пока он стоит
+        # в очереди готовых или его апдейт обрабатывается - в обоих случаях ровно в одном месте
+        self._chats = {}
+        self._ready = queue.Queue()
+        self._pending = 0
+        self._changed = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        for index in range(self._workers):
+            thread = threading.Thread(target=self._run, name=f"UpdateWorker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info("Update dispatcher started with %s workers", self._workers)
+
+    def submit(self, update):
+        chat_id = get_update_chat_id(update)
+        with self._changed:
+            while self._pending >= self._queue_size:
+                self._changed.wait()
+            self._pending += 1
+            chat_updates = self._chats.get(chat_id)
+            if chat_updates is not None:
+                # Чат уже ждёт воркера или обрабатывается - апдейт будет взят после предыдущих
+                chat_updates.append(update)
+                return
+            self._chats[chat_id] = deque([update])
+        self._ready.put(chat_id)
+
+    def qsize(self):
+        with self._changed:
+            return self._pending
+
+    def stop(self):
+        # Дорабатываем уже принятые апдейты, затем останавливаем воркеры
+        with self._changed:
+            while self._pending:
+                self._changed.wait()
+        for _ in self._threads:
+            self._ready.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self):
+        while True:
+            chat_id = self._ready.get()
+            if chat_id is _STOP:
+                return
+            with self._changed:
+                update = self._chats[chat_id].popleft()
+            try:
+                # update_id попадает во все записи лога, сделанные при обработке апдейта
+                with log_context(update_id=update.update_id):
+                    self._handler(update)
+            except Exception as error:
+                logging.exception("Error while processing update: %s", error)
+            finally:
+                with self._changed:
+                    self._pending -= 1
+                    self._changed.notify_all()
+                    requeue = bool(self._chats[chat_id])
+                    if not requeue:
+                        del self._chats[chat_id]
+                if requeue:
+                    # В конец очереди: активный чат не занимает воркер в ущерб остальным
+                    self._ready.put(chat_id)
+
+
+def install_dispatcher(bot, workers, queue_size):
+    """Перенаправляет bot.process_new_updates в пул воркеров. Бот должен быть создан с threaded=False."""
+    process_new_updates = bot.process_new_updates
+    dispatcher = ChatOrderedDispatcher(lambda update: process_new_updates([update]), workers, queue_size)
+
+    def submit_updates(updates):
+        # offset для getUpdates сдвигаем сразу, иначе polling получит те же апдейты повторно
+        for update in updates:
+            if update.update_id > bot.last_update_id:
+                bot.last_update_id = update.update_id
+        for update in updates:
+            dispatcher.submit(update)
+
+    bot.process_new_updates = submit_updates
+    dispatcher.start()
+    return dispatcher
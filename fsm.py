@@ -0,0 +1,143 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config import FSM_STORAGE, FSM_SESSION_TTL, FSM_MAX_SESSIONS
+from database import get_connection
+
+
+# --------------------------------------------------------------------------------------------------------
+# Конечный автомат для многошаговых диалогов (оформление заказа, /add_product и другие админ-команды).
+#
+# Вместо замыканий register_next_step_handler для каждого чата хранится только имя шага и небольшой
+# словарь с данными. Хранилище подключаемое: память процесса (LRU с TTL) или таблица fsm_states
+# в PostgreSQL - тогда состояние переживает перезапуск и доступно всем репликам бота.
+
+class MemoryStateStorage:
+    def __init__(self, max_sessions, ttl):
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_sessions = max_sessions
+        self._ttl = ttl
+
+    def get(self, chat_id):
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is None:
+                return None
+            state, data, updated_at = session
+            if time.monotonic() - updated_at > self._ttl:
+                del self._sessions[chat_id]
+                return None
+            self._sessions.move_to_end(chat_id)
+            return state, data
+
+    def set(self, chat_id, state, data):
+        with self._lock:
+            self._sessions[chat_id] = (state, data, time.monotonic())
+            self._sessions.move_to_end(chat_id)
+            # Самые давно неактивные сессии вытесняются первыми
+            while len(self._sessions) > self._max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, chat_id):
+        with self._lock:
+            self._sessions.pop(chat_id, None)
+
+
+class PostgresStateStorage:
+    # Просроченные сессии удаляются не чаще, чем раз в столько секунд
+    PURGE_INTERVAL = 300
+
+    def __init__(self, ttl):
+        self._ttl = ttl
+        self._last_purge = 0
+
+    def get(self, chat_id):
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT state, data FROM fsm_states
+                WHERE chat_id = %s AND updated_at > NOW() - make_interval(secs => %s)
+            """, (chat_id, self._ttl))
+            row = cursor.fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, chat_id, state, data):
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO fsm_states (chat_id, state, data, updated_at)
+                VALUES (%s, %s, %s, NOW())
+                ON CONFLICT (chat_id) DO UPDATE
+                SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+            """, (chat_id, state, json.dumps(data)))
+        self._purge_expired()
+
+    def delete(self, chat_id):
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("DELETE FROM fsm_states WHERE chat_id = %s", (chat_id,))
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        if now - self._last_purge < self.PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("DELETE FROM fsm_states WHERE updated_at < NOW() - make_interval(secs => %s)",
+                           (self._ttl,))
+
+
+class StateMachine:
+    def __init__(self, storage):
+        self.storage = storage
+        self._handlers = {}
+
+    def step(self, state):
+        """Регистрирует обработчик шага: handler(message, data)."""
+        def decorator(handler):
+            self._handlers[state] = handler
+            return handler
+        return decorator
+
+    def wrap_steps(self, wrapper):
+        """Заменяет каждый обработчик шага на wrapper(state, handler) - например, для метрик."""
+        self._handlers = {state: wrapper(state, handler) for state, handler in self._handlers.items()}
+
+    def set_state(self, chat_id, state, data=None):
+        self.storage.set(chat_id, state, data or {})
+
+    def get_state(self, chat_id):
+        return self.storage.get(chat_id)
+
+    def finish(self, chat_id):
+        self.storage.delete(chat_id)
+
+    def attach(self, bot):
+        # Регистрируется раньше остальных обработчиков, чтобы шаг диалога получал сообщение первым.
+        # Команды (/start, /admin ...) проходят мимо автомата.
+        bot.register_message_handler(self._dispatch, func=self._is_active, content_types=['text', 'photo', 'document'])
+
+    def _is_active(self, message):
+        if message.text and message.text.startswith('/'):
+            return False
+        session = self.storage.get(message.chat.id)
+        if session is None or session[0] not in self._handlers:
+            return False
+        # Сохраняем найденную сессию, чтобы не читать хранилище второй раз в _dispatch
+        message.fsm_session = session
+        return True
+
+    def _dispatch(self, message):
+        state, data = message.fsm_session
+        logging.info("FSM step %s for chat %s", state, message.chat.id)
+        self._handlers[state](message, data)
+
+
+def create_storage():
+    if FSM_STORAGE == 'postgres':
+        return PostgresStateStorage(FSM_SESSION_TTL)
+    return MemoryStateStorage(FSM_MAX_SESSIONS, FSM_SESSION_TTL)
+
+
+machine = StateMachine(create_storage())
@@ -0,0 +1,84 @@
+from telebot import types
+
+
+# --------------------------------------------------------------------------------------------------------
+# Клавиатуры каталога, общие для синхронного (bot.py) и async (async_bot.py) режимов.
+# Клавиатуры каталога и карточек товаров не строятся на каждое нажатие - готовый JSON берётся
+# из кэша каталога (CatalogCache.get_markup).
+
+# Кнопки листания: catpage_<category_id>_<n|p>_<id крайнего товара на текущей странице>
+PAGE_CALLBACK_ACTION = "catpage"
+PAGE_CALLBACK_PREFIX = f"{PAGE_CALLBACK_ACTION}_"
+
+
+def catalog_markup(categories):
+    markup = types.InlineKeyboardMarkup()
+    for category in categories:
+        markup.add(types.InlineKeyboardButton(category.name, callback_data=f"category_{category.id}"))
+    markup.add(types.InlineKeyboardButton("Назад", callback_data="back_catalog"))
+    return markup
+
+
+def category_page_markup(category_id, page):
+    rows, has_prev, has_next = page
+    markup = types.InlineKeyboardMarkup()
+    for product_id, name, price in rows:
+        markup.add(types.InlineKeyboardButton(f"{name} - {price} тг.", callback_data=f"product_{product_id}"))
+
+    navigation = []
+    if has_prev and rows:
+        navigation.append(types.InlineKeyboardButton(
+            "« Назад", callback_data=f"{PAGE_CALLBACK_PREFIX}{category_id}_p_{rows[0][0]}"))
+    if has_next and rows:
+        navigation.append(types.InlineKeyboardButton(
+            "Далее »", callback_data=f"{PAGE_CALLBACK_PREFIX}{category_id}_n_{rows[-1][0]}"))
+    if navigation:
+        markup.row(*navigation)
+    # Список открывается на месте меню каталога, поэтому вернуться к нему можно только этой кнопкой
+    markup.add(types.InlineKeyboardButton("Каталог", callback_data="back_catalog"))
+    return markup
+
+
+def product_card_markup(product_id):
+    # Добавление в корзину отвечает всплывающим уведомлением, корзина открывается кнопкой рядом
+    markup = types.InlineKeyboardMarkup()
+    markup.row(types.InlineKeyboardButton("В корзину", callback_data=f"add_to_cart_{product_id}"),
+               types.InlineKeyboardButton("Корзина", callback_data="view_cart"))
+    return markup
+
+
+def product_caption(product):
+    return (f"ID товара: {product.id}\n\nНазвание: <b>{product.name}</b>\n\nЦена: {product.price} тг.\n\n"
+            f"Размеры: {', '.join(product.sizes)}")
+
+
+def format_cart(lines, total_amount):
+    response = "Ваша корзина:\n ----------------- \n"
+    for line in lines:
+        response += (f" {line.name} "
+                     f"\n Кол-во: {line.quantity} шт."
+                     f"\n Цена: {line.price} тг. за шт.\n")
+    return response + f" ----------------- \nИтого: {total_amount:.2f} тг."
+
+
+def cart_markup():
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("Очистить корзину", callback_data="clear_cart"),
+               types.InlineKeyboardButton("Оформить заказ", callback_data="order_0"))
+    markup.add(types.InlineKeyboardButton("Каталог", callback_data="back_catalog"))
+    return markup
+
+
+def page_direction(value):
+    """'p' -> 'prev', 'n' -> 'next' (аргумент маршрута catpage в callbacks.py)."""
+    if value == 'p':
+        return 'prev'
+    if value == 'n':
+        return 'next'
+    raise ValueError(f"Некорректное направление листания: {value!r}")
+
+
+def parse_page_callback(data):
+    """catpage_3_n_57 -> (3, 'next', 57)"""
+    category_id, direction, cursor_id = data[len(PAGE_CALLBACK_PREFIX):].split('_')
+    return int(category_id), page_direction(direction), int(cursor_id)
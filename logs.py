@@ -0,0 +1,174 @@
+import contextlib
+import contextvars
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_RATE_LIMIT, LOG_RATE_BURST, LOG_SAMPLE_RATES
+
+
+# --------------------------------------------------------------------------------------------------------
+# Логирование.
+#
+# Обработчики апдейтов только кладут запись в очередь (QueueHandler), форматирование и запись в
+# stderr делает отдельный поток (QueueListener). Записи уровня INFO и ниже с одного места в коде
+# ограничены по частоте (LOG_RATE_LIMIT в секунду) и могут сэмплироваться (LOG_SAMPLE_RATES),
+# предупреждения и ошибки проходят всегда. Каждая запись содержит update_id апдейта, во время
+# обработки которого она сделана, - по нему собираются все строки одного запроса.
+
+_context = contextvars.ContextVar('log_context', default={})
+
+# Поля LogRecord, которые не надо дублировать в JSON как extra
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'context'}
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """Добавляет поля (например, update_id) ко всем записям внутри блока."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {'sampled_out': 0, 'rate_limited': 0, 'queue_full': 0}
+
+    def increment(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+stats = _Stats()
+
+
+class ContextFilter(logging.Filter):
+    """Запоминает контекст в момент вызова - форматирование идёт позже, в другом потоке."""
+
+    def filter(self, record):
+        record.context = _context.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate, burst, sample_rates):
+        super().__init__()
+        self._rate = rate
+        self._burst = burst
+        self._sample_rates = sample_rates
+        self._lock = threading.Lock()
+        # (файл, строка) -> [токены, время последнего пополнения]
+        self._buckets = {}
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+
+        sample_rate = self._sample_rates.get(f"{record.module}.{record.funcName}")
+        if sample_rate is not None and random.random() >= sample_rate:
+            stats.increment('sampled_out')
+            return False
+
+        if not self._rate:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self._burst, now]
+            bucket[0] = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                stats.increment('rate_limited')
+                return False
+            bucket[0] -= 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        event.update(getattr(record, 'context', {}))
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                event[key] = value
+        if record.exc_info:
+            event['exception'] = self.formatException(record.exc_info)
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        context = getattr(record, 'context', None)
+        if context:
+            line += ' [' + ' '.join(f"{key}={value}" for key, value in context.items()) + ']'
+        return line
+
+
+class _DroppingQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        # Если поток записи не успевает, запись теряется, а обработчик апдейта не ждёт
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            stats.increment('queue_full')
+
+    def prepare(self, record):
+        # Сообщение и исключение форматируются в потоке записи, а не в обработчике
+        return record
+
+
+_listener = None
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """Настраивает корневой логгер: очередь + фоновый поток записи в stderr. Повторный вызов ничего не делает."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    if log_format == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(TextFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    queue_handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SamplingFilter(LOG_RATE_LIMIT, LOG_RATE_BURST, LOG_SAMPLE_RATES))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Дописывает оставшиеся в очереди записи."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
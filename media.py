@@ -0,0 +1,77 @@
+import logging
+import os
+import threading
+
+from catalog_cache import catalog
+from config import PHOTOS_DIR
+from database import set_product_photo_file_id
+from navigation import API_ERRORS, run_steps
+
+
+# --------------------------------------------------------------------------------------------------------
+# Отправка медиа по file_id.
+#
+# После первой загрузки Telegram возвращает file_id, по которому файл можно отправлять повторно
+# без передачи самих байтов. Для товаров file_id хранится в products.photo_file_id,
+# для стикера приветствия - в памяти процесса.
+
+_sticker_file_ids = {}
+_sticker_lock = threading.Lock()
+
+
+def is_rejected_file_id(error):
+    # Telegram отвечает 400 "wrong file identifier/HTTP URL specified" и похожими ошибками
+    return error.error_code == 400 and 'file' in str(error.description).lower()
+
+
+def product_photo_steps(chat_id, product, **kwargs):
+    """Шаги отправки фото товара (см. navigation.run_steps): по file_id, а если Telegram его не принял
+    или его ещё нет - загрузкой файла. Возвращает (сообщение, новый file_id или None)."""
+    if product.photo_file_id:
+        try:
+            return (yield 'send_photo', (chat_id, product.photo_file_id), kwargs), None
+        except API_ERRORS as error:
+            if not is_rejected_file_id(error):
+                raise
+            logging.warning("Telegram rejected cached file_id for product %s, re-uploading: %s", product.id, error)
+
+    with open(os.path.join(PHOTOS_DIR, product.photo), 'rb') as photo_file:
+        message = yield 'send_photo', (chat_id, photo_file), kwargs
+    return message, message.photo[-1].file_id if message.photo else None
+
+
+def _product_photo_with_save(chat_id, product, **kwargs):
+    message, new_file_id = yield from product_photo_steps(chat_id, product, **kwargs)
+    if new_file_id and set_product_photo_file_id(product.id, new_file_id):
+        catalog.set_photo_file_id(product.id, new_file_id)
+    return message
+
+
+def send_product_photo(bot, chat_id, product, **kwargs):
+    """Возвращает Future с отправленным сообщением; новый file_id сохраняется, когда фото загружено."""
+    return run_steps(bot, _product_photo_with_save(chat_id, product, **kwargs))
+
+
+def sticker_steps(chat_id, sticker_path):
+    with _sticker_lock:
+        file_id = _sticker_file_ids.get(sticker_path)
+
+    if file_id:
+        try:
+            return (yield 'send_sticker', (chat_id, file_id), {})
+        except API_ERRORS as error:
+            if not is_rejected_file_id(error):
+                raise
+            logging.warning("Telegram rejected cached sticker file_id, re-uploading: %s", error)
+
+    with open(sticker_path, 'rb') as sticker:
+        message = yield 'send_sticker', (chat_id, sticker), {}
+
+    if message.sticker:
+        with _sticker_lock:
+            _sticker_file_ids[sticker_path] = message.sticker.file_id
+    return message
+
+
+def send_sticker_file(bot, chat_id, sticker_path):
+    return run_steps(bot, sticker_steps(chat_id, sticker_path))
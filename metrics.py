@@ -0,0 +1,223 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import apihelper
+
+
+# --------------------------------------------------------------------------------------------------------
+# Метрики в формате Prometheus.
+#
+# Гистограммы времени выполнения обработчиков апдейтов, функций database.py и запросов к Bot API
+# с метками имени и результата (ok/error, для Bot API - код ошибки). Отдаются по HTTP на
+# METRICS_LISTEN:METRICS_PORT/metrics, например:
+#
+#   bot_handler_duration_seconds_bucket{handler="send_catalog",outcome="ok",le="0.1"} 42
+
+# Границы корзин в секундах: от быстрых ответов из кэша до медленных загрузок фото
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=''):
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # значения меток -> [счётчики по корзинам..., +Inf], сумма
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((label_values, list(counts), total) for label_values, (counts, total) in self._series.items())
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def histogram(self, name, documentation, labels, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_gauges(self, name, documentation, collect):
+        """collect() возвращает {подпись: значение}; подпись становится меткой name."""
+        self._collectors.append((name, documentation, collect))
+
+    def expose(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        for name, documentation, collect in self._collectors:
+            try:
+                values = collect()
+            except Exception as error:
+                logging.error("Metrics collector %s failed: %s", name, error)
+                continue
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(values.items()):
+                lines.append(f'{name}{{name="{_escape(key)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+HANDLER_DURATION = registry.histogram(
+    'bot_handler_duration_seconds', "Время обработки апдейта обработчиком", ('handler', 'outcome'))
+DB_QUERY_DURATION = registry.histogram(
+    'bot_db_query_duration_seconds', "Время выполнения функций database.py", ('function', 'outcome'))
+BOT_API_DURATION = registry.histogram(
+    'bot_api_request_duration_seconds', "Время запроса к Bot API", ('method', 'outcome'))
+
+
+# --------------------------------------------------------------------------------------------------------
+# Подключение к боту
+
+def _timed_handler(function, name):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started_at = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = function(*args, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            HANDLER_DURATION.observe(time.perf_counter() - started_at, name, outcome)
+    wrapper.__metrics_wrapped__ = True
+    return wrapper
+
+
+def instrument_bot(bot, machine=None, router=None):
+    """Оборачивает все зарегистрированные обработчики бота, шаги диалогов и маршруты кнопок. Вызывать после регистрации."""
+    skip = set()
+    if machine is not None:
+        skip.add(machine._dispatch)
+    if router is not None:
+        skip.add(router._dispatch)
+    for handlers in (bot.message_handlers, bot.edited_message_handlers, bot.callback_query_handlers,
+                     bot.inline_handlers):
+        for handler in handlers:
+            function = handler['function']
+            if function in skip or getattr(function, '__metrics_wrapped__', False):
+                continue
+            handler['function'] = _timed_handler(function, function.__name__)
+    if machine is not None:
+        # Сам диспетчер автомата не меряем - время попадает в метку конкретного шага "fsm:<состояние>"
+        machine.wrap_steps(lambda state, function: _timed_handler(function, f"fsm:{state}"))
+    if router is not None:
+        # Нажатия на кнопки меряются по обработчику маршрута, а не по общему диспетчеру
+        router.wrap_routes(lambda action, function: function if getattr(function, '__metrics_wrapped__', False)
+                           else _timed_handler(function, function.__name__))
+
+
+def instrument_bot_api():
+    """Измеряет каждый HTTP-запрос к Bot API (включая повторы после 429 из outbound.py)."""
+    make_request = apihelper._make_request
+    if getattr(make_request, '__metrics_wrapped__', False):
+        return
+
+    @functools.wraps(make_request)
+    def timed_make_request(token, method_name, *args, **kwargs):
+        started_at = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = make_request(token, method_name, *args, **kwargs)
+            outcome = 'ok'
+            return result
+        except apihelper.ApiTelegramException as error:
+            outcome = str(error.error_code)
+            raise
+        finally:
+            BOT_API_DURATION.observe(time.perf_counter() - started_at, method_name, outcome)
+
+    timed_make_request.__metrics_wrapped__ = True
+    apihelper._make_request = timed_make_request
+
+
+def instrument_async_bot_api():
+    """То же для AsyncTeleBot (async_bot.py): его запросы идут через asyncio_helper, а не apihelper."""
+    from telebot import asyncio_helper
+
+    process_request = asyncio_helper._process_request
+    if getattr(process_request, '__metrics_wrapped__', False):
+        return
+
+    @functools.wraps(process_request)
+    async def timed_process_request(token, method_name, *args, **kwargs):
+        started_at = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = await process_request(token, method_name, *args, **kwargs)
+            outcome = 'ok'
+            return result
+        except asyncio_helper.ApiTelegramException as error:
+            outcome = str(error.error_code)
+            raise
+        finally:
+            BOT_API_DURATION.observe(time.perf_counter() - started_at, method_name, outcome)
+
+    timed_process_request.__metrics_wrapped__ = True
+    asyncio_helper._process_request = timed_process_request
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host, port):
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True)
+    thread.start()
+    logging.info("Metrics are served on http://%s:%s/metrics", host, port)
+    return server
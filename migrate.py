@@ -0,0 +1,193 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+
+from database import get_connection, close_pool, statement_text, PRODUCTS_PAGE_NEXT, PRODUCTS_PAGE_PREV, \
+    USER_ID_BY_CHAT_ID, ORDER_CART_ROWS, PRODUCT_CARTS_DELETE, BROADCAST_RECIPIENTS, OUTBOX_CLAIM, \
+    IMPORT_PRODUCTS_TABLE, IMPORT_PRODUCTS_UPDATE, IMPORT_PRODUCTS_INSERT
+from repository import CART_BY_USER
+
+
+# --------------------------------------------------------------------------------------------------------
+# Миграции схемы базы данных.
+#
+# Каждая миграция - файл migrations/NNNN_описание.sql. Номер файла - версия; применённые версии
+# записываются в таблицу schema_migrations. Миграция выполняется в одной транзакции вместе с записью
+# о ней, поэтому при ошибке база остаётся в предыдущей версии. Одновременный запуск с нескольких
+# реплик сериализуется advisory-блокировкой.
+#
+#   python migrate.py            - применить новые миграции
+#   python migrate.py --status   - показать применённые и ожидающие миграции
+#   python migrate.py --check    - проверить через EXPLAIN, что горячие запросы бота идут по индексам
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Произвольный ключ pg_advisory_xact_lock для раннера миграций
+_MIGRATION_LOCK_ID = 7054860054
+
+_MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+
+def load_migrations():
+    """Возвращает [(версия, имя, путь)] в порядке версий."""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = _MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError("Duplicate migration versions in %s" % MIGRATIONS_DIR)
+    return migrations
+
+
+def _ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def get_applied_versions():
+    with get_connection() as connection, connection.cursor() as cursor:
+        _ensure_migrations_table(cursor)
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def migrate():
+    """Применяет все ещё не применённые миграции. Возвращает список применённых версий."""
+    applied = []
+    for version, name, path in load_migrations():
+        with open(path, encoding='utf-8') as file:
+            sql = file.read()
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_MIGRATION_LOCK_ID,))
+            _ensure_migrations_table(cursor)
+            # Проверяем под блокировкой: миграцию могла уже применить другая реплика
+            cursor.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+            if cursor.fetchone():
+                continue
+            logging.info("Applying migration %04d_%s", version, name)
+            cursor.execute(sql)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        applied.append(version)
+    return applied
+
+
+def print_status():
+    applied = get_applied_versions()
+    for version, name, _ in load_migrations():
+        print(f"{'applied' if version in applied else 'pending':8} {version:04d}_{name}")
+
+
+# --------------------------------------------------------------------------------------------------------
+# Проверка планов горячих запросов.
+#
+# На маленькой базе планировщик честно выбирает Seq Scan - прочитать пару страниц дешевле, чем
+# индекс. Поэтому проверка выключает enable_seqscan и убеждается, что индекс вообще применим:
+# если нужного индекса нет, PostgreSQL всё равно построит Seq Scan.
+
+# (описание, запрос, параметры, индекс, который должен быть в плане). Все запросы берутся из
+# database.py и repository.py - оттуда же, откуда их выполняет бот, - проверяется ровно тот текст.
+HOT_QUERIES = (
+    ("category page",
+     statement_text(PRODUCTS_PAGE_NEXT), (1, 0, 11),
+     'products_category_id_id_idx'),
+    ("category page backwards",
+     statement_text(PRODUCTS_PAGE_PREV), (1, 100, 11),
+     'products_category_id_id_idx'),
+    ("cart items",
+     statement_text(CART_BY_USER), (1,),
+     'carts_user_id_product_id_key'),
+    ("cart rows locked for order",
+     ORDER_CART_ROWS, (1,),
+     'carts_user_id_product_id_key'),
+    ("carts of deleted product",
+     PRODUCT_CARTS_DELETE, (1,),
+     'carts_product_id_idx'),
+    ("catalog import: update by name",
+     IMPORT_PRODUCTS_UPDATE, (),
+     'products_name_idx'),
+    ("catalog import: new products",
+     IMPORT_PRODUCTS_INSERT, (),
+     'products_name_idx'),
+    ("user by chat_id",
+     statement_text(USER_ID_BY_CHAT_ID), (1,),
+     'users_chat_id_key'),
+    ("broadcast recipients",
+     BROADCAST_RECIPIENTS, (0, 200),
+     'users_pkey'),
+    ("outbox due messages",
+     OUTBOX_CLAIM, (30, 50),
+     'outbox_pending_idx'),
+)
+
+
+def _plan_indexes(plan, found):
+    """Собирает имена индексов и таблиц, прочитанных Seq Scan, из узлов плана."""
+    if 'Index Name' in plan:
+        found['indexes'].add(plan['Index Name'])
+    if plan.get('Node Type') == 'Seq Scan':
+        found['seq_scans'].add(plan.get('Relation Name'))
+    for child in plan.get('Plans', ()):
+        _plan_indexes(child, found)
+    return found
+
+
+def check_query_plans():
+    """Возвращает список (описание, ожидаемый индекс, план) для запросов, не использующих индекс."""
+    failures = []
+    with get_connection() as connection, connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        # Запросы импорта каталога читают временную таблицу; она удаляется вместе с транзакцией
+        cursor.execute(IMPORT_PRODUCTS_TABLE)
+        for description, query, params, index in HOT_QUERIES:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + query, params or None)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            found = _plan_indexes(plan[0]['Plan'], {'indexes': set(), 'seq_scans': set()})
+            if index not in found['indexes']:
+                failures.append((description, index, plan))
+            logging.info("%s: indexes=%s seq_scans=%s", description, sorted(found['indexes']),
+                         sorted(found['seq_scans']))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции базы данных бота")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--status', action='store_true', help="показать применённые и ожидающие миграции")
+    group.add_argument('--check', action='store_true', help="проверить, что горячие запросы используют индексы")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        if args.status:
+            print_status()
+        elif args.check:
+            failures = check_query_plans()
+            for description, index, plan in failures:
+                print(f"FAIL {description}: expected {index}\n{json.dumps(plan, indent=2)}")
+            if failures:
+                return 1
+            print(f"OK: {len(HOT_QUERIES)} queries use indexes")
+        else:
+            applied = migrate()
+            print(f"Applied migrations: {', '.join('%04d' % v for v in applied)}" if applied
+                  else "Database is up to date")
+    finally:
+        close_pool()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
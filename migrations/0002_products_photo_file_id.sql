@@ -0,0 +1,2 @@
+-- file_id, который Telegram вернул после первой загрузки фото
+ALTER TABLE products ADD COLUMN IF NOT EXISTS photo_file_id VARCHAR(255);
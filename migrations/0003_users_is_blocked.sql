@@ -0,0 +1,2 @@
+-- Пользователь заблокировал бота, рассылки его пропускают
+ALTER TABLE users ADD COLUMN IF NOT EXISTS is_blocked BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,7 @@
+-- Состояния диалогов (fsm.py, FSM_STORAGE = 'postgres')
+CREATE TABLE IF NOT EXISTS fsm_states (
+    chat_id BIGINT PRIMARY KEY,
+    state VARCHAR(64) NOT NULL,
+    data JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
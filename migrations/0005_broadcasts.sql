@@ -0,0 +1,15 @@
+-- Рассылки /broadcast (broadcast.py)
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id SERIAL PRIMARY KEY,
+    text TEXT,
+    product_id INT REFERENCES products(id) ON DELETE SET NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    -- users.id последнего обработанного получателя, с него рассылка продолжается после перезапуска
+    last_user_id INT NOT NULL DEFAULT 0,
+    sent INT NOT NULL DEFAULT 0,
+    failed INT NOT NULL DEFAULT 0,
+    blocked INT NOT NULL DEFAULT 0,
+    created_by BIGINT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
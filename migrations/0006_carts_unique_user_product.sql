@@ -0,0 +1,30 @@
+-- add_to_cart использует ON CONFLICT (user_id, product_id), которому нужен уникальный индекс.
+-- До этого каждое нажатие "В корзину" могло добавлять новую строку - сначала схлопываем дубли,
+-- суммируя количество в строку с наименьшим id.
+
+UPDATE carts c
+SET quantity = d.total
+FROM (
+    SELECT MIN(id) AS keep_id, SUM(quantity) AS total
+    FROM carts
+    GROUP BY user_id, product_id
+    HAVING COUNT(*) > 1
+) d
+WHERE c.id = d.keep_id;
+
+DELETE FROM carts c
+USING carts k
+WHERE c.user_id = k.user_id
+  AND c.product_id = k.product_id
+  AND c.id > k.id;
+
+-- Индекс (user_id, product_id) заодно обслуживает выборку корзины по user_id,
+-- поэтому отдельный индекс на carts.user_id не нужен.
+-- Ограничение уже есть в базах, созданных из нового create_tables.sql.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'carts_user_id_product_id_key') THEN
+        ALTER TABLE carts ADD CONSTRAINT carts_user_id_product_id_key UNIQUE (user_id, product_id);
+    END IF;
+END
+$$;
@@ -0,0 +1,14 @@
+-- Индексы под запросы бота (проверка: python migrate.py --check)
+
+-- Страницы категории: WHERE category_id = ? AND id > ? ORDER BY id
+CREATE INDEX IF NOT EXISTS products_category_id_id_idx ON products (category_id, id);
+
+-- Импорт каталога (import_catalog) сопоставляет товары по названию: WHERE p.name = s.name
+CREATE INDEX IF NOT EXISTS products_name_idx ON products (name);
+
+-- Удаление товара чистит корзины: DELETE FROM carts WHERE product_id = ?
+CREATE INDEX IF NOT EXISTS carts_product_id_idx ON carts (product_id);
+
+-- Заказы пользователя и позиции заказа
+CREATE INDEX IF NOT EXISTS orders_user_id_idx ON orders (user_id);
+CREATE INDEX IF NOT EXISTS order_items_order_id_idx ON order_items (order_id);
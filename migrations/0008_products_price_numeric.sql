@@ -0,0 +1,9 @@
+-- Цена товара хранилась строкой (VARCHAR), а итог корзины считался в Python через float.
+-- Теперь цена - NUMERIC, и суммы корзины считаются в SQL (get_cart_summary).
+-- Админка записывала цены через float, поэтому в строках встречаются только число и пробелы;
+-- десятичная запятая на всякий случай заменяется точкой. ::TEXT - чтобы миграция проходила и на базе,
+-- где цена уже NUMERIC (создана из create_tables.sql).
+
+ALTER TABLE products
+    ALTER COLUMN price TYPE NUMERIC(10, 2)
+    USING replace(regexp_replace(price::TEXT, '\s', '', 'g'), ',', '.')::NUMERIC(10, 2);
@@ -0,0 +1,5 @@
+-- Контактные данные, которые покупатель вводит при оформлении заказа (place_order).
+-- Раньше они уходили только сообщением в группу администраторов и в базе не сохранялись.
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS customer_name VARCHAR(255);
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS address TEXT;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS phone VARCHAR(50);
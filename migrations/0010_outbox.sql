@@ -0,0 +1,19 @@
+-- Очередь уведомлений администраторам (outbox.py). Уведомление о заказе записывается в той же
+-- транзакции, что и заказ, а отправляется фоновым потоком уже после ответа покупателю.
+CREATE TABLE IF NOT EXISTS outbox (
+    id BIGSERIAL PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    -- 'text' (payload.text), 'photo' (payload.photo, payload.caption) или 'copy'
+    -- (payload.from_chat_id, payload.message_id, payload.caption)
+    kind VARCHAR(20) NOT NULL,
+    payload JSONB NOT NULL,
+    -- pending -> sent или failed после OUTBOX_MAX_ATTEMPTS неудачных попыток
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS outbox_pending_idx ON outbox (next_attempt_at, id) WHERE status = 'pending';
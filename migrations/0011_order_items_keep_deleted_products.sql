@@ -0,0 +1,8 @@
+-- Позиции заказов ссылались на товар без ON DELETE, и с тех пор как place_order записывает order_items,
+-- товар, который хоть раз заказывали, нельзя было удалить (/delete_product падал на внешнем ключе).
+-- Теперь при удалении товара позиции заказов остаются, а product_id в них обнуляется.
+ALTER TABLE order_items ALTER COLUMN product_id DROP NOT NULL;
+ALTER TABLE order_items DROP CONSTRAINT IF EXISTS order_items_product_id_fkey;
+ALTER TABLE order_items
+    ADD CONSTRAINT order_items_product_id_fkey
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE SET NULL;
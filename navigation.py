@@ -0,0 +1,140 @@
+import logging
+from concurrent.futures import Future
+
+from telebot.apihelper import ApiTelegramException
+
+try:
+    from telebot.asyncio_helper import ApiTelegramException as AsyncApiTelegramException
+except ImportError:
+    # aiohttp не установлен - async-режим (async_bot.py) недоступен
+    AsyncApiTelegramException = None
+
+
+# --------------------------------------------------------------------------------------------------------
+# Навигация по меню без новых сообщений.
+#
+# Нажатие на кнопку меню (каталог, категория, корзина) меняет то сообщение, в котором нажата кнопка,
+# а не удаляет его и не присылает новое - одно обращение к Bot API вместо двух-трёх, и чат не
+# засоряется устаревшими меню. Новое сообщение отправляется, только если старое изменить нельзя:
+# это фото (текст в него не превратить) или Telegram отказал в редактировании.
+#
+# На каждое нажатие нужно ответить answerCallbackQuery, иначе на кнопке крутится индикатор загрузки.
+# Обработчик может ответить сам (answer(bot, call, "Товар добавлен")), иначе отвечает
+# callbacks.CallbackRouter после обработчика.
+#
+# show_text и show_markup нужны и синхронному, и async-боту, поэтому записаны один раз - генераторами
+# шагов: генератор отдаёт вызов Bot API (имя метода, args, kwargs) и получает обратно его результат или
+# исключение. Синхронный код выполняет шаги через run_steps, async_bot.py - через run_steps_async.
+# Отправка через outbound.scheduler возвращает Future - тогда следующий шаг выполняется, когда запрос
+# завершится, в потоке планировщика, а воркер апдейтов не ждёт Bot API.
+
+# Ошибки Bot API синхронного и async-клиента - разные классы с одинаковыми полями
+API_ERRORS = (ApiTelegramException,) + ((AsyncApiTelegramException,) if AsyncApiTelegramException else ())
+
+
+def run_steps(bot, steps):
+    """Выполняет шаги через синхронного бота и возвращает Future с их результатом."""
+    outcome = Future()
+
+    def advance(resume, value):
+        while True:
+            try:
+                method, args, kwargs = resume(value)
+            except StopIteration as stop:
+                outcome.set_result(stop.value)
+                return
+            except BaseException as error:
+                outcome.set_exception(error)
+                return
+            try:
+                result = getattr(bot, method)(*args, **kwargs)
+            except Exception as error:
+                resume, value = steps.throw, error
+                continue
+            if isinstance(result, Future):
+                result.add_done_callback(lambda future: advance(*_resume_with(steps, future)))
+                return
+            resume, value = steps.send, result
+
+    advance(steps.send, None)
+    return outcome
+
+
+def _resume_with(steps, future):
+    error = future.exception()
+    if error is not None:
+        return steps.throw, error
+    return steps.send, future.result()
+
+
+async def run_steps_async(bot, steps):
+    try:
+        method, args, kwargs = next(steps)
+        while True:
+            try:
+                result = await getattr(bot, method)(*args, **kwargs)
+            except Exception as error:
+                method, args, kwargs = steps.throw(error)
+            else:
+                method, args, kwargs = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+def is_not_modified(error):
+    # Повторное нажатие на ту же кнопку: 400 "message is not modified"
+    return error.error_code == 400 and 'message is not modified' in str(error.description)
+
+
+def can_edit_text(message):
+    return message is not None and message.content_type == 'text'
+
+
+def answer(bot, call, text=None, show_alert=False):
+    """Отвечает на нажатие один раз; повторный вызов для того же call ничего не делает."""
+    if getattr(call, 'answered', False):
+        return
+    call.answered = True
+    try:
+        bot.answer_callback_query(call.id, text, show_alert=show_alert)
+    except ApiTelegramException as error:
+        # Ответ опоздал (query is too old) - пользователю это уже не важно
+        logging.info("Error answering callback query: %s", error)
+
+
+def show_text_steps(call, text, reply_markup=None, parse_mode=None):
+    """Шаги show_text: показывает text с клавиатурой на месте сообщения с кнопкой."""
+    message = call.message
+    if can_edit_text(message):
+        try:
+            return (yield 'edit_message_text', (text,),
+                    {'chat_id': message.chat.id, 'message_id': message.message_id,
+                     'reply_markup': reply_markup, 'parse_mode': parse_mode})
+        except API_ERRORS as error:
+            if is_not_modified(error):
+                return message
+            if error.error_code != 400:
+                raise
+            # "message can't be edited", "message to edit not found" - отправляем заново
+            logging.info("Error editing message, sending a new one: %s", error)
+    return (yield 'send_message', (message.chat.id, text), {'reply_markup': reply_markup, 'parse_mode': parse_mode})
+
+
+def show_markup_steps(call, reply_markup):
+    """Шаги show_markup: меняет только клавиатуру (листание страниц)."""
+    message = call.message
+    try:
+        return (yield 'edit_message_reply_markup', (),
+                {'chat_id': message.chat.id, 'message_id': message.message_id, 'reply_markup': reply_markup})
+    except API_ERRORS as error:
+        if not is_not_modified(error):
+            raise
+        return message
+
+
+def show_text(bot, call, text, reply_markup=None, parse_mode=None):
+    return run_steps(bot, show_text_steps(call, text, reply_markup, parse_mode))
+
+
+def show_markup(bot, call, reply_markup):
+    return run_steps(bot, show_markup_steps(call, reply_markup))
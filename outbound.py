@@ -0,0 +1,377 @@
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import deque
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_GROUP_RATE, \
+    OUTBOUND_GROUP_BURST, OUTBOUND_WORKERS, OUTBOUND_MAX_RETRIES, OUTBOUND_STATS_INTERVAL
+from navigation import API_ERRORS, is_not_modified
+
+
+# --------------------------------------------------------------------------------------------------------
+# Планировщик исходящих запросов к Bot API.
+#
+# Все отправки проходят через token bucket'ы: общий лимит бота, лимит на чат и более строгий лимит
+# на группы (GROUP_ID). Ответ 429 учитывается через retry_after - чат блокируется на указанное
+# время, а запрос повторяется. Ответы пользователям имеют приоритет над уведомлениями в группу,
+# а те - над массовыми рассылками.
+#
+# Отправка не блокирует вызывающий поток: методы бота после install() возвращают Future. Поэтому чат,
+# упёршийся в лимит или получивший 429, не задерживает воркер апдейтов и другие чаты. Порядок сообщений
+# одного чата сохраняется - следующий запрос в чат уходит только после завершения предыдущего.
+# Кому нужен результат (Message), ждёт Future вне воркера апдейтов: в add_done_callback
+# (navigation.run_steps) или в своём фоновом потоке (wait()).
+#
+# Async-бот (async_bot.py) подключается через install_async(): его методы остаются корутинами, но
+# ставят запрос в те же очереди, так что лимиты и повторы после 429 общие для обоих ботов.
+
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BULK = 2
+
+# Методы с аргументом chat_id - чатом получателя. У edit_message_* он не первый (первый - текст,
+# подпись или media), поэтому чат определяется по сигнатуре метода, см. _chat_id()
+THROTTLED_METHODS = (
+    'send_message', 'send_photo', 'send_sticker', 'send_document', 'send_media_group', 'forward_message',
+    'copy_message', 'edit_message_text', 'edit_message_caption', 'edit_message_media',
+    'edit_message_reply_markup',
+)
+
+# Сколько задач каждого приоритета просматривать в поисках той, чей чат не упёрся в лимит
+_SCAN_LIMIT = 200
+
+
+class SchedulerStopped(RuntimeError):
+    """Планировщик остановлен: задача не была и уже не будет отправлена."""
+
+
+def unwrap(method):
+    """Исходный метод бота без планировщика - для задач, которые сами ставятся в очередь через submit()."""
+    return getattr(method, '__wrapped__', method)
+
+
+def wait(result):
+    """Результат вызова метода бота: ждёт Future, если бот отправляет через планировщик.
+
+    Только для фоновых потоков (outbox, рассылки) - воркер апдейтов ждать отправки не должен.
+    """
+    return result.result() if isinstance(result, Future) else result
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0
+
+    def delay(self, now):
+        """Через сколько секунд будет доступен токен (0 - можно отправлять сейчас)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def is_idle(self, now):
+        return now >= self.blocked_until and self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ('method', 'chat_key', 'args', 'kwargs', 'future', 'priority', 'created_at', 'attempts', 'files')
+
+    def __init__(self, method, chat_key, args, kwargs, priority):
+        self.method = method
+        self.chat_key = chat_key
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.priority = priority
+        self.created_at = time.monotonic()
+        self.attempts = 0
+        # Открытые файлы (первая загрузка фото, стикера) и их позиции: запрос читает файл до конца
+        self.files = [(value, value.tell()) for value in (*args, *kwargs.values())
+                      if hasattr(value, 'read') and hasattr(value, 'seek')]
+
+    def rewind(self):
+        """Возвращает файлы в исходную позицию перед повтором, иначе повтор загрузит пустое тело."""
+        for file, position in self.files:
+            file.seek(position)
+
+
+@functools.lru_cache(maxsize=None)
+def _signature(function):
+    return inspect.signature(function)
+
+
+def _chat_id(method, args, kwargs):
+    if 'chat_id' in kwargs:
+        return kwargs['chat_id']
+    function = getattr(method, '__func__', None)
+    try:
+        if function is not None:
+            # Метод бота: self привязывается к заглушке, сигнатура функции кешируется
+            signature = _signature(function)
+            arguments = signature.bind_partial(None, *args, **kwargs).arguments
+        else:
+            signature = inspect.signature(method)
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+    except (TypeError, ValueError):
+        return args[0] if args else None
+    if 'chat_id' in signature.parameters:
+        # None - правка по inline_message_id, без чата
+        return arguments.get('chat_id')
+    return args[0] if args else None
+
+
+def _chat_key(chat_id):
+    if chat_id is None:
+        return None
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        # @channelusername
+        return chat_id
+
+
+def _is_group(chat_key):
+    return isinstance(chat_key, int) and chat_key < 0
+
+
+class OutboundScheduler:
+    def __init__(self, global_rate, chat_rate, chat_burst, group_rate, group_burst, workers, max_retries):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._group_burst = group_burst
+        self._buckets = {}
+        self._queues = (deque(), deque(), deque())
+        # Чаты, запрос в которые сейчас выполняется
+        self._in_flight = set()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Outbound")
+        self._max_retries = max_retries
+        self._thread = None
+        self._running = False
+        # После stop() исполнитель закрыт, перезапустить планировщик нельзя
+        self._stopped = False
+
+        self._sent = 0
+        self._rate_limited = 0
+        self._total_delay = 0.0
+        self._max_delay = 0.0
+
+    # ---------------------------------------------------------------------------------------------
+
+    def start(self):
+        if self._running or self._stopped:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="OutboundScheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def submit(self, method, *args, priority=None, **kwargs):
+        """Ставит вызов method(*args, **kwargs) в очередь и возвращает Future с результатом.
+
+        Чат получателя - аргумент chat_id метода (позиционный или именованный), а если такого
+        аргумента нет - первый позиционный. После stop() бросает SchedulerStopped.
+        """
+        chat_key = _chat_key(_chat_id(method, args, kwargs))
+        if priority is None:
+            priority = PRIORITY_ADMIN if _is_group(chat_key) else PRIORITY_USER
+        job = _Job(method, chat_key, args, kwargs, priority)
+        with self._condition:
+            if self._stopped:
+                raise SchedulerStopped("Outbound scheduler stopped")
+            self._queues[priority].append(job)
+            self._condition.notify()
+        return job.future
+
+    def install(self, bot):
+        """Перенаправляет отправляющие методы бота через планировщик. Методы возвращают Future."""
+        for name in THROTTLED_METHODS:
+            method = getattr(bot, name)
+            setattr(bot, name, self._wrap(method))
+        self.start()
+        return self
+
+    def install_async(self, bot):
+        """То же для AsyncTeleBot: методы ждут своей очереди и возвращают результат. Вызывать из цикла событий бота."""
+        loop = asyncio.get_running_loop()
+        for name in THROTTLED_METHODS:
+            method = getattr(bot, name)
+            setattr(bot, name, self._wrap_async(method, loop))
+        self.start()
+        return self
+
+    def _wrap_async(self, method, loop):
+        # Воркер планировщика выполняет корутину на цикле событий бота и ждёт её результата
+        @functools.wraps(method)
+        def call(*args, **kwargs):
+            future = asyncio.run_coroutine_threadsafe(method(*args, **kwargs), loop)
+            while True:
+                try:
+                    return future.result(timeout=1)
+                except futures.TimeoutError:
+                    if loop.is_closed():
+                        future.cancel()
+                        raise SchedulerStopped("Event loop of the async bot is closed")
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            return await asyncio.wrap_future(self.submit(call, *args, **kwargs))
+        return wrapper
+
+    def _wrap(self, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            return self.submit(method, *args, **kwargs)
+        return wrapper
+
+    def stats(self):
+        with self._condition:
+            sent = self._sent
+            return {
+                'queue_user': len(self._queues[PRIORITY_USER]),
+                'queue_admin': len(self._queues[PRIORITY_ADMIN]),
+                'queue_bulk': len(self._queues[PRIORITY_BULK]),
+                'sent': sent,
+                'rate_limited': self._rate_limited,
+                'avg_delay': self._total_delay / sent if sent else 0.0,
+                'max_delay': self._max_delay,
+            }
+
+    # ---------------------------------------------------------------------------------------------
+
+    def _bucket(self, chat_key):
+        bucket = self._buckets.get(chat_key)
+        if bucket is None:
+            if _is_group(chat_key):
+                bucket = TokenBucket(self._group_rate, self._group_burst)
+            else:
+                bucket = TokenBucket(self._chat_rate, self._chat_burst)
+            self._buckets[chat_key] = bucket
+        return bucket
+
+    def _next_job(self, now):
+        """Возвращает (job, None) для готовой задачи или (None, сколько ждать)."""
+        global_delay = self._global.delay(now)
+        wait = None
+        for jobs in self._queues:
+            for index, job in enumerate(jobs):
+                if index >= _SCAN_LIMIT:
+                    break
+                if job.chat_key in self._in_flight:
+                    # Предыдущий запрос в этот чат ещё выполняется - ждём его завершения (notify в _execute)
+                    continue
+                delay = self._bucket(job.chat_key).delay(now) if job.chat_key is not None else 0
+                if delay == 0 and global_delay == 0:
+                    del jobs[index]
+                    return job, None
+                delay = max(delay, global_delay)
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _run(self):
+        last_report = time.monotonic()
+        while True:
+            with self._condition:
+                if not self._running:
+                    break
+                now = time.monotonic()
+                job, wait = self._next_job(now)
+                if job is None:
+                    self._condition.wait(timeout=wait)
+                    continue
+                self._global.consume()
+                if job.chat_key is not None:
+                    self._bucket(job.chat_key).consume()
+                    self._in_flight.add(job.chat_key)
+                delay = now - job.created_at
+                self._total_delay += delay
+                self._max_delay = max(self._max_delay, delay)
+                self._sent += 1
+
+                if now - last_report >= OUTBOUND_STATS_INTERVAL:
+                    last_report = now
+                    self._prune_buckets(now)
+                    logging.info("Outbound scheduler stats: %s", self.stats())
+
+            self._executor.submit(self._execute, job)
+
+        # Не отправленные при остановке задачи завершаются ошибкой
+        with self._condition:
+            for jobs in self._queues:
+                while jobs:
+                    jobs.popleft().future.set_exception(SchedulerStopped("Outbound scheduler stopped"))
+
+    def _execute(self, job):
+        try:
+            result = job.method(*job.args, **job.kwargs)
+        except API_ERRORS as error:
+            if error.error_code == 429 and job.attempts < self._max_retries:
+                retry_after = error.result_json.get('parameters', {}).get('retry_after', 1)
+                logging.warning("Bot API rate limit for chat %s, retry after %s s", job.chat_key, retry_after)
+                with self._condition:
+                    self._rate_limited += 1
+                    blocked_until = time.monotonic() + retry_after
+                    bucket = self._bucket(job.chat_key) if job.chat_key is not None else self._global
+                    bucket.blocked_until = max(bucket.blocked_until, blocked_until)
+                    job.attempts += 1
+                    job.rewind()
+                    # Повтор встаёт в начало своей очереди, чтобы сохранить порядок сообщений чата
+                    self._queues[job.priority].appendleft(job)
+                    self._release(job)
+                return
+            self._fail(job, error)
+        except BaseException as error:
+            self._fail(job, error)
+        else:
+            with self._condition:
+                self._release(job)
+            job.future.set_result(result)
+
+    def _release(self, job):
+        # Вызывается под self._condition: чат снова может получать запросы
+        self._in_flight.discard(job.chat_key)
+        self._condition.notify()
+
+    def _fail(self, job, error):
+        with self._condition:
+            self._release(job)
+        # Ошибку больше некому поймать: обработчик, поставивший отправку, уже вернулся.
+        # Результаты рассылки считает сам Broadcaster
+        if job.priority != PRIORITY_BULK and not (isinstance(error, API_ERRORS) and is_not_modified(error)):
+            logging.warning("Bot API %s for chat %s failed: %s", getattr(job.method, '__name__', job.method),
+                            job.chat_key, error)
+        job.future.set_exception(error)
+
+    def _prune_buckets(self, now):
+        pending = {job.chat_key for jobs in self._queues for job in jobs}
+        for chat_key in [key for key, bucket in self._buckets.items() if key not in pending and bucket.is_idle(now)]:
+            del self._buckets[chat_key]
+
+
+scheduler = OutboundScheduler(OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_GROUP_RATE,
+                              OUTBOUND_GROUP_BURST, OUTBOUND_WORKERS, OUTBOUND_MAX_RETRIES)
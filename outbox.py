@@ -0,0 +1,172 @@
+import logging
+import threading
+
+from telebot import util
+
+from config import OUTBOX_POLL_INTERVAL, OUTBOX_DIGEST_WINDOW, OUTBOX_BATCH_SIZE, OUTBOX_LEASE, OUTBOX_MAX_ATTEMPTS, \
+    OUTBOX_BACKOFF_BASE, OUTBOX_BACKOFF_MAX
+from database import enqueue_outbox, claim_outbox, mark_outbox_sent, mark_outbox_failed
+from outbound import wait
+
+
+# --------------------------------------------------------------------------------------------------------
+# Уведомления администраторам через таблицу outbox.
+#
+# Обработчик покупателя только записывает уведомление в базу (для заказа - в той же транзакции,
+# что и сам заказ, см. database.place_order) и сразу отвечает покупателю. Отправляет уведомления
+# фоновый поток: медленная или недоступная группа администраторов больше не задерживает и не ломает
+# оформление заказа. Неудачная отправка повторяется с экспоненциальной задержкой, уведомления
+# переживают перезапуск бота. Тексты, накопившиеся для одного чата за OUTBOX_DIGEST_WINDOW, уходят
+# одной сводкой - группа получает меньше сообщений и реже упирается в лимит 20 сообщений в минуту.
+#
+# Доставка "хотя бы один раз": если процесс упадёт между отправкой и отметкой в базе, уведомление
+# уйдёт повторно после OUTBOX_LEASE секунд.
+
+# Ограничение Telegram на длину текста сообщения
+MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = "\n\n— — — — —\n\n"
+
+
+def text_message(chat_id, text):
+    return chat_id, 'text', {'text': text}
+
+
+def photo_message(chat_id, photo, caption=None):
+    return chat_id, 'photo', {'photo': photo, 'caption': caption}
+
+
+def copy_message(chat_id, from_chat_id, message_id, caption=None):
+    # Копия с подписью вместо пересылки: в сводке порядок сообщений не сохраняется,
+    # поэтому каждое фото само говорит, к какому заказу оно относится
+    return chat_id, 'copy', {'from_chat_id': from_chat_id, 'message_id': message_id, 'caption': caption}
+
+
+def build_batches(messages):
+    """Группирует забранные уведомления [(id, chat_id, kind, payload, attempts)] в отправки.
+
+    Все тексты одного чата склеиваются в сводки не длиннее MESSAGE_LIMIT и идут первыми,
+    фото и копии отправляются по одному. Возвращает [(chat_id, kind, payload, [id, ...])].
+    """
+    texts = {}
+    batches = []
+    for message_id, chat_id, kind, payload, _ in messages:
+        if kind == 'text':
+            texts.setdefault(chat_id, []).append((message_id, payload['text']))
+        else:
+            batches.append((chat_id, kind, payload, [message_id]))
+
+    digests = []
+    for chat_id, items in texts.items():
+        if len(items) == 1:
+            digests.append((chat_id, 'text', {'text': items[0][1]}, [items[0][0]]))
+            continue
+        header = f"Новых уведомлений: {len(items)}"
+        parts, ids = [header], []
+        for message_id, text in items:
+            if ids and len(DIGEST_SEPARATOR.join(parts + [text])) > MESSAGE_LIMIT:
+                digests.append((chat_id, 'text', {'text': DIGEST_SEPARATOR.join(parts)}, ids))
+                parts, ids = [header], []
+            parts.append(text)
+            ids.append(message_id)
+        digests.append((chat_id, 'text', {'text': DIGEST_SEPARATOR.join(parts)}, ids))
+    return digests + batches
+
+
+class OutboxWorker:
+    def __init__(self, bot, batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL,
+                 digest_window=OUTBOX_DIGEST_WINDOW, lease=OUTBOX_LEASE):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.digest_window = digest_window
+        self.lease = lease
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {'sent': 0, 'digests': 0, 'retries': 0, 'failed': 0}
+
+    def enqueue(self, messages):
+        """Записывает уведомления [(chat_id, kind, payload)] в outbox и будит поток отправки."""
+        enqueue_outbox(messages)
+        self.notify()
+
+    def notify(self):
+        """Новые уведомления уже в базе (например, записаны place_order) - можно отправлять."""
+        self._wakeup.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="OutboxWorker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if self._wakeup.wait(self.poll_interval) and not self._stopped.is_set():
+                # Даём всплеску уведомлений накопиться, чтобы отправить его одной сводкой
+                self._stopped.wait(self.digest_window)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.process_due()
+            except Exception as error:
+                # База недоступна - попробуем на следующем круге
+                logging.error("Outbox worker failed: %s", error)
+
+    def process_due(self):
+        while not self._stopped.is_set():
+            messages = claim_outbox(self.batch_size, self.lease)
+            for chat_id, kind, payload, message_ids in build_batches(messages):
+                self._deliver(chat_id, kind, payload, message_ids)
+            if len(messages) < self.batch_size:
+                return
+
+    def _send(self, chat_id, kind, payload):
+        # Ждём каждую отправку: уведомление отмечается отправленным, только если Telegram его принял
+        if kind == 'text':
+            for part in util.smart_split(payload['text'], MESSAGE_LIMIT):
+                wait(self.bot.send_message(chat_id, part))
+        elif kind == 'photo':
+            wait(self.bot.send_photo(chat_id, payload['photo'], caption=payload.get('caption')))
+        elif kind == 'copy':
+            wait(self.bot.copy_message(chat_id, payload['from_chat_id'], payload['message_id'],
+                                       caption=payload.get('caption')))
+        else:
+            raise ValueError(f"Неизвестный тип уведомления: {kind!r}")
+
+    def _deliver(self, chat_id, kind, payload, message_ids):
+        try:
+            self._send(chat_id, kind, payload)
+        except Exception as error:
+            failed = mark_outbox_failed(message_ids, error, OUTBOX_MAX_ATTEMPTS, OUTBOX_BACKOFF_BASE,
+                                        OUTBOX_BACKOFF_MAX)
+            self._count('retries', len(message_ids) - len(failed))
+            self._count('failed', len(failed))
+            if failed:
+                logging.error("Outbox messages %s to chat %s failed permanently: %s", failed, chat_id, error)
+            else:
+                logging.warning("Outbox messages %s to chat %s failed, will retry: %s", message_ids, chat_id, error)
+            return
+
+        mark_outbox_sent(message_ids)
+        self._count('sent', len(message_ids))
+        if len(message_ids) > 1:
+            self._count('digests')
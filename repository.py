@@ -0,0 +1,149 @@
+import logging
+from dataclasses import dataclass
+from decimal import Decimal
+
+from psycopg2 import Error
+
+from database import get_connection, instrumented, prepare, execute_prepared
+
+
+# --------------------------------------------------------------------------------------------------------
+# Чтение каталога, корзин и пользователей.
+#
+# Строки возвращаются объектами с __slots__ вместо кортежей: поля читаются по имени (product.name,
+# а не product[1]), а объект не тащит за собой __dict__ - каталог целиком живёт в памяти процесса.
+# Каждый запрос перечисляет только нужные ему столбцы вместо SELECT *, порядок столбцов совпадает
+# с порядком полей, поэтому строка превращается в объект без словарей - cls(*row).
+# Значения передаются только параметрами, текст запросов постоянный: запросы, которые выполняются
+# на каждый апдейт, подготовлены на сервере один раз на соединение (database.prepare).
+#
+# Запись (корзина, заказы, импорт каталога) остаётся в database.py, async-версии - в async_database.py.
+
+
+@dataclass(slots=True, frozen=True)
+class Category:
+    id: int
+    name: str
+
+
+@dataclass(slots=True, frozen=True)
+class Product:
+    id: int
+    name: str
+    category_id: int
+    price: Decimal
+    sizes: tuple
+    photo: str
+    # file_id, который Telegram вернул после первой загрузки фото
+    photo_file_id: str | None
+
+    @classmethod
+    def from_row(cls, row):
+        # TEXT[] приходит списком - в кэше каталога храним неизменяемый кортеж
+        return cls(row[0], row[1], row[2], row[3], tuple(row[4] or ()), row[5], row[6])
+
+
+@dataclass(slots=True, frozen=True)
+class CartLine:
+    product_id: int
+    name: str
+    price: Decimal
+    quantity: int
+    subtotal: Decimal
+
+
+@dataclass(slots=True, frozen=True)
+class User:
+    id: int
+    chat_id: int
+    username: str | None
+    first_name: str | None
+    last_name: str | None
+
+
+
+# --------------------------------------------------------------------------------------------------------
+# Каталог
+
+
+@instrumented
+def get_categories():
+    try:
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT id, name FROM categories ORDER BY id")
+            return [Category(*row) for row in cursor.fetchall()]
+    except (Exception, Error) as error:
+        logging.error("Error while fetching categories: %s", error)
+        return None
+
+
+@instrumented
+def get_products():
+    try:
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, name, category_id, price, sizes, photo, photo_file_id
+                FROM products
+                ORDER BY id
+            """)
+            return [Product.from_row(row) for row in cursor.fetchall()]
+    except (Exception, Error) as error:
+        logging.error("Error while fetching products: %s", error)
+        return None
+
+
+# --------------------------------------------------------------------------------------------------------
+# Корзина
+
+
+CART_BY_USER = prepare('cart_by_user', """
+    SELECT p.id, p.name, p.price, c.quantity,
+           p.price * c.quantity AS subtotal,
+           SUM(p.price * c.quantity) OVER () AS total
+    FROM carts c
+    JOIN products p ON c.product_id = p.id
+    WHERE c.user_id = %s
+    ORDER BY c.id
+""")
+
+
+@instrumented
+def get_cart_summary(user_id):
+    """Корзина пользователя одним запросом: ([CartLine], total).
+
+    Суммы считаются в PostgreSQL как NUMERIC и приходят как Decimal, без округлений float.
+    """
+    try:
+        with get_connection() as connection, connection.cursor() as cursor:
+            execute_prepared(cursor, CART_BY_USER, (user_id,))
+            rows = cursor.fetchall()
+    except (Exception, Error) as error:
+        logging.error("Error while fetching cart summary: %s", error)
+        return [], Decimal(0)
+
+    if not rows:
+        return [], Decimal(0)
+    return [CartLine(*row[:5]) for row in rows], rows[0][5]
+
+
+# --------------------------------------------------------------------------------------------------------
+# Пользователи
+
+
+USER_BY_CHAT_ID = prepare('user_by_chat_id', """
+    SELECT id, chat_id, username, first_name, last_name
+    FROM users
+    WHERE chat_id = %s
+""")
+
+
+@instrumented
+def get_user(chat_id):
+    try:
+        with get_connection() as connection, connection.cursor() as cursor:
+            execute_prepared(cursor, USER_BY_CHAT_ID, (chat_id,))
+            row = cursor.fetchone()
+        return User(*row) if row else None
+    except (Exception, Error) as error:
+        logging.error("Error while fetching user info: %s", error)
+        return None
@@ -0,0 +1,155 @@
+import bisect
+import functools
+import heapq
+import itertools
+import re
+
+from telebot import types
+
+
+# --------------------------------------------------------------------------------------------------------
+# Поиск товаров (/search и inline-режим @bot запрос).
+#
+# Индекс строится в памяти вместе с кэшем каталога (catalog_cache.py) и перестраивается при каждом
+# его изменении. Названия товаров и категорий разбиваются на слова, слова хранятся в
+# отсортированном списке, поэтому каждое слово запроса ищется как префикс двоичным поиском.
+# Товар подходит, если каждое слово запроса - начало какого-то слова в названии товара или его
+# категории.
+
+_TOKEN = re.compile(r'\w+')
+
+# Ранг совпадения слова запроса: целиком в названии, префикс в названии, целиком в категории,
+# префикс в категории. Ранг товара - сумма рангов по словам запроса, при равенстве выше товар
+# с более коротким названием.
+_RANKS = 4
+# Слова запроса сверх этого числа не учитываются
+_MAX_TERMS = 4
+
+_MAX_CHAR = chr(0x10FFFF)
+
+_RESULT_CACHE_SIZE = 1024
+
+
+def tokenize(text):
+    return _TOKEN.findall(str(text).lower().replace('ё', 'е'))
+
+
+def _sorted_pairs(pairs):
+    pairs.sort()
+    return [token for token, _ in pairs], [position for _, position in pairs]
+
+
+class SearchIndex:
+    def __init__(self, products, categories):
+        category_tokens = {category.id: set(tokenize(category.name)) for category in categories}
+        # Товары нумеруются в порядке (длина названия, id): тогда лучшие внутри одного ранга -
+        # просто наименьшие номера, и их выбирает heapq.nsmallest по множеству int без key
+        products = sorted(products, key=lambda product: (len(product.name), product.id))
+        self._ids = [product.id for product in products]
+
+        # Пары (слово, номер товара), отсортированные по слову: все товары со словами на данный
+        # префикс - один непрерывный срез, который превращается в множество без цикла на Python
+        name_pairs = []
+        category_pairs = []
+        for position, product in enumerate(products):
+            name_tokens = set(tokenize(product.name))
+            name_pairs.extend((token, position) for token in name_tokens)
+            category_pairs.extend((token, position) for token in category_tokens.get(product.category_id, ()) - name_tokens)
+        self._name_tokens, self._name_positions = _sorted_pairs(name_pairs)
+        self._category_tokens, self._category_positions = _sorted_pairs(category_pairs)
+
+        # Наборы рангов, отсортированные по сумме: (0, 0), (0, 1), (1, 0), ...
+        self._rank_combinations = {
+            count: sorted(itertools.product(range(_RANKS), repeat=count), key=sum)
+            for count in range(1, _MAX_TERMS + 1)
+        }
+        # Inline-запросы приходят на каждое нажатие клавиши, популярные запросы повторяются.
+        # Кэш живёт вместе с индексом и пропадает при его перестройке.
+        self._search_terms = functools.lru_cache(maxsize=_RESULT_CACHE_SIZE)(self._search_terms)
+
+    @staticmethod
+    def _lookup(tokens, positions, term):
+        """(товары со словом term, товары со словами, которые начинаются на term и длиннее него)."""
+        start = bisect.bisect_left(tokens, term)
+        exact_end = bisect.bisect_right(tokens, term, start)
+        prefix_end = bisect.bisect_left(tokens, term + _MAX_CHAR, exact_end)
+        return set(positions[start:exact_end]), set(positions[exact_end:prefix_end])
+
+    def _rank_sets(self, term):
+        """Номера товаров, совпавших со словом term, по рангам (множества не пересекаются)."""
+        exact_name, prefix_name = self._lookup(self._name_tokens, self._name_positions, term)
+        exact_category, prefix_category = self._lookup(self._category_tokens, self._category_positions, term)
+        prefix_name -= exact_name
+        exact_category -= exact_name
+        exact_category -= prefix_name
+        prefix_category -= exact_name
+        prefix_category -= prefix_name
+        prefix_category -= exact_category
+        return exact_name, prefix_name, exact_category, prefix_category
+
+    def search(self, query, limit):
+        """Возвращает id не более limit лучших товаров."""
+        terms = tuple(dict.fromkeys(tokenize(query)))[:_MAX_TERMS]
+        if not terms:
+            return []
+        return list(self._search_terms(terms, limit))
+
+    def _search_terms(self, terms, limit):
+        rank_sets = [self._rank_sets(term) for term in terms]
+
+        found = []
+        level, level_matches = None, []
+        for combination in self._rank_combinations[len(terms)]:
+            if sum(combination) != level:
+                # Ранг закончился - добираем лучших из него
+                found.extend(heapq.nsmallest(limit - len(found), set().union(*level_matches)))
+                if len(found) >= limit:
+                    break
+                level, level_matches = sum(combination), []
+            sets = sorted((rank_sets[term][rank] for term, rank in enumerate(combination)), key=len)
+            if not sets[0]:
+                continue
+            matches = sets[0].intersection(*sets[1:])
+            if matches:
+                level_matches.append(matches)
+        else:
+            found.extend(heapq.nsmallest(limit - len(found), set().union(*level_matches)))
+
+        return tuple(self._ids[position] for position in found)
+
+
+# --------------------------------------------------------------------------------------------------------
+# Результаты поиска
+
+def search_results_markup(products):
+    markup = types.InlineKeyboardMarkup()
+    for product in products:
+        markup.add(types.InlineKeyboardButton(f"{product.name} - {product.price} тг.", callback_data=f"product_{product.id}"))
+    return markup
+
+
+def product_deep_link(bot_username, product_id):
+    # /start product_<id> открывает карточку товара в личном чате с ботом
+    return f"https://t.me/{bot_username}?start=product_{product_id}"
+
+
+def inline_search_results(products, bot_username):
+    """Результаты inline-запроса: фото по сохранённому file_id, если оно уже загружалось, иначе текст."""
+    results = []
+    for product in products:
+        product_id = product.id
+        caption = (f"<b>{product.name}</b>\n\nЦена: {product.price} тг.\n\nРазмеры: {', '.join(product.sizes)}")
+        # Кнопки с callback_data в сообщениях из inline-режима не привязаны к чату с ботом,
+        # поэтому заказ идёт через ссылку на бота
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("Открыть в боте", url=product_deep_link(bot_username, product_id)))
+        if product.photo_file_id:
+            results.append(types.InlineQueryResultCachedPhoto(
+                str(product_id), product.photo_file_id, title=product.name, caption=caption, parse_mode='HTML',
+                reply_markup=markup))
+        else:
+            results.append(types.InlineQueryResultArticle(
+                str(product_id), product.name,
+                types.InputTextMessageContent(caption, parse_mode='HTML'),
+                description=f"{product.price} тг.", reply_markup=markup))
+    return results
@@ -0,0 +1,58 @@
+from concurrent.futures import Future
+
+import broadcast
+from broadcast import Broadcaster
+from outbound import SchedulerStopped
+
+
+class FakeScheduler:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+
+    def submit(self, method, chat_id, *args, priority=None, **kwargs):
+        future = Future()
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            future.set_exception(outcome)
+        else:
+            future.set_result(outcome)
+        return future
+
+
+class FakeBot:
+    def send_message(self, chat_id, text):
+        return None
+
+
+def run_broadcast(monkeypatch, outcomes, pages):
+    progress = []
+    finished = []
+    pages = list(pages)
+    monkeypatch.setattr(broadcast, 'scheduler', FakeScheduler(outcomes))
+    monkeypatch.setattr(broadcast, 'get_broadcast_recipients', lambda after, limit: pages.pop(0) if pages else [])
+    monkeypatch.setattr(broadcast, 'save_broadcast_progress', lambda *args: progress.append(args))
+    monkeypatch.setattr(broadcast, 'finish_broadcast', lambda broadcast_id: finished.append(broadcast_id) or (0, 0, 0))
+    Broadcaster(FakeBot(), page_size=3)._run(7, "Скидки", None, 0, None)
+    return progress, finished
+
+
+def test_progress_advances_past_every_delivered_recipient(monkeypatch):
+    progress, finished = run_broadcast(monkeypatch, ['ok', 'ok'], [[(1, 101), (2, 102)]])
+    assert progress == [(7, 2, 2, 0, [])]
+    assert finished == [7]
+
+
+def test_shutdown_keeps_undelivered_recipients_for_resume(monkeypatch):
+    stopped = SchedulerStopped("Outbound scheduler stopped")
+    progress, finished = run_broadcast(monkeypatch, ['ok', stopped, stopped],
+                                       [[(1, 101), (2, 102), (3, 103)]])
+    # Сохранён только первый получатель, рассылка не завершена
+    assert progress == [(7, 1, 1, 0, [])]
+    assert finished == []
+
+
+def test_shutdown_before_any_delivery_saves_nothing(monkeypatch):
+    stopped = SchedulerStopped("Outbound scheduler stopped")
+    progress, finished = run_broadcast(monkeypatch, [stopped, stopped], [[(1, 101), (2, 102)]])
+    assert progress == []
+    assert finished == []
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import pytest
+
+from callbacks import CallbackRouter
+from keyboards import page_direction
+
+
+def handler(call, *args):
+    return args
+
+
+def other_handler(call, *args):
+    return args
+
+
+def test_resolve_converts_arguments():
+    router = CallbackRouter()
+    router.route('add_to_cart', int)(handler)
+    assert router.resolve('add_to_cart_15') == (handler, [15])
+
+
+def test_longest_action_wins():
+    router = CallbackRouter()
+    router.route('order')(handler)
+    router.route('order_0')(other_handler)
+    assert router.resolve('order_0') == (other_handler, [])
+    assert router.resolve('order') == (handler, [])
+
+
+def test_shorter_action_used_when_argument_count_differs():
+    router = CallbackRouter()
+    router.route('product', int)(handler)
+    router.route('product_card', int, int)(other_handler)
+    assert router.resolve('product_7') == (handler, [7])
+    assert router.resolve('product_card_7_2') == (other_handler, [7, 2])
+
+
+def test_unknown_or_malformed_data_is_not_resolved():
+    router = CallbackRouter()
+    router.route('catpage', int, page_direction, int)(handler)
+    assert router.resolve('catpage_3_n_57') == (handler, [3, 'next', 57])
+    assert router.resolve('catpage_3_x_57') is None
+    assert router.resolve('catpage_3_n') is None
+    assert router.resolve('unknown_1') is None
+    assert router.resolve('') is None
+
+
+def test_duplicate_route_is_rejected():
+    router = CallbackRouter()
+    router.route('catalog')(handler)
+    with pytest.raises(ValueError):
+        router.route('catalog')(other_handler)
+
+
+def test_dispatch_answers_every_query():
+    answered = []
+    bot = SimpleNamespace(register_callback_query_handler=lambda *args, **kwargs: None,
+                          answer_callback_query=lambda call_id, text=None, show_alert=False: answered.append(text))
+    router = CallbackRouter()
+    handled = []
+    router.route('view_cart')(lambda call: handled.append(call.data))
+    router.attach(bot)
+
+    router._dispatch(SimpleNamespace(id='1', data='view_cart'))
+    router._dispatch(SimpleNamespace(id='2', data='nonsense'))
+    assert handled == ['view_cart']
+    assert answered == [None, "Неизвестная команда."]
@@ -0,0 +1,170 @@
+from contextlib import contextmanager
+from decimal import Decimal
+
+import pytest
+from psycopg2 import errors, extensions
+
+import database
+from database import _positional, execute_prepared, prepare
+
+
+STATEMENT = prepare('test_user_by_chat', "SELECT id FROM users WHERE chat_id = %s AND name = %s")
+
+
+class FakeConnection:
+    autocommit = False
+
+    def __init__(self):
+        self.prepared_statements = set()
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeCursor:
+    """Записывает выполненные команды; failures - ошибки для первых команд с данным префиксом."""
+
+    def __init__(self, connection, failures=None):
+        self.connection = connection
+        self.failures = dict(failures or {})
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append(query.split(' AS ')[0])
+        self.connection.status = extensions.TRANSACTION_STATUS_INTRANS
+        for prefix, error in list(self.failures.items()):
+            if query.startswith(prefix):
+                del self.failures[prefix]
+                raise error
+
+
+def test_positional_numbers_placeholders_in_order():
+    assert _positional("a = %s AND b = %s LIMIT %s") == "a = $1 AND b = $2 LIMIT $3"
+    assert _positional("SELECT 1") == "SELECT 1"
+
+
+def test_prepares_once_per_connection():
+    connection = FakeConnection()
+    cursor = FakeCursor(connection)
+    execute_prepared(cursor, STATEMENT, (1, 'a'))
+    execute_prepared(cursor, STATEMENT, (2, 'b'))
+    assert cursor.executed.count(f"PREPARE {STATEMENT}") == 1
+    assert cursor.executed.count(f"EXECUTE {STATEMENT} (%s, %s)") == 2
+    assert STATEMENT in connection.prepared_statements
+
+
+def test_duplicate_prepare_deallocates_and_prepares_again():
+    cursor = FakeCursor(FakeConnection(), {"PREPARE": errors.DuplicatePreparedStatement()})
+    execute_prepared(cursor, STATEMENT, (1, 'a'))
+    assert cursor.executed == [
+        "SAVEPOINT prepare_statement", f"PREPARE {STATEMENT}", "ROLLBACK TO SAVEPOINT prepare_statement",
+        f"DEALLOCATE {STATEMENT}", f"PREPARE {STATEMENT}", "RELEASE SAVEPOINT prepare_statement",
+        f"EXECUTE {STATEMENT} (%s, %s)",
+    ]
+
+
+def test_stale_plan_is_deallocated_and_retried_once():
+    connection = FakeConnection()
+    connection.prepared_statements.add(STATEMENT)
+    stale = errors.FeatureNotSupported("cached plan must not change result type")
+    cursor = FakeCursor(connection, {"EXECUTE": stale})
+    execute_prepared(cursor, STATEMENT, (1, 'a'))
+    assert connection.rollbacks == 1
+    assert cursor.executed[1:] == [
+        f"DEALLOCATE {STATEMENT}", "SAVEPOINT prepare_statement", f"PREPARE {STATEMENT}",
+        "RELEASE SAVEPOINT prepare_statement", f"EXECUTE {STATEMENT} (%s, %s)",
+    ]
+
+
+def test_forgotten_statement_is_prepared_again_and_others_are_kept():
+    connection = FakeConnection()
+    connection.prepared_statements.update({STATEMENT, 'other'})
+    cursor = FakeCursor(connection, {"EXECUTE": errors.InvalidSqlStatementName()})
+    execute_prepared(cursor, STATEMENT, (1, 'a'))
+    assert f"DEALLOCATE {STATEMENT}" not in cursor.executed
+    assert cursor.executed.count(f"PREPARE {STATEMENT}") == 1
+    assert connection.prepared_statements == {STATEMENT, 'other'}
+
+
+def test_error_inside_open_transaction_is_raised_without_retry():
+    connection = FakeConnection()
+    connection.prepared_statements.update({STATEMENT, 'other'})
+    connection.status = extensions.TRANSACTION_STATUS_INTRANS
+    stale = errors.FeatureNotSupported("cached plan must not change result type")
+    cursor = FakeCursor(connection, {"EXECUTE": stale})
+    with pytest.raises(errors.FeatureNotSupported):
+        execute_prepared(cursor, STATEMENT, (1, 'a'))
+    assert connection.rollbacks == 0
+    assert connection.prepared_statements == {'other'}
+
+
+def test_other_feature_errors_are_not_retried():
+    connection = FakeConnection()
+    connection.prepared_statements.add(STATEMENT)
+    cursor = FakeCursor(connection, {"EXECUTE": errors.FeatureNotSupported("something else")})
+    with pytest.raises(errors.FeatureNotSupported):
+        execute_prepared(cursor, STATEMENT, (1, 'a'))
+    assert connection.prepared_statements == {STATEMENT}
+
+
+def test_plain_execute_when_disabled(monkeypatch):
+    monkeypatch.setattr(database, 'DB_PREPARED_STATEMENTS', False)
+    cursor = FakeCursor(FakeConnection())
+    execute_prepared(cursor, STATEMENT, (1, 'a'))
+    assert cursor.executed == ["SELECT id FROM users WHERE chat_id = %s AND name = %s"]
+
+
+class OrderCursor:
+    """Курсор place_order: корзина из двух заблокированных строк, обе попадают в заказ."""
+
+    def __init__(self):
+        self.executed = []
+        self.results = [
+            [(11,), (12,)],
+            [(7,)],
+            [("Кеды", 1, Decimal("4990.00")), ("Худи", 2, Decimal("3500.50"))],
+        ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, params=None):
+        self.executed.append((' '.join(query.split()), params))
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+    def fetchone(self):
+        return self.results.pop(0)[0]
+
+
+def test_place_order_totals_written_lines_and_deletes_only_locked_cart_rows(monkeypatch):
+    cursor = OrderCursor()
+
+    class Connection:
+        def cursor(self):
+            return cursor
+
+    @contextmanager
+    def get_connection():
+        yield Connection()
+
+    monkeypatch.setattr(database, 'get_connection', get_connection)
+    notified = []
+    order_id = database.place_order(5, {'name': "Аня", 'address': "Алматы", 'phone': "+7"},
+                                    lambda *args: notified.append(args) or [])
+    assert order_id == 7
+    total = Decimal("11991.00")
+    lines = [("Кеды", 1, Decimal("4990.00")), ("Худи", 2, Decimal("3500.50"))]
+    assert notified == [(7, lines, total)]
+    assert ("UPDATE orders SET total_amount = %s WHERE id = %s", (total, 7)) in cursor.executed
+    assert ("DELETE FROM carts WHERE id = ANY(%s)", ([11, 12],)) in cursor.executed
@@ -0,0 +1,47 @@
+import threading
+from types import SimpleNamespace
+
+from dispatcher import ChatOrderedDispatcher, get_update_chat_id
+
+
+def make_update(update_id, chat_id):
+    return SimpleNamespace(update_id=update_id, message=SimpleNamespace(chat=SimpleNamespace(id=chat_id)))
+
+
+def test_get_update_chat_id_uses_message_chat():
+    assert get_update_chat_id(make_update(1, 42)) == 42
+
+
+def test_updates_of_one_chat_are_handled_in_order():
+    handled = []
+    dispatcher = ChatOrderedDispatcher(lambda update: handled.append(update.update_id), workers=4,
+                                       queue_size=100)
+    dispatcher.start()
+    for update_id in range(50):
+        dispatcher.submit(make_update(update_id, 7))
+    dispatcher.stop()
+    assert handled == list(range(50))
+
+
+def test_slow_chat_does_not_block_other_chats():
+    release = threading.Event()
+    fast_done = threading.Event()
+
+    def handler(update):
+        if update.message.chat.id == 1:
+            assert release.wait(5)
+        else:
+            fast_done.set()
+
+    # Два воркера: при шардировании по hash(chat_id) чаты 1 и 3 попали бы на один воркер
+    dispatcher = ChatOrderedDispatcher(handler, workers=2, queue_size=100)
+    dispatcher.start()
+    dispatcher.submit(make_update(1, 1))
+    dispatcher.submit(make_update(2, 1))
+    dispatcher.submit(make_update(3, 3))
+    try:
+        assert fast_done.wait(2)
+    finally:
+        release.set()
+        dispatcher.stop()
+    assert dispatcher.qsize() == 0
@@ -0,0 +1,40 @@
+from fsm import MemoryStateStorage, StateMachine
+
+
+def test_memory_storage_returns_saved_state():
+    storage = MemoryStateStorage(max_sessions=10, ttl=60)
+    storage.set(1, 'checkout:name', {'receipt_photo': 'abc'})
+    assert storage.get(1) == ('checkout:name', {'receipt_photo': 'abc'})
+    storage.delete(1)
+    assert storage.get(1) is None
+
+
+def test_memory_storage_expires_sessions_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('fsm.time.monotonic', lambda: now[0])
+    storage = MemoryStateStorage(max_sessions=10, ttl=60)
+    storage.set(1, 'checkout:phone', {})
+    now[0] += 59
+    assert storage.get(1) == ('checkout:phone', {})
+    now[0] += 61
+    assert storage.get(1) is None
+
+
+def test_memory_storage_evicts_least_recently_used():
+    storage = MemoryStateStorage(max_sessions=2, ttl=60)
+    storage.set(1, 'a', {})
+    storage.set(2, 'b', {})
+    # Чтение делает сессию 1 самой свежей - вытесняется 2
+    storage.get(1)
+    storage.set(3, 'c', {})
+    assert storage.get(1) == ('a', {})
+    assert storage.get(2) is None
+    assert storage.get(3) == ('c', {})
+
+
+def test_state_machine_keeps_state_until_finish():
+    machine = StateMachine(MemoryStateStorage(max_sessions=10, ttl=60))
+    machine.set_state(1, 'checkout:phone', {'address': 'Абая 1'})
+    assert machine.get_state(1) == ('checkout:phone', {'address': 'Абая 1'})
+    machine.finish(1)
+    assert machine.get_state(1) is None
@@ -0,0 +1,33 @@
+import io
+import os
+
+from PIL import Image
+
+import images
+from images import ImagePipeline
+
+
+def make_png(size):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def test_pipeline_stores_one_file_per_content_and_reports_saved_bytes(tmp_path, monkeypatch):
+    monkeypatch.setattr(images, 'PHOTOS_DIR', str(tmp_path))
+    pipeline = ImagePipeline(workers=1)
+    try:
+        data = make_png((3000, 2000))
+        first = pipeline.submit(data).result()
+        second = pipeline.submit(data).result()
+    finally:
+        pipeline.shutdown()
+
+    assert first.filename == second.filename
+    assert os.listdir(tmp_path) == [first.filename]
+    with Image.open(tmp_path / first.filename) as stored:
+        assert max(stored.size) == images.IMAGE_MAX_SIZE
+
+    stats = pipeline.stats()
+    assert stats['images'] == 2
+    assert stats['saved_bytes'] == stats['original_bytes'] - stats['stored_bytes']
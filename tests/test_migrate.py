@@ -0,0 +1,26 @@
+import database
+import migrate
+import repository
+from database import statement_text
+
+
+def test_hot_queries_have_a_parameter_for_every_placeholder():
+    for description, query, params, index in migrate.HOT_QUERIES:
+        assert query.count('%s') == len(params), description
+
+
+def test_cart_check_uses_the_query_the_bot_runs():
+    queries = {description: query for description, query, _, _ in migrate.HOT_QUERIES}
+    assert queries["cart items"] == statement_text(repository.CART_BY_USER)
+
+
+def test_every_checked_query_is_a_statement_the_bot_runs():
+    statements = set(database._statements.values())
+    statements.update(value for value in vars(database).values() if isinstance(value, str))
+    for description, query, _, _ in migrate.HOT_QUERIES:
+        assert query in statements, description
+
+
+def test_migrations_are_numbered_without_gaps():
+    versions = [version for version, _, _ in migrate.load_migrations()]
+    assert versions == list(range(1, len(versions) + 1))
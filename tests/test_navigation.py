@@ -0,0 +1,95 @@
+import asyncio
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from navigation import show_text, show_text_steps, run_steps_async
+
+
+def api_error(description):
+    return ApiTelegramException('editMessageText', None, {'error_code': 400, 'description': description})
+
+
+def make_call(content_type='text'):
+    message = SimpleNamespace(chat=SimpleNamespace(id=1), message_id=10, content_type=content_type)
+    return SimpleNamespace(message=message)
+
+
+class FakeBot:
+    def __init__(self, edit_error=None):
+        self.edit_error = edit_error
+        self.calls = []
+
+    def edit_message_text(self, text, **kwargs):
+        self.calls.append('edit_message_text')
+        if self.edit_error:
+            raise self.edit_error
+        return 'edited'
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.calls.append('send_message')
+        return 'sent'
+
+
+class AsyncFakeBot(FakeBot):
+    async def edit_message_text(self, text, **kwargs):
+        return FakeBot.edit_message_text(self, text, **kwargs)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return FakeBot.send_message(self, chat_id, text, **kwargs)
+
+
+def test_show_text_edits_text_message():
+    bot = FakeBot()
+    assert show_text(bot, make_call(), "Каталог").result() == 'edited'
+    assert bot.calls == ['edit_message_text']
+
+
+def test_show_text_sends_new_message_for_photo():
+    bot = FakeBot()
+    assert show_text(bot, make_call('photo'), "Каталог").result() == 'sent'
+    assert bot.calls == ['send_message']
+
+
+def test_show_text_ignores_not_modified():
+    bot = FakeBot(api_error("Bad Request: message is not modified"))
+    call = make_call()
+    assert show_text(bot, call, "Каталог").result() is call.message
+
+
+def test_show_text_falls_back_to_send_when_edit_rejected():
+    bot = FakeBot(api_error("Bad Request: message can't be edited"))
+    assert show_text(bot, make_call(), "Каталог").result() == 'sent'
+    assert bot.calls == ['edit_message_text', 'send_message']
+
+
+def test_steps_continue_when_scheduled_request_completes():
+    # Бот с планировщиком возвращает Future: следующий шаг выполняется после его завершения
+    pending = Future()
+
+    class ScheduledBot(FakeBot):
+        def edit_message_text(self, text, **kwargs):
+            self.calls.append('edit_message_text')
+            return pending
+
+    bot = ScheduledBot()
+    outcome = show_text(bot, make_call(), "Каталог")
+    assert not outcome.done()
+    pending.set_exception(api_error("Bad Request: message can't be edited"))
+    assert outcome.result() == 'sent'
+    assert bot.calls == ['edit_message_text', 'send_message']
+
+
+def test_show_text_reraises_other_errors():
+    bot = FakeBot(RuntimeError("network"))
+    with pytest.raises(RuntimeError):
+        show_text(bot, make_call(), "Каталог").result()
+
+
+def test_async_runner_executes_same_steps():
+    bot = AsyncFakeBot(api_error("Bad Request: message can't be edited"))
+    result = asyncio.run(run_steps_async(bot, show_text_steps(make_call(), "Каталог")))
+    assert result == 'sent'
+    assert bot.calls == ['edit_message_text', 'send_message']
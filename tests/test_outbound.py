@@ -0,0 +1,172 @@
+import asyncio
+import io
+import threading
+import time
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from outbound import OutboundScheduler, SchedulerStopped, TokenBucket, unwrap, wait
+
+
+def test_token_bucket_allows_burst_then_waits_for_refill():
+    bucket = TokenBucket(rate=1, capacity=3)
+    now = bucket.updated_at
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.consume()
+    assert bucket.delay(now) == pytest.approx(1)
+    assert bucket.delay(now + 0.5) == pytest.approx(0.5)
+    assert bucket.delay(now + 1) == 0
+
+
+def test_token_bucket_respects_retry_after_block():
+    bucket = TokenBucket(rate=10, capacity=10)
+    now = bucket.updated_at
+    bucket.blocked_until = now + 5
+    assert bucket.delay(now) == pytest.approx(5)
+    assert not bucket.is_idle(now)
+    assert bucket.delay(now + 5) == 0
+
+
+def make_scheduler(chat_rate=100, max_retries=0):
+    return OutboundScheduler(global_rate=1000, chat_rate=chat_rate, chat_burst=1, group_rate=100, group_burst=1,
+                             workers=4, max_retries=max_retries)
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def send_message(self, chat_id, text):
+        assert self.release.wait(5)
+        self.sent.append((chat_id, text))
+        return text
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, reply_markup=None):
+        self.sent.append((chat_id, text))
+        return text
+
+    def __getattr__(self, name):
+        # Остальные отправляющие методы, которые подменяет install()
+        return lambda *args, **kwargs: None
+
+
+def test_installed_methods_return_future_without_blocking():
+    bot = FakeBot()
+    bot.release.clear()
+    scheduler = make_scheduler().install(bot)
+    try:
+        started_at = time.monotonic()
+        future = bot.send_message(1, "привет")
+        assert time.monotonic() - started_at < 0.5
+        assert not future.done()
+        bot.release.set()
+        assert wait(future) == "привет"
+        assert unwrap(bot.send_message).__name__ == 'send_message'
+    finally:
+        bot.release.set()
+        scheduler.stop()
+
+
+def test_throttled_chat_does_not_delay_other_chats():
+    bot = FakeBot()
+    # Один токен на чат в 10 секунд: второе сообщение в чат 1 ждёт, чат 2 - нет
+    scheduler = make_scheduler(chat_rate=0.1).install(bot)
+    try:
+        bot.send_message(1, "первое").result(timeout=2)
+        throttled = bot.send_message(1, "второе")
+        other = bot.send_message(2, "другой чат")
+        assert other.result(timeout=2) == "другой чат"
+        assert not throttled.done()
+    finally:
+        scheduler.stop()
+
+
+def test_edits_with_same_text_to_different_chats_do_not_throttle_each_other():
+    bot = FakeBot()
+    scheduler = make_scheduler(chat_rate=0.1).install(bot)
+    try:
+        futures = [bot.edit_message_text("Что будем покупать?", chat_id, 1) for chat_id in range(100, 105)]
+        for future in futures:
+            future.result(timeout=2)
+        assert sorted(chat_id for chat_id, _ in bot.sent) == list(range(100, 105))
+    finally:
+        scheduler.stop()
+
+
+def test_messages_of_one_chat_keep_order():
+    bot = FakeBot()
+    scheduler = make_scheduler(chat_rate=1000).install(bot)
+    try:
+        futures = [bot.send_message(1, str(number)) for number in range(20)]
+        for future in futures:
+            future.result(timeout=5)
+        assert [text for _, text in bot.sent] == [str(number) for number in range(20)]
+    finally:
+        scheduler.stop()
+
+
+def test_submit_after_stop_raises_and_pending_jobs_fail():
+    bot = FakeBot()
+    scheduler = make_scheduler(chat_rate=0.1).install(bot)
+    bot.send_message(1, "первое").result(timeout=2)
+    pending = bot.send_message(1, "второе")
+    scheduler.stop()
+    with pytest.raises(SchedulerStopped):
+        pending.result(timeout=2)
+    with pytest.raises(SchedulerStopped):
+        bot.send_message(1, "после остановки")
+
+
+def test_retry_after_429_uploads_the_whole_file_again():
+    uploads = []
+
+    def send_photo(chat_id, photo):
+        uploads.append(photo.read())
+        if len(uploads) == 1:
+            raise ApiTelegramException('sendPhoto', None, {
+                'error_code': 429, 'description': 'Too Many Requests', 'parameters': {'retry_after': 0},
+            })
+        return len(uploads)
+
+    scheduler = make_scheduler(max_retries=1)
+    scheduler.start()
+    try:
+        assert scheduler.submit(send_photo, 1, io.BytesIO(b"jpeg")).result(timeout=2) == 2
+        assert uploads == [b"jpeg", b"jpeg"]
+    finally:
+        scheduler.stop()
+
+
+class FakeAsyncBot:
+    def __init__(self):
+        self.sent = []
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, reply_markup=None):
+        self.sent.append((chat_id, text))
+        return text
+
+    def __getattr__(self, name):
+        async def method(*args, **kwargs):
+            return None
+        return method
+
+
+def test_async_bot_sends_go_through_the_scheduler():
+    bot = FakeAsyncBot()
+    scheduler = make_scheduler(chat_rate=0.1)
+
+    async def main():
+        scheduler.install_async(bot)
+        return await asyncio.gather(*(bot.edit_message_text("Выберите товар:", chat_id, 1)
+                                      for chat_id in (100, 101)))
+
+    try:
+        assert asyncio.run(asyncio.wait_for(main(), 2)) == ["Выберите товар:"] * 2
+        assert scheduler.stats()['sent'] == 2
+        assert sorted(chat_id for chat_id, _ in bot.sent) == [100, 101]
+    finally:
+        scheduler.stop()
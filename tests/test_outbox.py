@@ -0,0 +1,39 @@
+from outbox import build_batches, MESSAGE_LIMIT
+
+
+def claimed(message_id, chat_id, kind, payload):
+    return message_id, chat_id, kind, payload, 0
+
+
+def test_single_text_is_sent_as_is():
+    batches = build_batches([claimed(1, -100, 'text', {'text': "Заказ #1"})])
+    assert batches == [(-100, 'text', {'text': "Заказ #1"}, [1])]
+
+
+def test_texts_for_one_chat_become_a_digest_before_photos():
+    batches = build_batches([
+        claimed(1, -100, 'text', {'text': "Заказ #1"}),
+        claimed(2, -100, 'photo', {'photo': 'file', 'caption': "Чек"}),
+        claimed(3, -100, 'text', {'text': "Заказ #2"}),
+    ])
+    assert [(kind, ids) for _, kind, _, ids in batches] == [('text', [1, 3]), ('photo', [2])]
+    digest = batches[0][2]['text']
+    assert digest.startswith("Новых уведомлений: 2")
+    assert digest.index("Заказ #1") < digest.index("Заказ #2")
+
+
+def test_digest_is_split_at_message_limit():
+    text = "x" * 1500
+    batches = build_batches([claimed(number, -100, 'text', {'text': text}) for number in range(1, 6)])
+    assert [ids for _, _, _, ids in batches] == [[1, 2], [3, 4], [5]]
+    for _, _, payload, _ in batches:
+        assert len(payload['text']) <= MESSAGE_LIMIT
+
+
+def test_chats_are_digested_separately():
+    batches = build_batches([
+        claimed(1, -100, 'text', {'text': "a"}),
+        claimed(2, -200, 'text', {'text': "b"}),
+        claimed(3, -100, 'text', {'text': "c"}),
+    ])
+    assert sorted((chat_id, ids) for chat_id, _, _, ids in batches) == [(-200, [2]), (-100, [1, 3])]
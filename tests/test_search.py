@@ -0,0 +1,52 @@
+from decimal import Decimal
+
+from repository import Category, Product
+from search import SearchIndex, tokenize
+
+
+def product(product_id, name, category_id=1):
+    return Product(product_id, name, category_id, Decimal('1000'), (), 'photo.jpg', None)
+
+
+CATEGORIES = [Category(1, 'Кроссовки'), Category(2, 'Футболки')]
+
+
+def test_tokenize_lowercases_and_folds_yo():
+    assert tokenize("Чёрные Nike-AIR") == ['черные', 'nike', 'air']
+
+
+def test_whole_word_in_name_ranks_above_prefix_and_category():
+    index = SearchIndex([
+        product(1, "Кроссовки Nike Air Max"),
+        product(2, "Nikelab runner"),
+        product(3, "Adidas Superstar"),
+    ], CATEGORIES)
+    # Целое слово в названии, затем префикс; Adidas совпадает только по категории - его нет в выдаче
+    assert index.search("nike", 10) == [1, 2]
+    assert index.search("кроссовки", 10) == [1, 2, 3]
+
+
+def test_every_query_word_must_match():
+    index = SearchIndex([
+        product(1, "Nike Air Max"),
+        product(2, "Nike Dunk"),
+        product(3, "Футболка Nike", category_id=2),
+    ], CATEGORIES)
+    assert index.search("nike футб", 10) == [3]
+    assert index.search("nike max", 10) == [1]
+    assert index.search("reebok", 10) == []
+
+
+def test_shorter_name_wins_within_rank_and_limit_applies():
+    index = SearchIndex([
+        product(1, "Nike Air Max 90 Premium"),
+        product(2, "Nike Air"),
+        product(3, "Nike Air Max"),
+    ], CATEGORIES)
+    assert index.search("nike air", 10) == [2, 3, 1]
+    assert index.search("nike air", 2) == [2, 3]
+
+
+def test_empty_query_returns_nothing():
+    index = SearchIndex([product(1, "Nike")], CATEGORIES)
+    assert index.search("  ", 10) == []
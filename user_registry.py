@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+
+from config import USER_CACHE_SIZE
+from database import get_user_id, upsert_user
+
+
+# --------------------------------------------------------------------------------------------------------
+# Кэш зарегистрированных пользователей: chat_id -> users.id.
+#
+# /start регистрирует пользователя одним upsert-запросом, а обработчики корзины и заказов получают
+# users.id из памяти и обращаются к базе только при промахе кэша.
+
+class UserRegistry:
+    def __init__(self, max_size):
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_size = max_size
+
+    def get(self, chat_id):
+        with self._lock:
+            user_id = self._cache.get(chat_id)
+            if user_id is not None:
+                self._cache.move_to_end(chat_id)
+            return user_id
+
+    def put(self, chat_id, user_id):
+        with self._lock:
+            self._cache[chat_id] = user_id
+            self._cache.move_to_end(chat_id)
+            while len(self._cache) > self._max_size:
+                self._cache.popitem(last=False)
+
+    def forget(self, chat_id):
+        with self._lock:
+            self._cache.pop(chat_id, None)
+
+    def register(self, chat):
+        user_id = upsert_user(chat.id, chat.username, chat.first_name, chat.last_name)
+        self.put(chat.id, user_id)
+        return user_id
+
+    def resolve(self, chat_id):
+        """Возвращает users.id или None, если пользователь ещё не нажимал /start."""
+        user_id = self.get(chat_id)
+        if user_id is None:
+            user_id = get_user_id(chat_id)
+            # Незарегистрированных не кэшируем, чтобы /start на другой реплике сразу подхватился
+            if user_id is not None:
+                self.put(chat_id, user_id)
+        return user_id
+
+
+users = UserRegistry(USER_CACHE_SIZE)
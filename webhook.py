@@ -0,0 +1,117 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+
+# --------------------------------------------------------------------------------------------------------
+# Приём апдейтов через webhook.
+#
+# Telegram отправляет апдейты POST-запросами. Сервер проверяет секретный токен, кладёт апдейт
+# в ограниченную очередь и сразу отвечает 200; обработку выполняет отдельный поток через
+# bot.process_new_updates (а значит, через пул воркеров из dispatcher.py, если он установлен).
+# Если очередь переполнена, отвечаем 503 - Telegram повторит доставку позже.
+#
+# Локальная проверка:
+#   curl -X POST http://127.0.0.1:8443/webhook \
+#        -H "X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET_TOKEN>" \
+#        -H "Content-Type: application/json" -d @update.json
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class _WebhookRequestHandler(BaseHTTPRequestHandler):
+    server_version = "PandaShopBot"
+
+    def do_POST(self):
+        webhook = self.server.webhook
+
+        if self.path != webhook.path:
+            self._reply(404)
+            return
+
+        if webhook.secret_token:
+            received = self.headers.get(SECRET_TOKEN_HEADER, '')
+            if not hmac.compare_digest(received.encode(), webhook.secret_token.encode()):
+                logging.warning("Webhook request with invalid secret token from %s", self.client_address[0])
+                self._reply(403)
+                return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = 0
+        if length <= 0 or length > MAX_BODY_SIZE:
+            self._reply(400)
+            return
+
+        body = self.rfile.read(length)
+        try:
+            update = types.Update.de_json(body.decode('utf-8'))
+        except (ValueError, KeyError, json.JSONDecodeError) as error:
+            logging.warning("Malformed webhook update: %s", error)
+            self._reply(400)
+            return
+
+        if not webhook.enqueue(update):
+            self._reply(503)
+            return
+        self._reply(200)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logging.debug("Webhook %s - %s", self.client_address[0], format % args)
+
+
+class WebhookServer:
+    def __init__(self, bot, host, port, path, secret_token, queue_size, enqueue_timeout=1.0):
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._enqueue_timeout = enqueue_timeout
+        self._httpd = ThreadingHTTPServer((host, port), _WebhookRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.webhook = self
+        self._consumer = None
+
+    def enqueue(self, update):
+        try:
+            self._queue.put(update, timeout=self._enqueue_timeout)
+            return True
+        except queue.Full:
+            logging.warning("Webhook queue is full, update %s rejected", update.update_id)
+            return False
+
+    def serve_forever(self):
+        self._consumer = threading.Thread(target=self._consume, name="WebhookConsumer", daemon=True)
+        self._consumer.start()
+        host, port = self._httpd.server_address[:2]
+        logging.info("Webhook server listening on %s:%s%s", host, port, self.path)
+        self._httpd.serve_forever()
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._queue.put(None)
+        if self._consumer is not None:
+            self._consumer.join()
+
+    def _consume(self):
+        while True:
+            update = self._queue.get()
+            if update is None:
+                return
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as error:
+                logging.exception("Error while processing webhook update: %s", error)